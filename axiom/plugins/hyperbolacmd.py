@@ -0,0 +1,125 @@
+# -*- test-case-name: hyperbola.test.test_hyperbolacmd -*-
+# Copyright 2008 Divmod, Inc.
+# See LICENSE file for details
+
+"""
+Axiomatic commands for maintaining Hyperbola blogs.
+"""
+
+import sys
+
+from axiom.scripts import axiomatic
+from axiom.substore import SubStore
+
+from hyperbola.hyperblurb import Blurb, CHUNK_SIZE, normalizeBodies
+from hyperbola.archive import exportBlurbs, importBlurbs
+
+
+class Normalize(axiomatic.AxiomaticSubCommand):
+    """
+    Command for normalizing the bodies of blurbs which were posted before
+    their normalized bodies were stored, in a store and every store inside
+    it.
+    """
+    optFlags = [
+        ('all', 'a', 'Normalize every body, not only those which have never '
+         'been normalized.'),
+        ]
+
+    optParameters = [
+        ('batch-size', 'b', CHUNK_SIZE,
+         'The number of blurbs to normalize in each transaction.', int),
+        ]
+
+    def postOptions(self):
+        """
+        Normalize the bodies of the blurbs in the store and its substores.
+        """
+        stores = [self.store] + [
+            substore.open() for substore in self.store.query(SubStore)]
+        count = 0
+        for store in stores:
+            count += normalizeBodies(
+                store, self['all'], self['batch-size'])
+        print 'Normalized %d blurbs.' % (count,)
+
+
+
+class Export(axiomatic.AxiomaticSubCommand):
+    """
+    Command for writing blogs out of a store as JSON Lines, as
+    L{exportBlurbs} does.
+    """
+    optParameters = [
+        ('output', 'o', '-',
+         'The file to write to, or - for standard output.'),
+        ('blurb', 'b', None,
+         'The storeID of the blurb to export, with its descendants.  By '
+         'default, every top-level blurb is exported.', int),
+        ]
+
+    def postOptions(self):
+        """
+        Write the blurbs out.
+        """
+        store = self.store
+        if self['blurb'] is None:
+            blurbs = store.query(Blurb, Blurb.parent == None,
+                                 sort=Blurb.storeID.ascending)
+        else:
+            blurbs = [store.getItemByID(self['blurb'])]
+        if self['output'] == '-':
+            output = sys.stdout
+        else:
+            output = file(self['output'], 'wb')
+        try:
+            for blurb in blurbs:
+                output.writelines(exportBlurbs(blurb))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+
+
+class Import(axiomatic.AxiomaticSubCommand):
+    """
+    Command for reading blogs written by L{Export} into a store, as
+    L{importBlurbs} does.
+    """
+    optParameters = [
+        ('input', 'i', '-',
+         'The file to read from, or - for standard input.'),
+        ('batch-size', 'b', CHUNK_SIZE,
+         'The number of lines to import in each transaction.', int),
+        ]
+
+    def postOptions(self):
+        """
+        Read the blurbs in.
+        """
+        if self['input'] == '-':
+            input = sys.stdin
+        else:
+            input = file(self['input'], 'rb')
+        try:
+            count = importBlurbs(self.store, input, self['batch-size'])
+        finally:
+            if input is not sys.stdin:
+                input.close()
+        print 'Imported %d blurbs.' % (count,)
+
+
+
+class HyperbolaCommand(axiomatic.AxiomaticCommand):
+    name = 'hyperbola'
+    description = 'Maintain Hyperbola blogs.'
+
+    subCommands = [
+        ('normalize', None, Normalize,
+         'Store normalized bodies for blurbs which lack them.'),
+        ('export', None, Export, 'Write blogs out as JSON Lines.'),
+        ('import', None, Import, 'Read blogs in from JSON Lines.'),
+        ]
+
+    def getStore(self):
+        return self.parent.getStore()
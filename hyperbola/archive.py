@@ -0,0 +1,376 @@
+# -*- test-case-name: hyperbola.test.test_archive -*-
+
+"""
+This module moves trees of blurbs into and out of stores as JSON Lines: one
+JSON object on each line, for a blurb, a past version of a blurb or a
+flavor permission.  L{exportBlurbs} writes a tree a chunk at a time and
+L{importBlurbs} reads one a batch of lines at a time, so that neither needs
+to hold a whole blog in memory.
+
+Every record has a C{type}: C{"blurb"}, C{"version"} or C{"permission"}.
+Blurbs are identified within the stream by an C{id}, which is their storeID
+in the store they were exported from, and refer to their parent by it.  A
+blurb always comes after its parent, and is followed by its past versions,
+oldest first, and by its flavor permissions.  Roles are identified by their
+external IDs, times are POSIX timestamps and interfaces are fully qualified
+names.  Shares keep their share IDs, so that links to the imported blurbs
+still work.
+"""
+
+from json import dumps, loads
+from itertools import islice
+
+from twisted.python.reflect import qual, namedAny
+
+from epsilon.extime import Time
+
+from axiom.item import Item
+from axiom.attributes import AND, OR, integer, reference
+from axiom.tags import Catalog
+
+from xmantissa.sharing import (
+    Role, Share, getEveryoneRole, getAuthenticatedRole)
+
+from hyperbola.hyperblurb import (
+    Blurb, BlurbAncestor, PastBlurb, FlavorPermission, CHUNK_SIZE,
+    _encodeRevision, _applyDelta)
+from hyperbola.normalize import normalize
+
+
+
+def _dumpTime(time):
+    """
+    @type time: L{Time} or C{None}
+    @rtype: C{float} or C{None}
+    """
+    if time is None:
+        return None
+    return time.asPOSIXTimestamp()
+
+
+
+def _loadTime(timestamp):
+    """
+    @type timestamp: C{float} or C{None}
+    @rtype: L{Time} or C{None}
+    """
+    if timestamp is None:
+        return None
+    return Time.fromPOSIXTimestamp(timestamp)
+
+
+
+def _subtree(blurb):
+    """
+    Collect a blurb and its descendants, shallowest first, loading
+    L{CHUNK_SIZE} of them from the store at a time.
+
+    @type blurb: L{Blurb}
+    @return: an iterable of L{Blurb}s.
+    """
+    store = blurb.store
+    comparison = BlurbAncestor.ancestor == blurb
+    while True:
+        links = list(store.query(
+            BlurbAncestor,
+            comparison,
+            sort=(BlurbAncestor.depth.ascending +
+                  BlurbAncestor.descendant.ascending),
+            limit=CHUNK_SIZE))
+        if not links:
+            return
+        for link in links:
+            yield link.descendant
+        last = links[-1]
+        comparison = AND(
+            BlurbAncestor.ancestor == blurb,
+            OR(BlurbAncestor.depth > last.depth,
+               AND(BlurbAncestor.depth == last.depth,
+                   BlurbAncestor.descendant > last.descendant)))
+
+
+
+def _blurbRecords(blurb):
+    """
+    Describe a blurb, its past versions and its flavor permissions.
+
+    @type blurb: L{Blurb}
+    @return: an iterable of C{dict}s.
+    """
+    store = blurb.store
+    parent = blurb.parent
+    yield {
+        u'type': u'blurb',
+        u'id': blurb.storeID,
+        u'parent': parent and parent.storeID,
+        u'flavor': blurb.flavor,
+        u'title': blurb.title,
+        u'body': blurb.body,
+        u'author': blurb.author.externalID,
+        u'hits': blurb.hits,
+        u'dateCreated': _dumpTime(blurb.dateCreated),
+        u'dateLastEdited': _dumpTime(blurb.dateLastEdited),
+        u'tags': sorted(blurb.tags()),
+        u'shares': [
+            {u'role': share.sharedTo.externalID,
+             u'shareID': share.shareID,
+             u'interfaces': [qual(interface).decode('ascii')
+                             for interface in share.sharedInterfaces]}
+            for share in store.query(
+                Share, Share.sharedItem == blurb,
+                sort=Share.storeID.ascending)]}
+
+    # Rebuild the bodies of the past versions newest first, since each may
+    # be stored as a delta from the next, but write them oldest first.
+    versions = []
+    body = blurb.body
+    for version in store.query(PastBlurb, PastBlurb.blurb == blurb,
+                               sort=PastBlurb.storeID.descending):
+        if version.bodyDelta is None:
+            body = version.body
+        else:
+            body = _applyDelta(body, version.bodyDelta)
+        versions.append({
+            u'type': u'version',
+            u'blurb': blurb.storeID,
+            u'title': version.title,
+            u'body': body,
+            u'author': version.author.externalID,
+            u'hits': version.hits,
+            u'dateEdited': _dumpTime(version.dateEdited),
+            u'tags': sorted(store.findOrCreate(Catalog).tagsOf(version))})
+    for version in reversed(versions):
+        yield version
+
+    for permission in store.query(FlavorPermission,
+                                  FlavorPermission.blurb == blurb,
+                                  sort=FlavorPermission.storeID.ascending):
+        yield {
+            u'type': u'permission',
+            u'blurb': blurb.storeID,
+            u'flavor': permission.flavor,
+            u'role': permission.role.externalID,
+            u'permissions': permission.permissions}
+
+
+
+def exportBlurbs(blurb):
+    """
+    Describe a blurb and all of its descendants as JSON Lines.
+
+    @type blurb: L{Blurb}
+
+    @return: an iterable of C{str}s, each a line of JSON ending in a newline.
+    """
+    for descendant in _subtree(blurb):
+        for record in _blurbRecords(descendant):
+            yield dumps(record, separators=(',', ':')) + '\n'
+
+
+
+# Roles which must be members of other roles, and so cannot simply be
+# created by their external IDs.
+_SPECIAL_ROLES = {
+    u'Everyone': getEveryoneRole,
+    u'Authenticated': getAuthenticatedRole}
+
+
+
+def _getRole(store, externalID):
+    """
+    Find or create the role with a particular external ID.
+
+    @type store: L{axiom.store.Store}
+    @type externalID: C{unicode}
+    @rtype: L{Role}
+    """
+    if externalID in _SPECIAL_ROLES:
+        return _SPECIAL_ROLES[externalID](store)
+    return store.findOrCreate(Role, externalID=externalID)
+
+
+
+class _ImportedBlurb(Item):
+    """
+    I record which blurb was imported for a blurb in a stream being imported
+    by L{importBlurbs}, so that the blurbs after it can find it without the
+    whole stream's blurbs being kept in memory.  I am deleted when the import
+    finishes.
+    """
+
+    typeName = 'hyperbola_imported_blurb'
+    schemaVersion = 1
+
+    streamID = integer(
+        doc="""
+        The C{id} of the blurb in the stream.
+        """,
+        allowNone=False,
+        indexed=True)
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} imported for it.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+
+
+class _Importer(object):
+    """
+    The state of an import by L{importBlurbs}, which is kept between its
+    batches.
+
+    @ivar store: the store to import into.
+
+    @ivar imported: the number of blurbs imported.
+
+    @ivar versions: the version records of the last blurb imported, which
+    are imported once all of them have been read, since each is stored as a
+    delta from the next.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.imported = 0
+        self.versions = []
+
+
+    def _getBlurb(self, id):
+        """
+        Find the blurb imported for the blurb with C{id} in the stream.
+
+        @rtype: L{Blurb} or C{None}
+        """
+        imported = self.store.findFirst(
+            _ImportedBlurb, _ImportedBlurb.streamID == id)
+        if imported is None:
+            return None
+        return imported.blurb
+
+
+    def importRecord(self, record):
+        """
+        Import one record of the stream.
+
+        @type record: C{dict}
+        """
+        kind = record[u'type']
+        if kind == u'version':
+            self.versions.append(record)
+            return
+        self.flushVersions()
+        if kind == u'blurb':
+            self.importBlurb(record)
+        elif kind == u'permission':
+            FlavorPermission(
+                store=self.store,
+                blurb=self._getBlurb(record[u'blurb']),
+                flavor=record[u'flavor'],
+                role=_getRole(self.store, record[u'role']),
+                permissions=record[u'permissions'])
+        else:
+            raise ValueError('Unknown record type %r' % (kind,))
+
+
+    def importBlurb(self, record):
+        """
+        Create a blurb, shared and tagged as it is described, and count it
+        in the L{BlurbChildCount}s of its parent.  Its parent must already
+        have been imported; if it was not part of the stream, the blurb is
+        made top-level.
+        """
+        parent = None
+        if record[u'parent'] is not None:
+            parent = self._getBlurb(record[u'parent'])
+        blurb = Blurb(
+            store=self.store,
+            parent=parent,
+            flavor=record[u'flavor'],
+            title=record[u'title'],
+            body=record[u'body'],
+            normalizedBody=normalize(record[u'body']),
+            author=_getRole(self.store, record[u'author']),
+            hits=record[u'hits'],
+            dateCreated=_loadTime(record[u'dateCreated']),
+            dateLastEdited=_loadTime(record[u'dateLastEdited']))
+        _ImportedBlurb(store=self.store, streamID=record[u'id'], blurb=blurb)
+        self.imported += 1
+
+        shareID = None
+        for share in record[u'shares']:
+            # Streams written before share IDs were exported give every
+            # share of a blurb the ID chosen for its first one.
+            shareID = blurb.shareWith(
+                _getRole(self.store, share[u'role']),
+                [namedAny(name) for name in share[u'interfaces']],
+                share.get(u'shareID', shareID)).shareID
+        if parent is not None:
+            parent._adjustChildCounts(blurb, 1)
+
+        catalog = self.store.findOrCreate(Catalog)
+        for tag in record[u'tags']:
+            catalog.tag(blurb, tag)
+        blurb._adjustTagCounts(record[u'tags'], 1)
+
+
+    def flushVersions(self):
+        """
+        Import the past versions of the last blurb imported.
+        """
+        if not self.versions:
+            return
+        blurb = self._getBlurb(self.versions[0][u'blurb'])
+        catalog = self.store.findOrCreate(Catalog)
+        nextBodies = [version[u'body'] for version in self.versions[1:]]
+        nextBodies.append(blurb.body)
+        for version, nextBody in zip(self.versions, nextBodies):
+            body, bodyDelta = _encodeRevision(version[u'body'], nextBody)
+            pastBlurb = PastBlurb(
+                store=self.store,
+                blurb=blurb,
+                title=version[u'title'],
+                body=body,
+                bodyDelta=bodyDelta,
+                author=_getRole(self.store, version[u'author']),
+                hits=version[u'hits'],
+                dateEdited=_loadTime(version[u'dateEdited']))
+            for tag in version[u'tags']:
+                catalog.tag(pastBlurb, tag)
+        self.versions = []
+
+
+
+def importBlurbs(store, lines, batchSize=CHUNK_SIZE):
+    """
+    Create the blurbs described by lines written by L{exportBlurbs}.  The
+    store may already have blurbs in it, but not ones shared with the same
+    share IDs to the same roles.
+
+    @type store: L{axiom.store.Store}
+
+    @param lines: an iterable of lines of JSON.
+
+    @param batchSize: the number of lines to import in each transaction.
+    @type batchSize: C{int}
+
+    @return: the number of blurbs imported.
+    @rtype: C{int}
+    """
+    importer = _Importer(store)
+    lines = iter(lines)
+
+    def importBatch():
+        batch = list(islice(lines, batchSize))
+        for line in batch:
+            if line.strip():
+                importer.importRecord(loads(line))
+        if len(batch) < batchSize:
+            importer.flushVersions()
+        return len(batch)
+
+    while store.transact(importBatch) == batchSize:
+        pass
+    store.query(_ImportedBlurb).deleteFromStore()
+    return importer.imported
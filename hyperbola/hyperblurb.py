@@ -5,6 +5,12 @@ public, shared, or private textual data.  They correspond to blog posts, wiki
 pages, forum posts, comments, threads (etc, etc) in other systems.
 """
 
+import os, weakref, zlib
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import islice
+from difflib import SequenceMatcher
+from json import dumps, loads
 
 from zope.interface import implements
 
@@ -12,14 +18,22 @@ from twisted.python.reflect import qual, namedAny
 
 from epsilon.extime import Time
 
-from axiom.item import Item
-from axiom.attributes import text, reference, integer, timestamp, textlist, AND
+from axiom.item import Item, declareLegacyItem
+from axiom.attributes import (
+    text, bytes, reference, integer, timestamp, textlist, inmemory, AND, OR,
+    compoundIndex)
 from axiom.tags import Catalog, Tag
+from axiom.upgrade import registerAttributeCopyingUpgrader
+from axiom.iaxiom import IComparison
+from axiom.errors import SQLError
 from axiom import batch
 
-from xmantissa.sharing import Role, shareItem, asAccessibleTo, unShare
+from xmantissa.sharing import (
+    Role, Share, SharedProxy, ALL_IMPLEMENTED, ALL_IMPLEMENTED_DB, shareItem,
+    itemFromProxy)
 
 from hyperbola import ihyperbola
+from hyperbola.normalize import normalize
 
 class FLAVOR:
     """
@@ -61,6 +75,47 @@ ALL_FLAVORS = set((FLAVOR.BLOG, FLAVOR.BLOG_POST, FLAVOR.BLOG_COMMENT,
     FLAVOR.FORUM, FLAVOR.FORUM_TOPIC, FLAVOR.FORUM_POST, FLAVOR.WIKI,
     FLAVOR.WIKI_NODE))
 
+# Normalizing a body is the most expensive part of rendering a blurb which
+# has not been normalized since it was posted.  This maps stores to LRU caches
+# of the results of Blurb.renderedBody for such blurbs, which map the storeIDs
+# and edit times of blurbs to their normalized bodies.
+_renderedBodyCache = weakref.WeakKeyDictionary()
+
+# The number of rendered bodies cached for each store.
+RENDERED_BODY_CACHE_SIZE = 1000
+
+# Maps the fully qualified names of interfaces, as FlavorPermissions store
+# them, to the interfaces, so that each is only resolved once per process.
+# Names always resolve to the same interface, so this is never invalidated.
+_namedInterfaces = {}
+
+# Callables which are called with each blurb which is edited, tagged or
+# deleted, or which has a child posted or deleted, so that anything kept
+# which was derived from it can be discarded.
+blurbChangeHooks = []
+
+
+
+def createTagNameIndex(store):
+    """
+    Index the tags in C{store} by name and object, if they are not already, so
+    that L{Blurb.viewByTags} can find the items with a particular tag without
+    looking at the tags of every item.  L{Tag} belongs to Axiom, which only
+    indexes its C{object} attribute, so the index is created with SQL.  This
+    is done when L{hyperbola.hyperbola_model.HyperbolaPublicPresence} is
+    installed or upgraded.
+
+    @type store: L{axiom.store.Store}
+    """
+    store.createSQL(
+        'CREATE INDEX IF NOT EXISTS %s.hyperbola_tag_name_object ON %s(%s, %s)'
+        % (store.databaseName,
+           store.getTableName(Tag).split('.', 1)[1],
+           store.getShortColumnName(Tag.name),
+           store.getShortColumnName(Tag.object)))
+
+
+
 class FlavorPermission(Item):
     """
     I am associated with a top-level Blurb and specify the associated roles for
@@ -116,6 +171,8 @@ class FlavorPermission(Item):
         permission's role.
         """)
 
+    compoundIndex(blurb, flavor)
+
 
 class Blurb(Item):
     """
@@ -140,8 +197,10 @@ class Blurb(Item):
         ihyperbola.ICommentable)
 
     typeName = 'hyperbola_blurb'
-    schemaVersion = 1
+    schemaVersion = 5
 
+    # This must not be changed once the blurb has been shared, since
+    # BlurbVisibility items are computed from it at that point.
     dateCreated = timestamp()
     dateLastEdited = timestamp()
 
@@ -155,6 +214,13 @@ class Blurb(Item):
         A short summary of this blurb.  This is formatted as XHTML mixed
         content.
         """)
+    normalizedBody = text(
+        doc="""
+        The XHTML which is displayed for L{body}, as computed by
+        L{hyperbola.normalize.normalize} when this blurb was posted or last
+        edited, or C{None} if it has not been computed.
+        """,
+        default=None)
 
     hits = integer(
         doc="The number of times that this blurb has been displayed to users.",
@@ -164,10 +230,18 @@ class Blurb(Item):
         reftype=Role,
         allowNone=False)
 
-    parent = reference()        # to Blurb, but you can't spell that AGGUGHH
+    # to Blurb, but you can't spell that AGGUGHH.  This must not be changed
+    # once the blurb is in a store, since BlurbAncestor items are computed
+    # from it at that point.
+    parent = reference()
     flavor = text(doc="One of FLAVOR's capitalized attributes.",
                   allowNone=False)
 
+    # True for blurbs created by postMany, which records their ancestry and
+    # notifies the batch processor itself, rather than letting stored() do it
+    # one blurb at a time.
+    _postedInBulk = inmemory()
+
     def edit(self, newTitle, newBody, newAuthor, newTags):
         """
         Edit an existing blurb, saving a PastBlurb of its current state for
@@ -176,40 +250,152 @@ class Blurb(Item):
         # Edit is only called on subsequent edits, not the first time, so we
         # need to save our current contents as history.
         editDate = Time()
+        _renderedBodyCache.get(self.store, {}).pop(
+            self._renderedBodyKey(), None)
+        body, bodyDelta = _encodeRevision(self.body, newBody)
         pb = PastBlurb(
             store=self.store,
             title=self.title,
-            body=self.body,
+            body=body,
+            bodyDelta=bodyDelta,
             author=self.author,
             blurb=self,
             dateEdited=self.dateLastEdited,
             hits=self.hits)
 
-        catalog = self.store.findOrCreate(Catalog)
-        for tag in self.tags():
-            catalog.tag(pb, tag)
+        oldTags = set(self.tags())
+        newTags = set(newTags)
+        removedTags = oldTags - newTags
+        addedTags = newTags - oldTags
+        if oldTags or addedTags:
+            # Our tags have all been applied through the catalog already, so
+            # they can be copied without checking for their names.
+            catalog = self.store.findOrCreate(Catalog)
+            self.store.batchInsert(
+                Tag, [Tag.object, Tag.name, Tag.created, Tag.catalog],
+                [(pb, tag, editDate, catalog) for tag in oldTags])
+            catalog.tagCount += len(oldTags) - len(removedTags)
 
         self.title = newTitle
         self.body = newBody
+        self.normalizedBody = normalize(newBody)
         self.dateLastEdited = editDate
         self.author = newAuthor
 
-        self.store.query(Tag, Tag.object == self).deleteFromStore()
-        for tag in newTags:
+        # Only the tags which changed are touched, so that saving a blurb
+        # without changing its tags does not rewrite them all.
+        if removedTags:
+            self.store.query(
+                Tag, AND(Tag.object == self,
+                         Tag.name.oneOf(removedTags))).deleteFromStore()
+            self._adjustTagCounts(removedTags, -1)
+        for tag in addedTags:
             catalog.tag(self, tag)
+        self._adjustTagCounts(addedTags, 1)
+        self._reindex()
+        self._changed()
 
     def editPermissions(self, roleToPerms):
         """
-        Change the permissions of this blurb
+        Change the permissions of this blurb.  Its existing shares, and its
+        share ID, are kept; only the shares of roles which are added or
+        removed, or whose interfaces change, are touched.
 
-        @param roleToPerms: mapping of roles to interfaces
+        @param roleToPerms: mapping of roles to interfaces, or to
+        L{ALL_IMPLEMENTED} to share every interface the blurb provides.
         @type roleToPerms: C{dict} of L{xmantissa.sharing.Role} to C{list} of
         L{zope.interface.Interface}
 
         @return: A share ID.
         """
-        unShare(self)
-        return self._setBlurbPermissions(self, roleToPerms)
+        shareID = None
+        sharedTo = set()
+        rolesChanged = False
+        for share in list(self.store.query(Share, Share.sharedItem == self,
+                                           sort=Share.storeID.descending)):
+            shareID = share.shareID
+            role = share.sharedTo
+            if role not in roleToPerms:
+                share.deleteFromStore()
+                rolesChanged = True
+            else:
+                sharedTo.add(role)
+                names = _interfaceNames(roleToPerms[role])
+                if (set(share.sharedInterfaceNames.split(u',')) !=
+                    set(names.split(u','))):
+                    share.sharedInterfaceNames = names
+        for role, interfaceList in roleToPerms.iteritems():
+            if role not in sharedTo:
+                shareID = self.shareWith(role, interfaceList, shareID).shareID
+                rolesChanged = True
+        if rolesChanged and self.parent is not None:
+            self.parent._recountChildren(roleToPerms)
+        self._changed()
+        if roleToPerms:
+            return shareID
+        return None
+
+
+    def editDescendantPermissions(self, role, interfaces,
+                                  inBackground=False):
+        """
+        Change the interfaces which each descendant of this blurb that is
+        shared to C{role} is shared with, such as to stop a role commenting
+        on any post in a blog.  Descendants which are not shared to C{role}
+        are left alone.
+
+        @type role: L{Role}
+        @param interfaces: the interfaces to share to C{role}.
+        @type interfaces: C{list} of L{zope.interface.Interface}
+
+        @param inBackground: if C{True}, leave changing the shares to a
+        L{SubtreePermissionEditor}, a few at a time.  This keeps changing
+        the permissions of a blurb with many descendants from blocking the
+        reactor.
+        """
+        names = _interfaceNames(interfaces)
+        if not inBackground:
+            self._editDescendantShares(role, names)
+            return
+        source = self.store.findOrCreate(_SubtreePermissionEditSource)
+        source.addReliableListener(
+            self.store.findOrCreate(SubtreePermissionEditor))
+        _SubtreePermissionEdit(
+            store=self.store, blurb=self, role=role,
+            sharedInterfaceNames=names)
+        source.itemAdded()
+
+
+    def _editDescendantShares(self, role, names, limit=None):
+        """
+        Change C{limit} of the shares of descendants of this blurb to C{role}
+        which do not yet have the interfaces C{names}.
+
+        @param names: the names of the interfaces to share, as stored in
+        L{Share.sharedInterfaceNames}.
+        @type names: C{unicode}
+
+        @param limit: the maximum number of shares to change, or C{None} to
+        change all of them.
+
+        @return: the number of shares changed.
+        """
+        shares = list(self.store.query(
+            Share,
+            AND(Share.sharedTo == role,
+                Share.sharedInterfaceNames != names,
+                Share.sharedItem.oneOf(
+                    self.store.query(
+                        BlurbAncestor,
+                        AND(BlurbAncestor.ancestor == self,
+                            BlurbAncestor.depth > 0)).getColumn(
+                        'descendant', raw=True))),
+            limit=limit))
+        for share in shares:
+            share.sharedInterfaceNames = names
+        if shares:
+            self._changed()
+        return len(shares)
 
     def _getChildPerms(self, childAuthor):
         """
@@ -227,24 +413,45 @@ class Blurb(Item):
         # probably get to delete).
         roleToPerms = {childAuthor: [ihyperbola.IEditable,
                                      ihyperbola.ICommentable]}
-        currentBlurb = self
+        flavorPerms = self._getFlavorPermissions(
+            FLAVOR.commentFlavors[self.flavor])
+        for role, interfaces in flavorPerms.iteritems():
+            if role not in roleToPerms:
+                roleToPerms[role] = list(interfaces)
+        return roleToPerms
 
+
+    def _getFlavorPermissions(self, newFlavor):
+        """
+        Resolve the L{FlavorPermission}s on this blurb and its ancestors which
+        apply to children of flavor C{newFlavor}.
+
+        This is one query, which finds the L{FlavorPermission}s of each
+        ancestor through its C{(blurb, flavor)} index.
+
+        @param newFlavor: one of the L{FLAVOR} constants.
+
+        @return: mapping of roles to interfaces.
+        @rtype: C{dict} of L{xmantissa.sharing.Role} to C{list} of
+        L{zope.interface.Interface}
+        """
+        roleToPerms = {}
         # With regards to permission, children supersede their parents.  For
         # example, if you want to lock comments on a particular entry, you can
         # give it a new FlavorPermission and its parents will no longer
         # override.  We are specifically iterating upwards from the child here
         # for this reason.
-        newFlavor = FLAVOR.commentFlavors[self.flavor]
-        while currentBlurb is not None:
-            for fp in self.store.query(FlavorPermission,
-                                    AND(FlavorPermission.flavor == newFlavor,
-                                        FlavorPermission.blurb == currentBlurb)):
-                # This test makes sure the parent doesn't override by
-                # clobbering the entry in the dictionary.
-                if fp.role not in roleToPerms:
-                    roleToPerms[fp.role] = [
-                        namedAny(x.encode('ascii')) for x in fp.permissions]
-            currentBlurb = currentBlurb.parent
+        for fp in self.store.query(
+            FlavorPermission,
+            AND(FlavorPermission.flavor == newFlavor,
+                FlavorPermission.blurb == BlurbAncestor.ancestor,
+                BlurbAncestor.descendant == self),
+            sort=BlurbAncestor.depth.ascending):
+            # This test makes sure the parent doesn't override by
+            # clobbering the entry in the dictionary.
+            if fp.role not in roleToPerms:
+                roleToPerms[fp.role] = [
+                    _namedInterface(name) for name in fp.permissions]
         return roleToPerms
 
 
@@ -254,14 +461,42 @@ class Blurb(Item):
         # new one, we just use this value for the first iteration...
         firstShareID = None
         for role, interfaceList in roleToPerms.items():
-            shareObj = shareItem(blurb, interfaces=interfaceList,
-                                 toRole=role, shareID=firstShareID)
+            shareObj = blurb.shareWith(role, interfaceList, firstShareID)
             # ... and then save the initially allocated shareID for each
             # subsequent share.
             firstShareID = shareObj.shareID
         return firstShareID
 
 
+    def shareWith(self, role, interfaces=ALL_IMPLEMENTED, shareID=None):
+        """
+        Share this blurb with a role, as L{shareItem} does, and record that it
+        is visible to that role with L{_recordVisibility}.  Blurbs shared with
+        L{shareItem} directly are recorded before the next blurb is shared
+        with this method; until then, L{view} and its variants find them
+        through their L{Share}s, which is slower.
+
+        @type role: L{Role}
+        @param interfaces: the interfaces to share.
+        @param shareID: the shareID to use, or C{None} to allocate one.
+
+        @rtype: L{Share}
+        """
+        _recordVisibility(self.store)
+        share = shareItem(
+            self, toRole=role, shareID=shareID, interfaces=interfaces)
+        BlurbVisibility(
+            store=self.store,
+            share=share,
+            role=role,
+            parent=self.parent,
+            dateCreated=self.dateCreated,
+            blurb=self)
+        self.store.findUnique(_VisibilityWatermark).lastShareID = (
+            share.storeID)
+        return share
+
+
     def post(self, childTitle, childBody, childAuthor, roleToPerms=None):
         """
         Create a new child of this Blurb, with a flavor derived from the
@@ -286,6 +521,7 @@ class Blurb(Item):
             flavor=newFlavor,
             parent=self,
             body=childBody,
+            normalizedBody=normalize(childBody),
             title=childTitle,
             author=childAuthor,
             dateCreated=Time(),
@@ -295,22 +531,404 @@ class Blurb(Item):
         if roleToPerms is None:
             roleToPerms = self._getChildPerms(childAuthor)
 
-        return self._setBlurbPermissions(newBlurb, roleToPerms)
+        shareID = self._setBlurbPermissions(newBlurb, roleToPerms)
+        self._adjustChildCounts(newBlurb, 1)
+        self._changed()
+        return shareID
+
+
+    def postMany(self, entries, batchSize=500):
+        """
+        Create many children of this Blurb, as L{post} would, for importing
+        large numbers of existing posts or comments.
+
+        C{entries} is consumed lazily and each batch of C{batchSize} children
+        is created in its own transaction, so an import of any size needs only
+        as much memory as one batch.  Permissions are resolved once per author
+        rather than once per child, and ancestry records and tags are inserted
+        in bulk.  The batch processor is notified once per batch rather than
+        once per child.
+
+        @param entries: an iterable of C{(title, body, author, tags,
+        dateCreated)} tuples.  C{author} is a L{Role}, C{tags} is an iterable
+        of C{unicode} tag names, and C{dateCreated} is a
+        L{epsilon.extime.Time}, or C{None} for the current time.
+
+        @param batchSize: the number of children to create in each
+        transaction.
+        @type batchSize: C{int}
+
+        @return: the number of children created.
+        @rtype: C{int}
+        """
+        newFlavor = FLAVOR.commentFlavors[self.flavor]
+        catalog = self.store.findOrCreate(Catalog)
+        parentLinks = [
+            (link.ancestor, link.depth + 1)
+            for link in self.store.query(
+                BlurbAncestor, BlurbAncestor.descendant == self)]
+        counters = [
+            (counter, set(counter.role.allRoles()))
+            for counter in self.store.query(
+                BlurbChildCount, BlurbChildCount.blurb == self)]
+        authorPerms = {}
+        tagNames = set()
+
+        def postBatch(batch):
+            _recordVisibility(self.store)
+            ancestorRows = []
+            visibilityRows = []
+            tagRows = []
+            tagCounts = {}
+            deltas = [0] * len(counters)
+            shareIDs = _genShareIDs(len(batch))
+            for (title, body, author, tags, dateCreated), shareID in zip(
+                batch, shareIDs):
+                if dateCreated is None:
+                    dateCreated = Time()
+                newBlurb = Blurb(
+                    store=self.store,
+                    flavor=newFlavor,
+                    parent=self,
+                    body=body,
+                    normalizedBody=normalize(body),
+                    title=title,
+                    author=author,
+                    dateCreated=dateCreated,
+                    dateLastEdited=dateCreated,
+                    hits=0,
+                    _postedInBulk=True)
+                ancestorRows.append((newBlurb, newBlurb, 0))
+                for (ancestor, depth) in parentLinks:
+                    ancestorRows.append((ancestor, newBlurb, depth))
+
+                if author not in authorPerms:
+                    authorPerms[author] = self._getChildPerms(author)
+                roleToPerms = authorPerms[author]
+                for role, interfaceList in roleToPerms.iteritems():
+                    share = role.shareItem(
+                        newBlurb, shareID=shareID, interfaces=interfaceList)
+                    visibilityRows.append(
+                        (share, role, self, dateCreated, newBlurb))
+
+                for i, (counter, roles) in enumerate(counters):
+                    if not roles.isdisjoint(roleToPerms):
+                        deltas[i] += 1
+
+                for tagName in set(tags):
+                    tagCounts[tagName] = tagCounts.get(tagName, 0) + 1
+                    if tagName in tagNames:
+                        tagRows.append((newBlurb, tagName, dateCreated))
+                    else:
+                        catalog.tag(newBlurb, tagName)
+                        tagNames.add(tagName)
+
+            self.store.batchInsert(
+                BlurbAncestor,
+                [BlurbAncestor.ancestor, BlurbAncestor.descendant,
+                 BlurbAncestor.depth],
+                ancestorRows)
+            self.store.batchInsert(
+                BlurbVisibility,
+                [BlurbVisibility.share, BlurbVisibility.role,
+                 BlurbVisibility.parent, BlurbVisibility.dateCreated,
+                 BlurbVisibility.blurb],
+                visibilityRows)
+            self.store.findOrCreate(_VisibilityWatermark).lastShareID = (
+                self.store.query(Share).getColumn('storeID').max())
+            self.store.batchInsert(
+                Tag, [Tag.object, Tag.name, Tag.created, Tag.catalog],
+                [row + (catalog,) for row in tagRows])
+            catalog.tagCount += len(tagRows)
+            for tagName, count in tagCounts.iteritems():
+                self._addToTagCount(tagName, count)
+            for (counter, roles), delta in zip(counters, deltas):
+                counter.count += delta
+            source = self.store.findUnique(BlurbSource, default=None)
+            if source is not None:
+                source.itemAdded()
+
+        entries = iter(entries)
+        posted = 0
+        while True:
+            batch = list(islice(entries, batchSize))
+            if not batch:
+                break
+            self.store.transact(postBatch, batch)
+            posted += len(batch)
+        roles = set()
+        for roleToPerms in authorPerms.itervalues():
+            roles.update(roleToPerms)
+        self._addChildCounts(roles)
+        self._changed()
+        return posted
+
+
+    def _isVisibleTo(self, role):
+        """
+        Determine whether this blurb has been shared to C{role} or any of the
+        roles it is a member of.
+
+        @type role: L{xmantissa.sharing.Role}
+        @rtype: C{bool}
+        """
+        return self.store.findFirst(
+            Share, AND(Share.sharedItem == self,
+                       Share.sharedTo.oneOf(list(role.allRoles())))) is not None
+
+
+    def _adjustChildCounts(self, child, delta):
+        """
+        Update the L{BlurbChildCount}s of this blurb to reflect the addition
+        or removal of C{child}.  Only the counters of roles which can see
+        C{child} are changed.  When C{child} is added, a counter is created
+        for each role it is shared to which does not have one yet.
+
+        @type child: L{Blurb}
+        @param delta: C{1} if C{child} was added, C{-1} if it is about to be
+        removed.
+        """
+        for counter in self.store.query(BlurbChildCount,
+                                        BlurbChildCount.blurb == self):
+            if child._isVisibleTo(counter.role):
+                counter.count += delta
+        if delta > 0:
+            self._addChildCounts(
+                self.store.query(
+                    Share, Share.sharedItem == child).getColumn('sharedTo'))
+
+
+    def _addChildCounts(self, roles):
+        """
+        Create a L{BlurbChildCount} of this blurb for each of C{roles} which
+        does not have one yet.
+
+        @type roles: iterable of L{Role}
+        """
+        counted = set(self.store.query(
+            BlurbChildCount,
+            BlurbChildCount.blurb == self).getColumn('role'))
+        for role in set(roles) - counted:
+            BlurbChildCount(
+                store=self.store,
+                blurb=self,
+                role=role,
+                count=self._countChildren(role))
+
+
+    def _recountChildren(self, roles):
+        """
+        Recompute each of the L{BlurbChildCount}s of this blurb, and create
+        any which are missing for C{roles}.  This is necessary when the
+        visibility of one of our children changes.
+
+        @type roles: iterable of L{Role}
+        """
+        for counter in self.store.query(BlurbChildCount,
+                                        BlurbChildCount.blurb == self):
+            counter.count = self._countChildren(counter.role)
+        self._addChildCounts(roles)
+
 
+    def _countChildren(self, role):
+        """
+        Count the children of this blurb that are visible to this role, by
+        querying for them.
+
+        @rtype: C{int}
+        """
+        return self.store.query(Blurb, self.childrenVisibleTo(role)).count()
+
+
+    def childCount(self, role):
+        """
+        Count the children of this blurb that are visible to this role.
+
+        The count is read from a L{BlurbChildCount} if this role has one.
+        Those are created and maintained by L{post}, L{postMany},
+        L{editPermissions} and L{delete}, for the roles children are shared
+        to; the children visible to any other role, or to any role while
+        some shares have not been recorded by L{_recordVisibility}, are
+        counted with a query.  Nothing is written to the store.
+
+        @param role: a L{Role} which can observe some children of this blurb.
+
+        @rtype: C{int}
+        """
+        counter = self.store.findUnique(
+            BlurbChildCount,
+            AND(BlurbChildCount.blurb == self,
+                BlurbChildCount.role == role),
+            default=None)
+        if counter is None or not _visibilityRecorded(self.store):
+            return self._countChildren(role)
+        return counter.count
+
+
+    def hasChildren(self, role):
+        """
+        Determine whether any children of this blurb are visible to this role,
+        without looking beyond the first one.
+
+        @param role: a L{Role} which can observe some children of this blurb.
+
+        @rtype: C{bool}
+        """
+        return self.store.findFirst(
+            Blurb, self.childrenVisibleTo(role)) is not None
+
+
+    def childrenVisibleTo(self, role):
+        """
+        Make a comparison which matches the children of this blurb that are
+        visible to this role, using their L{BlurbVisibility} items, or their
+        L{Share}s if some have not been recorded yet.  The visible children
+        are selected in a subquery, so that a child shared to more than one
+        of the roles C{role} is a member of is still only matched once.
+
+        @param role: a L{Role} which can observe some children of this blurb.
+
+        @rtype: L{axiom.iaxiom.IComparison}
+        """
+        visibility = _Visibility(self.store)
+        visible = self.store.query(
+            Blurb, AND(visibility.parent == self, visibility.visibleTo(role)))
+        return Blurb.storeID.oneOf(visible.getColumn('storeID'))
+
+
+    def subtreeVersion(self, role):
+        """
+        Describe the current version of this blurb and of its descendants,
+        from its L{BlurbSubtreeVersion}, so that pages and feeds of them can
+        be validated without being rendered.  The version changes whenever
+        any of them changes, whether or not it is visible to C{role}.
+
+        @param role: a L{Role} which can observe some descendants of this
+        blurb.
+
+        @return: a two-tuple of the latest L{Time} at which this blurb or any
+        of its descendants was posted or changed, or C{None} if none of them
+        has a date, and the number of times any of them has changed.
+        """
+        version = self.store.findUnique(
+            BlurbSubtreeVersion, BlurbSubtreeVersion.blurb == self,
+            default=None)
+        # Blurbs posted before they kept their edit times have only a
+        # creation time, and no blurb was edited before it was created.
+        dates = [self.dateLastEdited, self.dateCreated]
+        revision = 0
+        if version is not None:
+            dates.append(version.lastChanged)
+            revision = version.revision
+        dates = [date for date in dates if date is not None]
+        latest = None
+        if dates:
+            latest = max(dates)
+        return (latest, revision)
+
+
+    def thread(self, role, maxDepth=None):
+        """
+        Collect the descendants of this blurb which are visible to a role, as
+        a tree, with one query for the descendants and one for the shares of
+        each L{CHUNK_SIZE} of them, however deep the tree is.  Descendants of
+        blurbs which are not visible to the role are left out.
+
+        @param role: a L{Role} which can observe some descendants of this
+        blurb.
+
+        @param maxDepth: the depth below this blurb to stop at, or C{None} to
+        include every descendant.
+
+        @return: a C{list} of C{(proxy, replies)} tuples for the visible
+        children of this blurb, oldest first, where C{proxy} is a
+        L{SharedProxy} and C{replies} is a C{list} of the same form for the
+        visible children of its blurb.
+        """
+        visibility = _Visibility(self.store)
+        comparisons = [BlurbAncestor.ancestor == self,
+                       BlurbAncestor.depth > 0,
+                       BlurbAncestor.descendant == Blurb.storeID,
+                       visibility.visibleTo(role)]
+        if maxDepth is not None:
+            comparisons.append(BlurbAncestor.depth <= maxDepth)
+        # Shallower blurbs come first, so that each blurb's parent has been
+        # placed in the tree by the time the blurb is reached.
+        descendants = self.store.query(
+            Blurb, AND(*comparisons),
+            sort=(BlurbAncestor.depth.ascending +
+                  visibility.dateCreated.ascending +
+                  visibility.blurb.ascending)).distinct()
+        replies = {self.storeID: []}
+        for proxy in sharedProxies(role, descendants):
+            blurb = itemFromProxy(proxy)
+            siblings = replies.get(blurb.parent.storeID)
+            if siblings is not None:
+                children = []
+                siblings.append((proxy, children))
+                replies[blurb.storeID] = children
+        return replies[self.storeID]
+
+
+    def pageKey(self):
+        """
+        Get the key which orders this blurb among its siblings, newest first,
+        for use as the C{after} argument to L{view} and its variants.
+
+        @rtype: C{tuple} of L{Time} and C{int}
+        """
+        return (self.dateCreated, self.storeID)
+
+
+    def _viewPage(self, role, comparison, after, limit):
+        """
+        Collect a page of the children of this blurb that are visible to this
+        role and match a comparison, newest first.
+
+        @param role: a L{Role} which can observe some children of this blurb.
+        @param comparison: an L{axiom.iaxiom.IComparison} which children must
+        match, as well as being children of this blurb.
+        @param after: the L{pageKey} of the last child of the previous page, or
+        C{None} to start with the newest child.
+        @param limit: the maximum number of children to collect, or C{None} to
+        collect all of them.
+
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
+        """
+        visibility = _Visibility(self.store)
+        comparisons = [visibility.parent == self, visibility.visibleTo(role)]
+        if comparison is not None:
+            comparisons.append(comparison)
+        if after is not None:
+            dateCreated, storeID = after
+            comparisons.append(
+                OR(visibility.dateCreated < dateCreated,
+                   AND(visibility.dateCreated == dateCreated,
+                       Blurb.storeID < storeID)))
+        children = self.store.query(
+            Blurb, AND(*comparisons),
+            sort=(visibility.dateCreated.descending +
+                  visibility.blurb.descending),
+            limit=limit).distinct()
+        return sharedProxies(role, children)
 
-    def view(self, role):
+
+    def view(self, role, after=None, limit=None):
         """
         Collect the children of this blurb that are visible to this role.
 
         @param role: a L{Role} which can observe some children of this blurb.
+        @param after: the L{pageKey} of the last child of the previous page, or
+        C{None} to start with the newest child.
+        @param limit: the maximum number of children to collect, or C{None} to
+        collect all of them.
 
         @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
         """
-        children = self.store.query(Blurb, Blurb.parent == self, sort=Blurb.dateCreated.descending)
-        return asAccessibleTo(role, children)
+        return self._viewPage(role, None, after, limit)
 
 
-    def viewByTag(self, role, tag):
+    def viewByTag(self, role, tag, after=None, limit=None):
         """
         Collect the children of this blurb that are visible to this role, and
         have been tagged with C{tag}
@@ -318,15 +936,65 @@ class Blurb(Item):
         @param role: a L{Role} which can observe some children of this blurb.
         @param tag: the tag name
         @type tag: C{unicode}
+        @param after: see L{view}.
+        @param limit: see L{view}.
 
         @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
         """
-        children = self.store.query(
-            Blurb, AND(Blurb.parent == self,
-                       Tag.object == Blurb.storeID,
-                       Tag.name == tag),
-            sort=Blurb.dateCreated.descending)
-        return asAccessibleTo(role, children)
+        return self.viewByTags(role, [tag], after=after, limit=limit)
+
+
+    def viewByTags(self, role, tags, matchAll=True, after=None, limit=None):
+        """
+        Collect the children of this blurb that are visible to this role, and
+        have been tagged with every one of C{tags}, or any of them.
+
+        @param role: a L{Role} which can observe some children of this blurb.
+        @param tags: the tag names
+        @type tags: C{list} of C{unicode}
+        @param matchAll: if true, only children with every one of C{tags} are
+        collected, otherwise children with any of them are.
+        @type matchAll: C{bool}
+        @param after: see L{view}.
+        @param limit: see L{view}.
+
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
+        """
+        def taggedWith(*names):
+            return Blurb.storeID.oneOf(
+                self.store.query(Tag, Tag.name.oneOf(names)).getColumn(
+                    'object', raw=True))
+        if matchAll:
+            comparisons = [taggedWith(tag) for tag in tags]
+        else:
+            comparisons = [taggedWith(*tags)]
+        return self._viewPage(role, AND(*comparisons), after, limit)
+
+
+    def viewDescendants(self, role, limit=None):
+        """
+        Collect the descendants of this blurb that are visible to this role,
+        at any depth, newest first, such as all of the comments on a blog
+        post and the replies to them.
+
+        @param role: a L{Role} which can observe some descendants of this
+        blurb.
+        @param limit: the maximum number of descendants to collect, or
+        C{None} to collect all of them.
+
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
+        """
+        visibility = _Visibility(self.store)
+        descendants = self.store.query(
+            Blurb,
+            AND(BlurbAncestor.ancestor == self,
+                BlurbAncestor.depth > 0,
+                BlurbAncestor.descendant == Blurb.storeID,
+                visibility.visibleTo(role)),
+            sort=(visibility.dateCreated.descending +
+                  visibility.blurb.descending),
+            limit=limit).distinct()
+        return sharedProxies(role, descendants)
 
 
     def permitChildren(self, role, flavor, *interfaces):
@@ -358,6 +1026,43 @@ class Blurb(Item):
         """
         return self.store.findOrCreate(Catalog).tagsOf(self)
 
+
+    def _renderedBodyKey(self):
+        """
+        @return: the key of this blurb's current body in
+        L{_renderedBodyCache}.
+        """
+        edited = self.dateLastEdited
+        if edited is not None:
+            edited = edited.asPOSIXTimestamp()
+        return (self.storeID, edited)
+
+
+    def renderedBody(self):
+        """
+        Get the XHTML which should be displayed for the body of this blurb.
+        This is L{normalizedBody} if it has been computed; otherwise the body
+        is normalized now, and the result cached until the blurb is edited.
+
+        @return: a well-formed XHTML document fragment, or C{u''} if the body
+        is empty.
+        @rtype: C{unicode}
+        """
+        if self.normalizedBody is not None:
+            return self.normalizedBody
+        if not self.body:
+            return u''
+        cache = _renderedBodyCache.setdefault(self.store, OrderedDict())
+        key = self._renderedBodyKey()
+        try:
+            body = cache.pop(key)
+        except KeyError:
+            body = normalize(self.body)
+            if len(cache) >= RENDERED_BODY_CACHE_SIZE:
+                cache.popitem(last=False)
+        cache[key] = body
+        return body
+
     def tag(self, tagName):
         """
         Apply a tag to this blurb
@@ -365,25 +1070,195 @@ class Blurb(Item):
         @param tagName: the tag name
         @type tagName: C{unicode}
         """
+        if self.store.findFirst(
+            Tag, AND(Tag.object == self, Tag.name == tagName)) is None:
+            self._adjustTagCounts([tagName], 1)
         self.store.findOrCreate(Catalog).tag(self, tagName)
+        self._reindex()
+        self._changed()
+
+
+    def _changed(self):
+        """
+        Advance the L{BlurbSubtreeVersion} of this blurb and of each of its
+        ancestors, and call each of L{blurbChangeHooks} with this blurb.
+        """
+        now = Time()
+        for ancestor in self.store.query(
+            BlurbAncestor,
+            BlurbAncestor.descendant == self).getColumn('ancestor'):
+            version = self.store.findOrCreate(
+                BlurbSubtreeVersion, blurb=ancestor)
+            version.revision += 1
+            version.lastChanged = now
+        for hook in blurbChangeHooks:
+            hook(self)
+
+
+    def _reindex(self):
+        """
+        Update the full-text index entry for this blurb, if there is a
+        L{BlurbIndexer}.
+        """
+        indexer = self.store.findUnique(BlurbIndexer, default=None)
+        if indexer is not None:
+            indexer.indexBlurb(self)
+
+
+    def _adjustTagCounts(self, tagNames, delta):
+        """
+        Update the L{BlurbTagCount}s of our parent to reflect tags being
+        applied to or removed from this blurb.
+
+        @param tagNames: iterable of C{unicode} tag names.
+        @param delta: C{1} if the tags were applied, C{-1} if they were
+        removed.
+        """
+        if self.parent is not None:
+            for tagName in tagNames:
+                self.parent._addToTagCount(tagName, delta)
+
+
+    def _addToTagCount(self, tagName, delta):
+        """
+        Add C{delta} to the number of children of this blurb which have the tag
+        C{tagName}, discarding the L{BlurbTagCount} if it drops to zero.
+        """
+        counter = self.store.findOrCreate(
+            BlurbTagCount, blurb=self, name=tagName)
+        counter.count += delta
+        if counter.count <= 0:
+            counter.deleteFromStore()
+
+
+    def childTagCounts(self):
+        """
+        Count the tags which have been applied to the children of this blurb.
+        This is read from the L{BlurbTagCount}s which L{tag}, L{edit},
+        L{postMany} and L{delete} maintain.
+
+        @return: C{(name, count)} tuples, ordered by name.
+        @rtype: C{list} of C{tuple} of C{unicode} and C{int}
+        """
+        return [(counter.name, counter.count)
+                for counter in self.store.query(
+                    BlurbTagCount, BlurbTagCount.blurb == self,
+                    sort=BlurbTagCount.name.ascending)]
 
-    def delete(self):
+    def delete(self, inBackground=False):
         """
         Unshare & delete this blurb, and any descendent blurbs and
         L{PastBlurb}s
+
+        @param inBackground: if C{True}, only unshare the blurbs immediately,
+        and leave deleting them to a L{SubtreeDeleter}, a few at a time.  This
+        keeps deleting a blurb with many descendants from blocking the
+        reactor.
+        """
+        if self.parent is not None:
+            self.parent._adjustChildCounts(self, -1)
+            self._adjustTagCounts(self.tags(), -1)
+            self.parent._changed()
+        self._changed()
+        if not inBackground:
+            self._deleteDescendants()
+            return
+        subtree = self.store.query(
+            BlurbAncestor, BlurbAncestor.ancestor == self).getColumn(
+            'descendant', raw=True)
+        self.store.query(
+            BlurbVisibility, BlurbVisibility.blurb.oneOf(subtree)
+            ).deleteFromStore()
+        self.store.query(
+            Share, Share.sharedItem.oneOf(subtree)).deleteFromStore()
+        source = self.store.findOrCreate(_SubtreeDeletionSource)
+        source.addReliableListener(self.store.findOrCreate(SubtreeDeleter))
+        _SubtreeDeletion(store=self.store, blurb=self)
+        source.itemAdded()
+
+
+    def _deleteDescendants(self, limit=None):
+        """
+        Delete the deepest C{limit} blurbs of the subtree rooted at this blurb,
+        along with everything which refers to them, using a few set-based
+        deletes for each L{CHUNK_SIZE} blurbs.
+
+        @param limit: the maximum number of blurbs to delete, or C{None} to
+        delete the whole subtree, including this blurb.
+
+        @return: C{True} if the whole subtree has been deleted, C{False} if
+        some of it remains.
+        """
+        # Delete the deepest blurbs first, so that nothing is ever left
+        # referring to a parent which has already been deleted.
+        storeIDs = list(self.store.query(
+            BlurbAncestor,
+            BlurbAncestor.ancestor == self,
+            sort=BlurbAncestor.depth.descending,
+            limit=limit).getColumn('descendant', raw=True))
+        for i in xrange(0, len(storeIDs), CHUNK_SIZE):
+            _deleteBlurbs(self.store, storeIDs[i:i + CHUNK_SIZE])
+        return self.storeID in storeIDs
+
+
+    def ancestors(self):
+        """
+        Collect the blurbs which this blurb is a descendant of.
+
+        @return: an iterable of L{Blurb}s, starting with this blurb's parent
+        and ending with the top-level blurb.
+        """
+        return self.store.query(
+            Blurb,
+            AND(BlurbAncestor.descendant == self,
+                BlurbAncestor.ancestor == Blurb.storeID,
+                BlurbAncestor.depth > 0),
+            sort=BlurbAncestor.depth.ascending)
+
+
+    def descendants(self):
+        """
+        Collect the blurbs which are descended from this blurb: its children,
+        their children, and so on.
+
+        @return: an iterable of L{Blurb}s, shallowest first.
+        """
+        return self.store.query(
+            Blurb,
+            AND(BlurbAncestor.ancestor == self,
+                BlurbAncestor.descendant == Blurb.storeID,
+                BlurbAncestor.depth > 0),
+            sort=BlurbAncestor.depth.ascending)
+
+
+    def _recordAncestry(self):
         """
-        unShare(self)
-        self.store.query(PastBlurb, PastBlurb.blurb == self).deleteFromStore()
-        for blurb in self.store.query(Blurb, Blurb.parent == self):
-            blurb.delete()
-        self.deleteFromStore()
+        Create the L{BlurbAncestor} items which relate this blurb to itself
+        and to each of its ancestors.  The ancestry of our parent must already
+        have been recorded.
+        """
+        BlurbAncestor(store=self.store, ancestor=self, descendant=self,
+                      depth=0)
+        if self.parent is not None:
+            for link in self.store.query(
+                BlurbAncestor, BlurbAncestor.descendant == self.parent):
+                BlurbAncestor(store=self.store,
+                              ancestor=link.ancestor,
+                              descendant=self,
+                              depth=link.depth + 1)
+
 
     def stored(self):
         """
-        Hook the occurrence of a blurb being added to a store and notify the
-        batch processor, if one exists, of the event so that it can schedule
-        itself to handle the new blurb, if necessary.
+        Hook the occurrence of a blurb being added to a store, record its
+        position in the blurb hierarchy and notify the batch processor, if one
+        exists, of the event so that it can schedule itself to handle the new
+        blurb, if necessary.
         """
+        if getattr(self, '_postedInBulk', False):
+            # Blurb.postMany takes care of both in bulk.
+            return
+        self._recordAncestry()
         source = self.store.findUnique(BlurbSource, default=None)
         if source is not None:
             source.itemAdded()
@@ -394,22 +1269,1291 @@ BlurbSource = batch.processor(Blurb)
 
 
 
-class PastBlurb(Item):
+class BlurbAncestor(Item):
     """
-    This is an old version of a blurb.  It contains the text as it used to be
-    at a particular point in time.
+    I record that one L{Blurb} is descended from another, and how far apart
+    they are.  There is one of me for every pair of a blurb and one of its
+    ancestors, as well as one relating each blurb to itself, so that all the
+    ancestors or all the descendants of a blurb can be found with a single
+    query, rather than by walking L{Blurb.parent} one level at a time.
+
+    I am created by L{Blurb.stored}, and deleted along with either of the
+    blurbs I refer to.
     """
 
-    typeName = 'hyperbola_past_blurb'
+    typeName = 'hyperbola_blurb_ancestor'
     schemaVersion = 1
 
-    dateEdited = timestamp()
+    ancestor = reference(
+        doc="""
+        The L{Blurb} which C{descendant} is descended from.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
 
-    title = text()
-    body = text()
+    descendant = reference(
+        doc="""
+        The L{Blurb} which is descended from C{ancestor}.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
 
-    hits = integer(doc="The number of times that this blurb has been displayed to users.")
-    author = reference(reftype=Role,
-                       allowNone=False)
+    depth = integer(
+        doc="""
+        The number of generations between C{ancestor} and C{descendant}: C{0}
+        if they are the same blurb, C{1} if C{ancestor} is the parent of
+        C{descendant}, and so on.
+        """,
+        allowNone=False)
 
-    blurb = reference(reftype=Blurb)
+    compoundIndex(ancestor, depth)
+    compoundIndex(descendant, depth)
+
+
+
+def _recordLegacyAncestry(blurb):
+    """
+    Create the L{BlurbAncestor} items for a blurb which was created before
+    they existed, by walking up its parents.
+    """
+    ancestor = blurb
+    depth = 0
+    while ancestor is not None:
+        BlurbAncestor(store=blurb.store, ancestor=ancestor, descendant=blurb,
+                      depth=depth)
+        ancestor = ancestor.parent
+        depth += 1
+
+registerAttributeCopyingUpgrader(Blurb, 1, 2, _recordLegacyAncestry)
+
+
+
+declareLegacyItem(Blurb.typeName, 2, dict(
+    dateCreated=timestamp(),
+    dateLastEdited=timestamp(),
+    title=text(),
+    body=text(),
+    hits=integer(),
+    author=reference(),
+    parent=reference(),
+    flavor=text()))
+
+
+
+def _countLegacyTags(blurb):
+    """
+    Add the tags of a blurb which was created before L{BlurbTagCount}s
+    existed to the counts of its parent.  Both may still be legacy items
+    when this runs, so they have none of the methods of L{Blurb}.
+    """
+    if blurb.parent is None:
+        return
+    for tagName in blurb.store.findOrCreate(Catalog).tagsOf(blurb):
+        counter = blurb.store.findOrCreate(
+            BlurbTagCount, blurb=blurb.parent, name=tagName)
+        counter.count += 1
+
+registerAttributeCopyingUpgrader(Blurb, 2, 3, _countLegacyTags)
+
+
+declareLegacyItem(Blurb.typeName, 3, dict(
+    dateCreated=timestamp(),
+    dateLastEdited=timestamp(),
+    title=text(),
+    body=text(),
+    hits=integer(),
+    author=reference(),
+    parent=reference(),
+    flavor=text()))
+
+# Normalizing every body during the upgrade would keep the store closed for
+# too long; "axiomatic hyperbola normalize" does it afterwards instead.
+registerAttributeCopyingUpgrader(Blurb, 3, 4)
+
+
+
+declareLegacyItem(Blurb.typeName, 4, dict(
+    dateCreated=timestamp(),
+    dateLastEdited=timestamp(),
+    title=text(),
+    body=text(),
+    normalizedBody=text(),
+    hits=integer(),
+    author=reference(),
+    parent=reference(),
+    flavor=text()))
+
+
+
+def _recordLegacyVisibility(blurb):
+    """
+    Create the L{BlurbVisibility} items for the shares of a blurb which was
+    shared before they existed.
+    """
+    for share in blurb.store.query(Share, Share.sharedItem == blurb):
+        BlurbVisibility(
+            store=blurb.store,
+            share=share,
+            role=share.sharedTo,
+            parent=blurb.parent,
+            dateCreated=blurb.dateCreated,
+            blurb=blurb)
+
+registerAttributeCopyingUpgrader(Blurb, 4, 5, _recordLegacyVisibility)
+
+
+
+class BlurbChildCount(Item):
+    """
+    I am the number of children of a particular L{Blurb} which are visible to
+    a particular L{Role}.  I exist so that displaying the number of comments
+    on a post does not require loading all of those comments.
+
+    I am created by L{Blurb.post} for each role a new child is shared to,
+    kept up to date by L{Blurb.post} and L{Blurb.delete} and recomputed by
+    L{Blurb.editPermissions}, and by L{_recordVisibility} when children of a
+    blurb have been shared by some other means.
+    """
+
+    typeName = 'hyperbola_blurb_child_count'
+    schemaVersion = 1
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} whose children are being counted.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    role = reference(
+        doc="""
+        The L{Role} to which the counted children are visible.
+        """,
+        reftype=Role,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    count = integer(
+        doc="""
+        The number of children of C{blurb} visible to C{role}.
+        """,
+        allowNone=False,
+        default=0)
+
+    compoundIndex(blurb, role)
+
+
+
+class BlurbSubtreeVersion(Item):
+    """
+    I am the version of a particular L{Blurb} and all of its descendants.  I
+    exist so that validating a page or feed of a blurb's descendants does not
+    require querying them.
+
+    I am created and advanced by L{Blurb._changed} for the blurb which
+    changed and for each of its ancestors, and deleted along with my blurb.
+    """
+
+    typeName = 'hyperbola_blurb_subtree_version'
+    schemaVersion = 1
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} at the root of the versioned subtree.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    revision = integer(
+        doc="""
+        The number of times C{blurb} or any of its descendants has changed.
+        """,
+        allowNone=False,
+        default=0)
+
+    lastChanged = timestamp(
+        doc="""
+        The last time at which C{blurb} or any of its descendants changed.
+        """)
+
+
+
+class BlurbVisibility(Item):
+    """
+    A record that a blurb has been shared to a role, kept alongside the
+    L{Share} so that the children of a blurb which a role can see can be
+    listed and counted in order from an index.
+
+    I am created by L{_recordVisibility} for each L{Share} of a blurb, and
+    deleted along with it.
+    """
+
+    typeName = 'hyperbola_blurb_visibility'
+    schemaVersion = 1
+
+    share = reference(
+        doc="""
+        The L{Share} of C{blurb} to C{role}.  This item is deleted along with
+        it.
+        """,
+        reftype=Share,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    role = reference(
+        doc="""
+        The L{Role} which C{blurb} is shared to.
+        """,
+        reftype=Role,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    parent = reference(
+        doc="""
+        The parent of C{blurb}.
+        """,
+        reftype=Blurb)
+
+    dateCreated = timestamp(
+        doc="""
+        The creation time of C{blurb}.
+        """)
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} which is visible to C{role}.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    compoundIndex(role, parent, dateCreated, blurb)
+    compoundIndex(parent, role)
+
+
+
+class _VisibilityWatermark(Item):
+    """
+    I record how far L{_recordVisibility} has got through the L{Share}s in my
+    store.  Shares made with L{Blurb.shareWith} are recorded as they are
+    made, so the only shares after me are ones which were made with
+    L{shareItem} or L{Role.shareItem} directly.
+    """
+
+    typeName = 'hyperbola_visibility_watermark'
+    schemaVersion = 1
+
+    lastShareID = integer(
+        doc="""
+        The storeID of the newest L{Share} which has been recorded, or C{0}.
+        """,
+        allowNone=False,
+        default=0)
+
+
+
+def _recordVisibility(store):
+    """
+    Create a L{BlurbVisibility} for each L{Share} of a blurb which has been
+    made since the last time this was called, and which does not have one,
+    and recount the children of the parents of those blurbs.
+
+    @type store: L{axiom.store.Store}
+    """
+    watermark = store.findOrCreate(_VisibilityWatermark)
+    parents = set()
+    for share in store.query(
+        Share,
+        AND(Share.storeID > watermark.lastShareID,
+            Share.sharedItem == Blurb.storeID)):
+        if store.findFirst(
+            BlurbVisibility, BlurbVisibility.share == share) is not None:
+            continue
+        blurb = share.sharedItem
+        BlurbVisibility(
+            store=store,
+            share=share,
+            role=share.sharedTo,
+            parent=blurb.parent,
+            dateCreated=blurb.dateCreated,
+            blurb=blurb)
+        if blurb.parent is not None:
+            parents.add(blurb.parent)
+    for parent in parents:
+        parent._recountChildren(())
+        parent._changed()
+    watermark.lastShareID = max(
+        watermark.lastShareID,
+        store.query(Share).getColumn('storeID').max(default=0))
+
+
+
+def _visibilityRecorded(store):
+    """
+    Determine whether every L{Share} of a blurb in C{store} has been recorded
+    by L{_recordVisibility}, without writing anything.
+
+    @type store: L{axiom.store.Store}
+    @rtype: C{bool}
+    """
+    watermark = store.findUnique(_VisibilityWatermark, default=None)
+    lastShareID = 0
+    if watermark is not None:
+        lastShareID = watermark.lastShareID
+    return store.findFirst(
+        Share,
+        AND(Share.storeID > lastShareID,
+            Share.sharedItem == Blurb.storeID)) is None
+
+
+
+class _Visibility(object):
+    """
+    The columns which the blurbs visible to a role are found with: those of
+    L{BlurbVisibility}, which can be listed in order from its indexes, or, if
+    some blurbs have been shared since L{_recordVisibility} last ran, those of
+    L{Share} and L{Blurb}, which always describe every share.
+
+    @ivar blurb: the attribute referring to the visible blurb.
+    @ivar role: the attribute referring to the role it is visible to.
+    @ivar parent: the attribute referring to the parent of the blurb.
+    @ivar dateCreated: the attribute holding the creation time of the blurb.
+    """
+    def __init__(self, store):
+        """
+        @type store: L{axiom.store.Store}
+        """
+        if _visibilityRecorded(store):
+            self.blurb = BlurbVisibility.blurb
+            self.role = BlurbVisibility.role
+            self.parent = BlurbVisibility.parent
+            self.dateCreated = BlurbVisibility.dateCreated
+        else:
+            self.blurb = Share.sharedItem
+            self.role = Share.sharedTo
+            self.parent = Blurb.parent
+            self.dateCreated = Blurb.dateCreated
+
+
+    def visibleTo(self, role):
+        """
+        Make a comparison which matches the blurbs visible to a role, joining
+        L{Blurb} to this visibility's columns.
+
+        @type role: L{Role}
+        @rtype: L{axiom.iaxiom.IComparison}
+        """
+        return AND(self.blurb == Blurb.storeID,
+                   _sharedToAnyOf(self.role, role))
+
+
+
+def _namedInterface(name):
+    """
+    Find the interface with a fully qualified name, remembering it in
+    L{_namedInterfaces}.
+
+    @type name: C{unicode}
+    @rtype: L{zope.interface.Interface}
+    """
+    interface = _namedInterfaces.get(name)
+    if interface is None:
+        interface = _namedInterfaces[name] = namedAny(name.encode('ascii'))
+    return interface
+
+
+
+def _interfaceNames(interfaces):
+    """
+    Get the names of some interfaces as L{Share.sharedInterfaceNames} stores
+    them.  L{Share.sharedInterfaces} cannot be assigned to, since its setter
+    changes the wrong attribute.
+
+    @type interfaces: C{list} of L{zope.interface.Interface}, or
+    L{ALL_IMPLEMENTED}
+    @rtype: C{unicode}
+    """
+    if interfaces is ALL_IMPLEMENTED:
+        return ALL_IMPLEMENTED_DB
+    return u','.join([qual(interface).decode('ascii')
+                      for interface in interfaces])
+
+
+
+def _genShareIDs(count):
+    """
+    Generate C{count} random share IDs of the same form as
+    L{xmantissa.sharing.genShareID}'s, from a single read of random data.
+
+    @type count: C{int}
+    @rtype: C{list} of C{unicode}
+    """
+    data = os.urandom(16 * count).encode('hex').decode('ascii')
+    return [data[i:i + 32] for i in xrange(0, len(data), 32)]
+
+
+
+def _sharedToAnyOf(attribute, role):
+    """
+    Make a comparison which matches when a reference to a role, such as
+    L{BlurbVisibility.role}, is C{role} or any of the roles it is a member
+    of.
+
+    @type role: L{Role}
+    @rtype: L{axiom.iaxiom.IComparison}
+    """
+    roles = list(role.allRoles())
+    if len(roles) == 1:
+        return attribute == roles[0]
+    return attribute.oneOf(roles)
+
+
+
+def sharedProxies(role, blurbs):
+    """
+    Wrap blurbs in L{SharedProxy}s providing the interfaces shared to C{role},
+    like L{xmantissa.sharing.asAccessibleTo}, but loading their L{Share}s a
+    chunk of blurbs at a time.  Blurbs which are not shared to C{role} are
+    skipped.
+
+    @param role: a L{Role}.
+    @param blurbs: an iterable of L{Blurb}s.
+
+    @return: an iterable of L{SharedProxy} instances.
+    """
+    roles = list(role.allRoles())
+    blurbs = iter(blurbs)
+    while True:
+        chunk = list(islice(blurbs, CHUNK_SIZE))
+        if not chunk:
+            return
+        shares = {}
+        for share in role.store.query(
+            Share,
+            AND(Share.sharedItem.oneOf(chunk), Share.sharedTo.oneOf(roles)),
+            sort=Share.storeID.ascending):
+            shares.setdefault(share.sharedItem.storeID, []).append(share)
+        for blurb in chunk:
+            blurbShares = shares.get(blurb.storeID)
+            if blurbShares:
+                interfaces = []
+                for share in blurbShares:
+                    interfaces.extend(share.sharedInterfaces)
+                yield SharedProxy(blurb, interfaces, blurbShares[0].shareID)
+
+
+
+class BlurbTagCount(Item):
+    """
+    The number of children of a blurb which have a particular tag, so that the
+    tags used within a blog can be listed without looking at every tag in the
+    store.  Maintained by L{Blurb}.
+    """
+
+    typeName = 'hyperbola_blurb_tag_count'
+    schemaVersion = 1
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} whose children's tags are counted.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    name = text(
+        doc="""
+        The name of the tag.
+        """,
+        allowNone=False)
+
+    count = integer(
+        doc="""
+        The number of children of C{blurb} which have the tag C{name}.
+        """,
+        allowNone=False,
+        default=0)
+
+    compoundIndex(blurb, name)
+
+
+
+class PastBlurb(Item):
+    """
+    This is an old version of a blurb.  It contains the text as it used to be
+    at a particular point in time.
+
+    The body is either kept in full, in C{body}, or as a reverse delta against
+    the body of the next version of the blurb, in C{bodyDelta}.  Use
+    L{getBody} rather than C{body} to get it either way.
+    """
+
+    typeName = 'hyperbola_past_blurb'
+    schemaVersion = 2
+
+    dateEdited = timestamp()
+
+    title = text()
+    body = text(doc="""
+    The body of this version, or C{None} if it is stored in C{bodyDelta}.
+    """)
+    bodyDelta = bytes(doc="""
+    If C{body} is C{None}, a compressed delta from the body of the next
+    version of the blurb to the body of this version, as returned by
+    L{_encodeRevision}.  The next version is the L{PastBlurb} of the same
+    blurb with the next highest storeID, or the blurb itself.
+    """, default=None)
+
+    hits = integer(doc="The number of times that this blurb has been displayed to users.")
+    author = reference(reftype=Role,
+                       allowNone=False)
+
+    blurb = reference(reftype=Blurb)
+
+
+    def _nextVersions(self):
+        """
+        Find the later versions of our blurb.
+
+        @return: an iterable of L{PastBlurb}s, oldest first.
+        """
+        return self.store.query(
+            PastBlurb,
+            AND(PastBlurb.blurb == self.blurb,
+                PastBlurb.storeID > self.storeID),
+            sort=PastBlurb.storeID.ascending)
+
+
+    def getBody(self):
+        """
+        Rebuild the body of this version of the blurb, applying the deltas of
+        each later version stored as one, starting from the nearest later
+        version which is stored in full.
+
+        @rtype: C{unicode}
+        """
+        if self.bodyDelta is None:
+            return self.body
+        deltas = [self.bodyDelta]
+        for version in self._nextVersions():
+            if version.bodyDelta is None:
+                body = version.body
+                break
+            deltas.append(version.bodyDelta)
+        else:
+            body = self.blurb.body
+        for delta in reversed(deltas):
+            body = _applyDelta(body, delta)
+        return body
+
+
+    def stored(self):
+        """
+        Notify the batch processor, if one exists, of the new version, so that
+        it can give it to any L{RevisionPruner}.
+        """
+        source = self.store.findUnique(PastBlurbSource, default=None)
+        if source is not None:
+            source.itemAdded()
+
+
+
+PastBlurbSource = batch.processor(PastBlurb)
+
+
+
+PastBlurb1 = declareLegacyItem(PastBlurb.typeName, 1, dict(
+    dateEdited=timestamp(),
+    title=text(),
+    body=text(),
+    hits=integer(),
+    author=reference(),
+    blurb=reference()))
+
+
+
+def _compressLegacyRevision(pastBlurb):
+    """
+    Store the body of a L{PastBlurb} which has just been upgraded from
+    version 1 as a delta against the next version of its blurb, if that is
+    smaller and the next version's body is to hand.  Items are upgraded in
+    storeID order, so the next version is usually still a version 1
+    L{PastBlurb}, which has its body in full.
+    """
+    nextVersions = [
+        version
+        for itemType in [PastBlurb, PastBlurb1]
+        for version in pastBlurb.store.query(
+            itemType,
+            AND(itemType.blurb == pastBlurb.blurb,
+                itemType.storeID > pastBlurb.storeID),
+            sort=itemType.storeID.ascending,
+            limit=1)]
+    if not nextVersions:
+        nextBody = pastBlurb.blurb.body
+    else:
+        nextVersion = min(nextVersions, key=lambda version: version.storeID)
+        if nextVersion.body is None:
+            # Rebuilding it would mean following deltas past version 1
+            # items, which getBody cannot see.
+            return
+        nextBody = nextVersion.body
+    pastBlurb.body, pastBlurb.bodyDelta = _encodeRevision(
+        pastBlurb.body, nextBody)
+
+registerAttributeCopyingUpgrader(PastBlurb, 1, 2, _compressLegacyRevision)
+
+
+
+def _encodeRevision(body, nextBody):
+    """
+    Decide how to store the body of a past version of a blurb: in full, or as
+    a compressed reverse delta against the body of the next version,
+    whichever is smaller.
+
+    The delta is a zlib-compressed JSON list, with an element for each run of
+    lines of C{body}.  Runs which are also in C{nextBody} are given as a list
+    of the start and end line numbers in C{nextBody}, and other runs are
+    given as a string.
+
+    @type body: C{unicode} or C{None}
+    @type nextBody: C{unicode} or C{None}
+
+    @return: C{(body, None)} or C{(None, delta)}.
+    @rtype: C{tuple} of C{unicode} and C{str}
+    """
+    if body is None or nextBody is None:
+        return (body, None)
+    nextLines = nextBody.splitlines(True)
+    lines = body.splitlines(True)
+    ops = []
+    for (op, i1, i2, j1, j2) in SequenceMatcher(
+        None, nextLines, lines, autojunk=False).get_opcodes():
+        if op == 'equal':
+            ops.append([i1, i2])
+        elif j1 != j2:
+            ops.append(u''.join(lines[j1:j2]))
+    delta = zlib.compress(dumps(ops, separators=(',', ':')))
+    if len(delta) < len(body.encode('utf-8')):
+        return (None, delta)
+    return (body, None)
+
+
+
+def _applyDelta(nextBody, delta):
+    """
+    Rebuild the body of a past version of a blurb from the body of the next
+    version and a delta returned by L{_encodeRevision}.
+
+    @type nextBody: C{unicode}
+    @type delta: C{str}
+    @rtype: C{unicode}
+    """
+    nextLines = nextBody.splitlines(True)
+    lines = []
+    for op in loads(zlib.decompress(delta)):
+        if isinstance(op, list):
+            lines.extend(nextLines[op[0]:op[1]])
+        else:
+            lines.append(op)
+    return u''.join(lines)
+
+
+
+# The number of storeIDs to compare against at once with oneOf, which must stay
+# below SQLite's limit on the number of parameters to a statement.
+CHUNK_SIZE = 500
+
+
+
+def _deleteBlurbs(store, storeIDs):
+    """
+    Delete some blurbs and everything which refers to them: their shares,
+    visibility records, past versions, tags, ancestry records, child counts,
+    subtree versions, flavor permissions and full-text index entries.  Every
+    descendant of these blurbs must already have been deleted, or be
+    included.
+
+    @type store: L{axiom.store.Store}
+    @param storeIDs: the storeIDs of no more than L{CHUNK_SIZE}
+    L{Blurb}s.
+    """
+    # This must be a query on Blurb itself, rather than on BlurbAncestor, so
+    # that it keeps selecting the same blurbs while their ancestry records are
+    # deleted.
+    blurbIDs = store.query(
+        Blurb, Blurb.storeID.oneOf(storeIDs)).getColumn('storeID')
+    _deleteTags(store, store.query(
+        PastBlurb, PastBlurb.blurb.oneOf(blurbIDs)).getColumn('storeID'))
+    _deleteTags(store, blurbIDs)
+    for attr in [BlurbVisibility.blurb, Share.sharedItem, PastBlurb.blurb,
+                 BlurbChildCount.blurb, BlurbTagCount.blurb,
+                 BlurbSubtreeVersion.blurb, BlurbAncestor.descendant,
+                 FlavorPermission.blurb]:
+        store.query(attr.type, attr.oneOf(blurbIDs)).deleteFromStore()
+    store.query(Blurb, Blurb.storeID.oneOf(blurbIDs)).deleteFromStore()
+    indexer = store.findUnique(BlurbIndexer, default=None)
+    if indexer is not None:
+        indexer.unindexBlurbs(storeIDs)
+
+
+
+def _deleteTags(store, objectIDs):
+    """
+    Delete the tags of some items, and take them out of the
+    L{Catalog.tagCount} of the catalogs they were applied through.
+
+    @type store: L{axiom.store.Store}
+    @param objectIDs: a query for the storeIDs of the items.
+    @type objectIDs: L{axiom.store.AttributeQuery}
+    """
+    tags = store.query(Tag, Tag.object.oneOf(objectIDs))
+    counts = {}
+    for catalogID in tags.getColumn('catalog', raw=True):
+        if catalogID is not None:
+            counts[catalogID] = counts.get(catalogID, 0) + 1
+    tags.deleteFromStore()
+    for catalogID, count in counts.iteritems():
+        store.getItemByID(catalogID).tagCount -= count
+
+
+
+def normalizeBodies(store, renormalize=False, batchSize=CHUNK_SIZE):
+    """
+    Compute L{Blurb.normalizedBody} for the blurbs in C{store} which were
+    posted before it existed, a batch at a time.
+
+    @type store: L{axiom.store.Store}
+    @param renormalize: if true, normalize the bodies of every blurb, such as
+    after L{hyperbola.normalize.NORMALIZERS} has been changed.
+    @type renormalize: C{bool}
+    @param batchSize: the number of blurbs to normalize in each transaction.
+
+    @return: the number of blurbs normalized.
+    @rtype: C{int}
+    """
+    count = 0
+    lastStoreID = -1
+    while True:
+        comparison = Blurb.storeID > lastStoreID
+        if not renormalize:
+            comparison = AND(comparison, Blurb.normalizedBody == None)
+        def normalizeBatch():
+            blurbs = list(store.query(
+                Blurb, comparison,
+                sort=Blurb.storeID.ascending, limit=batchSize))
+            for blurb in blurbs:
+                blurb.normalizedBody = normalize(blurb.body)
+            return blurbs
+        blurbs = store.transact(normalizeBatch)
+        if not blurbs:
+            return count
+        count += len(blurbs)
+        lastStoreID = blurbs[-1].storeID
+
+
+
+class _SubtreeDeletion(Item):
+    """
+    A request, made by L{Blurb.delete}, for a L{SubtreeDeleter} to delete a
+    subtree of blurbs.
+    """
+
+    typeName = 'hyperbola_subtree_deletion'
+    schemaVersion = 1
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} at the root of the subtree to delete.  Its descendants,
+        and then it, will be deleted.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+
+
+_SubtreeDeletionSource = batch.processor(_SubtreeDeletion)
+
+
+
+class SubtreeDeleter(Item):
+    """
+    A batch processing listener which deletes the subtrees of blurbs given
+    to L{Blurb.delete} with C{inBackground=True}, deepest first.
+    """
+
+    typeName = 'hyperbola_subtree_deleter'
+    schemaVersion = 1
+
+    batchSize = integer(
+        doc="""
+        The number of blurbs to delete each time I am given a
+        L{_SubtreeDeletion}.
+        """,
+        allowNone=False,
+        default=CHUNK_SIZE)
+
+
+    def processItem(self, deletion):
+        """
+        Delete the deepest L{batchSize} blurbs of the subtree which
+        C{deletion} refers to.  If some of it remains, ask to be called again
+        with a new L{_SubtreeDeletion} for it.
+
+        @type deletion: L{_SubtreeDeletion}
+        """
+        blurb = deletion.blurb
+        if not blurb._deleteDescendants(self.batchSize):
+            deletion.deleteFromStore()
+            _SubtreeDeletion(store=self.store, blurb=blurb)
+            self.store.findUnique(_SubtreeDeletionSource).itemAdded()
+
+
+
+class _SubtreePermissionEdit(Item):
+    """
+    A request, made by L{Blurb.editDescendantPermissions}, for a
+    L{SubtreePermissionEditor} to change the shares of a subtree of blurbs to
+    a role.
+    """
+
+    typeName = 'hyperbola_subtree_permission_edit'
+    schemaVersion = 1
+
+    blurb = reference(
+        doc="""
+        The L{Blurb} at the root of the subtree.  The shares of its
+        descendants, but not its own, will be changed.
+        """,
+        reftype=Blurb,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    role = reference(
+        doc="""
+        The L{Role} whose shares will be changed.
+        """,
+        reftype=Role,
+        allowNone=False,
+        whenDeleted=reference.CASCADE)
+
+    sharedInterfaceNames = text(
+        doc="""
+        The names of the interfaces to share to C{role}, as stored in
+        L{Share.sharedInterfaceNames}.
+        """,
+        allowNone=False)
+
+
+
+_SubtreePermissionEditSource = batch.processor(_SubtreePermissionEdit)
+
+
+
+class SubtreePermissionEditor(Item):
+    """
+    A batch processing listener which changes the shares of the subtrees of
+    blurbs given to L{Blurb.editDescendantPermissions} with
+    C{inBackground=True}.
+    """
+
+    typeName = 'hyperbola_subtree_permission_editor'
+    schemaVersion = 1
+
+    batchSize = integer(
+        doc="""
+        The number of shares to change each time I am given a
+        L{_SubtreePermissionEdit}.
+        """,
+        allowNone=False,
+        default=CHUNK_SIZE)
+
+
+    def processItem(self, edit):
+        """
+        Change L{batchSize} of the shares which C{edit} refers to.  If some of
+        them may remain, ask to be called again with a new
+        L{_SubtreePermissionEdit} for them.
+
+        @type edit: L{_SubtreePermissionEdit}
+        """
+        blurb, role, names = edit.blurb, edit.role, edit.sharedInterfaceNames
+        edit.deleteFromStore()
+        if blurb._editDescendantShares(
+            role, names, self.batchSize) == self.batchSize:
+            _SubtreePermissionEdit(
+                store=self.store, blurb=blurb, role=role,
+                sharedInterfaceNames=names)
+            self.store.findUnique(_SubtreePermissionEditSource).itemAdded()
+
+
+
+class HitCounter(object):
+    """
+    Count views of blurbs in memory and add them to L{Blurb.hits} in one
+    transaction per store, so that viewing a blurb does not write to its
+    store.  The counts are written C{interval} seconds after the first
+    unwritten view, or as soon as C{threshold} views have been counted,
+    whichever comes first.  Views which have not been written are lost if the
+    process exits without calling L{flush}.
+
+    @ivar clock: the L{twisted.internet.interfaces.IReactorTime} provider
+    used to schedule writes.
+
+    @ivar interval: the number of seconds to wait before writing counts.
+    @type interval: C{int}
+
+    @ivar threshold: the number of views to count before writing them
+    immediately.
+    @type threshold: C{int}
+    """
+    def __init__(self, clock, interval=60, threshold=1000):
+        self.clock = clock
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}
+        self._pendingCount = 0
+        self._delayedFlush = None
+
+
+    def hit(self, blurb):
+        """
+        Count a view of C{blurb}.
+
+        @type blurb: L{Blurb}
+        """
+        counts = self._pending.setdefault(blurb.store, {})
+        counts[blurb.storeID] = counts.get(blurb.storeID, 0) + 1
+        self._pendingCount += 1
+        if self._pendingCount >= self.threshold:
+            self.flush()
+        elif self._delayedFlush is None:
+            self._delayedFlush = self.clock.callLater(
+                self.interval, self.flush)
+
+
+    def flush(self):
+        """
+        Add all of the views counted so far to the blurbs they were counted
+        for.  Blurbs which have been deleted since are skipped.
+        """
+        if self._delayedFlush is not None:
+            if self._delayedFlush.active():
+                self._delayedFlush.cancel()
+            self._delayedFlush = None
+        pending = self._pending
+        self._pending = {}
+        self._pendingCount = 0
+        for store, counts in pending.iteritems():
+            store.transact(_addHits, store, counts)
+
+
+
+def _addHits(store, counts):
+    """
+    Add to the hit counts of some blurbs.
+
+    @type store: L{axiom.store.Store}
+    @param counts: mapping of the storeIDs of L{Blurb}s to the number of
+    hits to add to them.
+    @type counts: C{dict} of C{int} to C{int}
+    """
+    storeIDs = counts.keys()
+    for i in xrange(0, len(storeIDs), CHUNK_SIZE):
+        for blurb in store.query(
+            Blurb, Blurb.storeID.oneOf(storeIDs[i:i + CHUNK_SIZE])):
+            blurb.hits += counts[blurb.storeID]
+
+
+
+class RevisionPruner(Item):
+    """
+    A batch processing listener which deletes old L{PastBlurb}s.  Each time a
+    blurb is edited, the newest C{keepRevisions} of its past versions are
+    kept, as are any others edited in the last C{dailyAfterDays} days.  Of
+    the rest, only the newest version edited on each day (in UTC) is kept.
+
+    Creating a L{RevisionPruner} adds it to the L{PastBlurbSource}.  Versions
+    which already exist are pruned a blurb at a time in the background.
+    """
+
+    typeName = 'hyperbola_revision_pruner'
+    schemaVersion = 1
+
+    keepRevisions = integer(
+        doc="""
+        The number of past versions of each blurb which are always kept.
+        """,
+        allowNone=False,
+        default=10)
+
+    dailyAfterDays = integer(
+        doc="""
+        The age in days after which only one past version per day is kept.
+        """,
+        allowNone=False,
+        default=30)
+
+
+    def stored(self):
+        """
+        Start listening for new L{PastBlurb}s.
+        """
+        self.store.findOrCreate(PastBlurbSource).addReliableListener(self)
+
+
+    def _shouldKeep(self, versions, now):
+        """
+        Decide which past versions of a blurb to keep.  Versions of blurbs
+        which were never given an edit time have no C{dateEdited}; they are
+        treated as older than any other, and as edited on a day of their own.
+
+        @param versions: every L{PastBlurb} of a blurb, oldest first.
+        @param now: the L{Time} to measure the age of C{versions} from.
+
+        @return: a C{list} of C{bool}s corresponding to C{versions}.
+        """
+        oldest = now - timedelta(days=self.dailyAfterDays)
+        days = [version.dateEdited and version.dateEdited.asDatetime().date()
+                for version in versions]
+        keep = []
+        for i, version in enumerate(versions):
+            keep.append(
+                i >= len(versions) - self.keepRevisions
+                or (version.dateEdited is not None
+                    and version.dateEdited > oldest)
+                or i == len(versions) - 1
+                or days[i + 1] != days[i])
+        return keep
+
+
+    def processItem(self, pastBlurb):
+        """
+        Prune the past versions of the blurb which C{pastBlurb} is a version
+        of, if C{pastBlurb} is the newest of them.  Older versions are
+        skipped, so that the versions of a blurb are pruned once however many
+        of them are waiting to be processed, such as when a L{RevisionPruner}
+        is first created.
+
+        @type pastBlurb: L{PastBlurb}
+        """
+        if pastBlurb._nextVersions().count() == 0:
+            self._prune(pastBlurb.blurb)
+
+
+    def _prune(self, blurb):
+        """
+        Delete the past versions of C{blurb} which are not to be kept, along
+        with their tags, and store the body of each kept version which was
+        stored against a deleted one against the next kept version instead.
+
+        @type blurb: L{Blurb}
+        """
+        versions = list(self.store.query(
+            PastBlurb, PastBlurb.blurb == blurb,
+            sort=PastBlurb.storeID.ascending))
+        keep = self._shouldKeep(versions, Time())
+        if all(keep):
+            return
+
+        # Rebuild every body in one pass from the newest version to the
+        # oldest, while every delta still applies, noting the kept versions
+        # which will need to be stored against a different version.
+        reencode = []
+        nextBody = nextKeptBody = blurb.body
+        nextPruned = False
+        for version, kept in reversed(zip(versions, keep)):
+            if version.bodyDelta is None:
+                body = version.body
+            else:
+                body = _applyDelta(nextBody, version.bodyDelta)
+            nextBody = body
+            if not kept:
+                nextPruned = True
+                continue
+            if nextPruned and version.bodyDelta is not None:
+                reencode.append((version, body, nextKeptBody))
+            nextKeptBody = body
+            nextPruned = False
+
+        pruned = [version.storeID
+                  for version, kept in zip(versions, keep) if not kept]
+        for i in xrange(0, len(pruned), CHUNK_SIZE):
+            chunk = self.store.query(
+                PastBlurb, PastBlurb.storeID.oneOf(pruned[i:i + CHUNK_SIZE]))
+            _deleteTags(self.store, chunk.getColumn('storeID'))
+            chunk.deleteFromStore()
+        for version, body, nextBody in reencode:
+            version.body, version.bodyDelta = _encodeRevision(body, nextBody)
+
+
+
+# The FTS4 table maintained by BlurbIndexer.  Its rowids are the storeIDs of
+# the blurbs it indexes.
+_FULL_TEXT_TABLE = 'hyperbola_blurb_fts'
+
+
+
+class _FullTextMatch(object):
+    """
+    A comparison which matches the L{Blurb}s whose indexed text matches a
+    full-text query.
+    """
+    implements(IComparison)
+
+    def __init__(self, query):
+        """
+        @param query: an SQLite full-text query.
+        @type query: C{unicode}
+        """
+        self.query = query
+
+
+    def getInvolvedTables(self):
+        return [Blurb]
+
+
+    def getQuery(self, store):
+        return '(%s IN (SELECT rowid FROM main.%s WHERE %s MATCH ?))' % (
+            Blurb.storeID.getColumnName(store), _FULL_TEXT_TABLE,
+            _FULL_TEXT_TABLE)
+
+
+    def getArgs(self, store):
+        return [self.query]
+
+
+
+class BlurbIndexer(Item):
+    """
+    A batch processing listener which maintains a full-text index of the
+    title, body and tags of every L{Blurb}.
+
+    Creating a L{BlurbIndexer} adds it to the L{BlurbSource}, which indexes
+    blurbs which already exist in the background.  Blurbs are reindexed as
+    soon as they are edited or tagged, and dropped from the index when they
+    are deleted.
+
+    Text is split into words by the SQLite tokenizer named by C{tokenizer}.
+    The default, C{unicode61}, folds the case and diacritics of any Unicode
+    text, and needs SQLite 3.7.13 or later; C{simple} only folds the case of
+    ASCII, but is always available.
+    """
+
+    typeName = 'hyperbola_blurb_indexer'
+    schemaVersion = 1
+
+    tokenizer = text(
+        doc="""
+        The name of the SQLite tokenizer which splits indexed text and queries
+        into words.  Changing it once the index has been created has no
+        effect.
+        """,
+        allowNone=False,
+        default=u'unicode61')
+
+
+    def stored(self):
+        """
+        Create the index and start listening for new L{Blurb}s.
+        """
+        self.store.createSQL(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS main.%s '
+            'USING fts4(title, body, tags, tokenize=%s)'
+            % (_FULL_TEXT_TABLE, self.tokenizer.encode('ascii')))
+        self.store.findOrCreate(BlurbSource).addReliableListener(self)
+
+
+    def processItem(self, blurb):
+        """
+        Index a newly posted blurb.
+
+        @type blurb: L{Blurb}
+        """
+        self.indexBlurb(blurb)
+
+
+    def indexBlurb(self, blurb):
+        """
+        Replace the indexed text of C{blurb} with its current title, body and
+        tags.
+
+        @type blurb: L{Blurb}
+        """
+        self.unindexBlurbs([blurb.storeID])
+        self.store.executeSQL(
+            'INSERT INTO main.%s (rowid, title, body, tags) VALUES (?, ?, ?, ?)'
+            % (_FULL_TEXT_TABLE,),
+            [blurb.storeID, blurb.title, blurb.body,
+             u' '.join(sorted(blurb.tags()))])
+
+
+    def unindexBlurbs(self, storeIDs):
+        """
+        Remove some blurbs from the index.
+
+        @param storeIDs: the storeIDs of no more than L{CHUNK_SIZE}
+        L{Blurb}s.
+        """
+        self.store.executeSQL(
+            'DELETE FROM main.%s WHERE rowid IN (%s)'
+            % (_FULL_TEXT_TABLE, ', '.join(['?'] * len(storeIDs))),
+            list(storeIDs))
+
+
+    def search(self, role, query, limit=None, offset=0):
+        """
+        Find the blurbs visible to C{role} which match a full-text query,
+        newest first.
+
+        @param role: a L{Role}.
+        @param query: an SQLite full-text query, such as C{u'twisted
+        OR axiom'}.
+        @type query: C{unicode}
+        @param limit: the maximum number of blurbs to collect, or C{None} to
+        collect all of them.
+        @param offset: the number of visible matching blurbs to skip.
+
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances,
+        which is empty if SQLite cannot parse C{query}, such as when it has
+        an unbalanced quote.
+        """
+        if not self._isValidQuery(query):
+            return []
+        # Axiom only accepts an offset along with a limit.
+        if limit is None:
+            skip, offset = offset, None
+        else:
+            skip = 0
+        blurbs = self.store.query(
+            Blurb,
+            AND(_FullTextMatch(query),
+                _Visibility(self.store).visibleTo(role)),
+            sort=Blurb.dateCreated.descending,
+            limit=limit, offset=offset).distinct()
+        return sharedProxies(role, islice(blurbs, skip, None))
+
+
+    def _isValidQuery(self, query):
+        """
+        Determine whether SQLite can parse a full-text query, by matching it
+        against the index for at most one row.  Searching for a malformed
+        query would otherwise fail only once its results were iterated.
+
+        @type query: C{unicode}
+        @rtype: C{bool}
+        """
+        try:
+            self.store.querySQL(
+                'SELECT rowid FROM main.%s WHERE %s MATCH ? LIMIT 1'
+                % (_FULL_TEXT_TABLE, _FULL_TEXT_TABLE), [query])
+        except SQLError, e:
+            if not str(e.underlying).startswith('malformed MATCH'):
+                raise
+            return False
+        return True
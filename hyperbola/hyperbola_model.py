@@ -10,7 +10,8 @@ from zope.interface import implements
 
 from epsilon.extime import Time
 
-from axiom.item import Item
+from axiom.item import Item, declareLegacyItem
+from axiom.attributes import reference
 
 from axiom.dependency import dependsOn
 
@@ -22,7 +23,8 @@ from twisted.python.components import registerAdapter
 
 from hyperbola.ihyperbola import IViewable
 from hyperbola.hyperbola_view import HyperbolaView
-from hyperbola.hyperblurb import Blurb, FLAVOR
+from hyperbola.hyperblurb import (
+    Blurb, BlurbIndexer, FLAVOR, createTagNameIndex)
 
 
 class HyperbolaPublicPresence(Item):
@@ -33,14 +35,21 @@ class HyperbolaPublicPresence(Item):
     # This object can be browsed from the web
     implements(ixmantissa.INavigableElement)
 
-    schemaVersion = 2                  # There was a previous version,
-                                       # but... let's ignore that.
+    schemaVersion = 3
     typeName = 'hyperbola_start'       # Database table name.
 
     privateApplication = dependsOn(webapp.PrivateApplication)
+    blurbIndexer = dependsOn(BlurbIndexer)
 
     powerupInterfaces = (ixmantissa.INavigableElement,)
 
+    def installed(self):
+        """
+        Index the tags in our store by name, for viewing blurbs by tag.
+        """
+        createTagNameIndex(self.store)
+
+
     def getTabs(self):
         """
         Implementation of L{ixmantissa.INavigableElement.getTabs} which yields a
@@ -85,16 +94,32 @@ class HyperbolaPublicPresence(Item):
         authorsRole = sharing.getPrimaryRole(store, title + u' blog', True)
         sharing.getSelfRole(store).becomeMemberOf(authorsRole)
 
-        sharing.shareItem(blog, authorsRole, shareID=u'blog')
+        blog.shareWith(authorsRole, shareID=u'blog')
 
         everyoneRole = sharing.getEveryoneRole(store)
-        sharing.shareItem(blog, everyoneRole, shareID=u'blog',
-                          interfaces=[IViewable])
+        blog.shareWith(everyoneRole, [IViewable], u'blog')
 
         # this should be configurable
         blog.permitChildren(everyoneRole, FLAVOR.BLOG_POST, IViewable)
 
 
+    def search(self, role, query, limit=None, offset=0):
+        """
+        Find the blurbs in this store which are visible to C{role} and match a
+        full-text query, newest first.
+
+        @param role: a L{xmantissa.sharing.Role}.
+        @param query: an SQLite full-text query.
+        @type query: C{unicode}
+        @param limit: the maximum number of blurbs to collect, or C{None} to
+        collect all of them.
+        @param offset: the number of matching blurbs to skip.
+
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
+        """
+        return self.blurbIndexer.search(role, query, limit, offset)
+
+
 def hyperbolaPublicPresence1to2(old):
     """
     Provide a simple, and probably wrong upgrader, from completely broken
@@ -107,6 +132,26 @@ registerUpgrader(hyperbolaPublicPresence1to2,
                  HyperbolaPublicPresence.typeName, 1, 2)
 
 
+declareLegacyItem(HyperbolaPublicPresence.typeName, 2, dict(
+    privateApplication=reference()))
+
+
+def hyperbolaPublicPresence2to3(old):
+    """
+    Give an existing public presence a L{BlurbIndexer}, which will index the
+    blurbs which already exist in the background, and index the tags in its
+    store by name.
+    """
+    createTagNameIndex(old.store)
+    return old.upgradeVersion(
+        old.typeName, 2, 3,
+        privateApplication=old.privateApplication,
+        blurbIndexer=old.store.findOrCreate(BlurbIndexer))
+
+registerUpgrader(hyperbolaPublicPresence2to3,
+                 HyperbolaPublicPresence.typeName, 2, 3)
+
+
 # Notify the system that this Fragment class will be responsible of rendering
 # the model. The 'self.original' attribute of the HyperbolaView instance is
 # actually an instance of the HyperbolaPublicPresence class.
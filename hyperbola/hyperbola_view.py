@@ -5,15 +5,15 @@ This module contains web-based views onto L{hyperbola.hyperblurb.Blurb}
 objects published by Hyperbola.
 """
 
+import weakref
+from collections import OrderedDict
+
 from zope.interface import implements
 
 from twisted.python.components import registerAdapter
-from twisted.web.microdom import parseString
 
 from epsilon.extime import Time
 
-from axiom.tags import Catalog, Tag
-
 from nevow import athena, inevow, page, tags, rend
 from nevow.flat import flatten
 
@@ -22,10 +22,150 @@ from xmantissa.publicweb import LoginPage
 from xmantissa import sharing, liveform
 from xmantissa.scrolltable import ScrollingElement, TYPE_WIDGET
 
-from hyperbola.hyperblurb import FLAVOR, Blurb
+from hyperbola.hyperblurb import FLAVOR, Blurb, HitCounter, blurbChangeHooks
 from hyperbola import ihyperbola, rss
 
 
+# Counts the views of every blurb rendered by this process, once one has been
+# rendered.  See getHitCounter.
+_hitCounter = None
+
+
+
+def getHitCounter():
+    """
+    Get the L{HitCounter} which counts the views of every blurb rendered by
+    this process.  It is created the first time a blurb is viewed, rather
+    than when this module is imported, so that importing it does not install
+    a reactor; the views it has counted are written when the reactor shuts
+    down.
+
+    @rtype: L{HitCounter}
+    """
+    global _hitCounter
+    if _hitCounter is None:
+        from twisted.internet import reactor
+        _hitCounter = HitCounter(reactor)
+        reactor.addSystemEventTrigger(
+            'before', 'shutdown', _hitCounter.flush)
+    return _hitCounter
+
+
+
+# The number of blurbs whose rendered fragments are cached for each store.
+FRAGMENT_CACHE_SIZE = 1000
+
+# The number of blurbs whose feeds are cached for each store.
+FEED_CACHE_SIZE = 100
+
+
+
+class FragmentCache(object):
+    """
+    A cache of the flattened markup of the parts of blurb views which do not
+    change from one rendering to the next, so that a listing of blurbs does
+    not run all of their renderers each time it is viewed.  The markup of
+    each blurb is kept under a key, which should identify everything else
+    it depends on, and is discarded when the blurb changes.
+
+    @ivar size: the number of blurbs to keep markup for in each store.  The
+    blurbs whose markup was least recently used are discarded first.
+    """
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        # Maps stores to LRU caches, which map the storeIDs of blurbs to
+        # dicts of their markup by key.
+        self._stores = weakref.WeakKeyDictionary()
+
+
+    def get(self, blurb, key):
+        """
+        Get the markup cached for a blurb under a key.
+
+        @type blurb: L{Blurb}
+        @rtype: C{str}, or C{None} if none is cached.
+        """
+        cache = self._stores.get(blurb.store)
+        if cache is None or blurb.storeID not in cache:
+            return None
+        fragments = cache.pop(blurb.storeID)
+        cache[blurb.storeID] = fragments
+        return fragments.get(key)
+
+
+    def put(self, blurb, key, markup):
+        """
+        Cache markup for a blurb under a key.
+
+        @type blurb: L{Blurb}
+        @type markup: C{str}
+        """
+        cache = self._stores.setdefault(blurb.store, OrderedDict())
+        fragments = cache.pop(blurb.storeID, None)
+        if fragments is None:
+            fragments = {}
+            if len(cache) >= self.size:
+                cache.popitem(last=False)
+        fragments[key] = markup
+        cache[blurb.storeID] = fragments
+
+
+    def invalidate(self, blurb):
+        """
+        Discard all of the markup cached for a blurb.
+
+        @type blurb: L{Blurb}
+        """
+        cache = self._stores.get(blurb.store)
+        if cache is not None:
+            cache.pop(blurb.storeID, None)
+
+
+
+# Caches parts of the blurb views rendered by this process.
+fragmentCache = FragmentCache()
+blurbChangeHooks.append(fragmentCache.invalidate)
+
+# Caches the feeds rendered by this process, by the blurb whose children
+# they list.
+feedCache = FragmentCache(FEED_CACHE_SIZE)
+
+
+
+def _invalidateFeeds(blurb):
+    """
+    Discard the feeds cached for a blurb which has changed, and for its
+    parent, whose feeds list it.
+
+    @type blurb: L{Blurb}
+    """
+    feedCache.invalidate(blurb)
+    if blurb.parent is not None:
+        feedCache.invalidate(blurb.parent)
+
+blurbChangeHooks.append(_invalidateFeeds)
+
+
+
+class _CachedRegion(page.Element):
+    """
+    The contents of a tag in the template of a L{BlurbViewer}, rendered with
+    the viewer's renderers, so that the result can be cached by
+    L{BlurbViewer.cached}.
+    """
+    def __init__(self, viewer, content):
+        self.viewer = viewer
+        self.content = content
+
+
+    def render(self, request):
+        return self.content
+
+
+    def renderer(self, name):
+        return self.viewer.renderer(name)
+
+
 def _docFactorify(publicViewElement):
     """
     Normally in the course of rendering one of these widgets, the theming
@@ -443,13 +583,13 @@ class AddBlogPostFragment(AddCommentFragment):
 
     def _getAllTags(self):
         """
-        Get all the tags in the same store as the underlying item of our
-        parent blurb
+        Get all the tags which have been applied to the children of our parent
+        blurb
 
         @rtype: C{list} of C{unicode}
         """
-        store = sharing.itemFromProxy(self.parent.original).store
-        return list(store.findOrCreate(Catalog).tagNames())
+        blurb = sharing.itemFromProxy(self.parent.original)
+        return [name for (name, count) in blurb.childTagCounts()]
 
     def getInitialArguments(self):
         """
@@ -526,6 +666,17 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
     fragmentName = 'view-blurb/default'
 
     customizedFor = None
+    # The HitCounter to count views with, or None for getHitCounter's.
+    hitCounter = None
+    fragmentCache = fragmentCache
+    feedCache = feedCache
+
+    # How far below our blurb to render its thread.
+    threadDepth = 8
+
+    # The replies to our blurb, from the L{ihyperbola.IViewable.thread} of
+    # one of its ancestors, if it is being rendered as part of one.
+    _replies = None
 
     def __init__(self, original, *a, **k):
         self.original = original
@@ -534,16 +685,41 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
             FLAVOR.commentFlavors[original.flavor]]
 
 
-    def _getSelectedTag(self, request):
+    def render(self, request):
+        """
+        Count a hit on our blurb with L{hitCounter}, unless we are only being
+        rendered as part of another fragment, such as the view of our
+        parent.
+        """
+        if not isinstance(self.fragmentParent,
+                          (athena.LiveElement, athena.LiveFragment)):
+            hitCounter = self.hitCounter
+            if hitCounter is None:
+                hitCounter = getHitCounter()
+            hitCounter.hit(sharing.itemFromProxy(self.original))
+        return super(BlurbViewer, self).render(request)
+
+
+    def _getSelectedTags(self, request):
         """
-        Figure out which tag the user is filtering by, by looking at the URL
+        Figure out which tags the user is filtering by, by looking at the
+        C{tag} arguments in the URL
 
-        @rtype: C{None} or C{unicode}
+        @rtype: C{list} of C{unicode}
         """
-        tag = request.args.get('tag', [None])[0]
-        if not tag:
-            return None
-        return tag
+        return [tag.decode('utf-8')
+                for tag in request.args.get('tag', []) if tag]
+
+
+    def _matchAllTags(self, request):
+        """
+        Figure out whether the user wants to see blurbs with all of the
+        selected tags, or any of them, by looking at the C{tagMatch} argument
+        in the URL
+
+        @rtype: C{bool}
+        """
+        return request.args.get('tagMatch', ['all'])[0] != 'any'
 
 
     def customizeFor(self, username):
@@ -583,6 +759,37 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
         pass
 
 
+    def cached(self, request, tag):
+        """
+        Render the contents of C{tag} as they were last rendered for our blurb
+        in its current version, with the same descendants and permissions, for
+        the same role and theme, if they have been.  They must not depend on
+        anything else.
+        """
+        blurb = sharing.itemFromProxy(self.original)
+        role = self.getRole()
+        edited = blurb.dateLastEdited
+        if edited is not None:
+            edited = edited.asPOSIXTimestamp()
+        # Dates are rendered differently on the day they fall on, so keep a
+        # day's markup apart from the next.
+        today = Time().asDatetime().date()
+        key = (edited, blurb.subtreeVersion(role), role.storeID,
+               self.docFactory, today)
+        markup = self.fragmentCache.get(blurb, key)
+        if markup is not None:
+            return tags.xml(markup)
+        chunks = []
+        def rendered(ignored):
+            markup = ''.join(chunks)
+            self.fragmentCache.put(blurb, key, markup)
+            return tags.xml(markup)
+        return page.deferflatten(
+            request, _CachedRegion(self, tag.children), False, True,
+            chunks.append).addCallback(rendered)
+    page.renderer(cached)
+
+
     def title(self, request, tag):
         """
         @return: title of our blurb
@@ -591,23 +798,11 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
     page.renderer(title)
 
 
-    def _htmlifyLineBreaks(self, body):
-        """
-        Replace line breaks with <br> elements
-        """
-        return [(tags.xml(line), tags.br) for line
-                    in body.splitlines()]
-
-
     def body(self, request, tag):
         """
         @return: body of our blurb
         """
-        if not self.original.body:
-            return ''
-        document = parseString(self.original.body, beExtremelyLenient=True)
-        body = document.documentElement.toxml()
-        return self._htmlifyLineBreaks(body)
+        return tags.xml(self.original.renderedBody())
     page.renderer(body)
 
 
@@ -623,8 +818,7 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
         """
         @return: child count of our blurb
         """
-        # XXX
-        return str(sum(1 for ign in self.original.view(self.getRole())))
+        return str(self.original.childCount(self.getRole()))
     page.renderer(childCount)
 
 
@@ -636,13 +830,17 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
     page.renderer(childTypeName)
 
 
-    def _getChildBlurbs(self, request):
+    def _getChildBlurbs(self, request, after=None, limit=None):
         """
-        Get the child blurbs of this blurb
+        Get a page of the child blurbs of this blurb
+
+        @param after: see L{ihyperbola.IViewable.view}.
+        @param limit: see L{ihyperbola.IViewable.view}.
 
         @rtype: C{list} of L{xmantissa.sharing.SharedProxy}
         """
-        return list(self.original.view(self.getRole()))
+        return list(self.original.view(
+            self.getRole(), after=after, limit=limit))
 
 
     def _getChildBlurbViews(self, blurbs):
@@ -655,18 +853,57 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
             _docFactorify(f)
             yield f
 
+    def _getThreadViews(self, thread):
+        """
+        Collect the view objects for the blurbs at the top of part of a
+        thread, each of which will render its own replies.
+
+        @param thread: see L{ihyperbola.IViewable.thread}.
+        """
+        for blurb, replies in thread:
+            f = blurbViewDispatcher(blurb)
+            f._replies = replies
+            f.setFragmentParent(self)
+            _docFactorify(f)
+            yield f
+
+
+    def thread(self, request, tag):
+        """
+        Render all the descendants of this blurb, as far down as
+        L{threadDepth}, each followed by its replies
+        """
+        thread = self.original.thread(self.getRole(), self.threadDepth)
+        if not thread:
+            p = inevow.IQ(tag).onePattern('no-child-blurbs')
+            return p.fillSlots('child-type-name', self._childTypeName)
+        return self._getThreadViews(thread)
+    page.renderer(thread)
+
+
+    def replies(self, request, tag):
+        """
+        Render the replies to this blurb, if it is being rendered as part of
+        the thread of one of its ancestors
+        """
+        if not self._replies:
+            return ''
+        return tag[self._getThreadViews(self._replies)]
+    page.renderer(replies)
+
+
     def view(self, request, tag):
         """
         Render the child blurbs of this blurb
         """
-        blurbs = self._getChildBlurbs(request)
-        if 0 < len(blurbs):
+        if self.original.hasChildren(self.getRole()):
+            role = self.getRole()
             blurbItem = sharing.itemFromProxy(self.original)
             fragment = ShareScrollingElement(
-                self.getRole(),
+                role,
                 blurbItem.store,
                 Blurb,
-                Blurb.parent == blurbItem,
+                blurbItem.childrenVisibleTo(role),
                 [_BlurbTimestampColumn(), BlurbViewColumn()],
                 Blurb.dateCreated, False,
                 ixmantissa.IWebTranslator(blurbItem.store))
@@ -706,10 +943,21 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
         Return the absolute URL the websharing system makes this blurb
         available at.
         """
+        return self._linkTo(self.original)
+
+
+    def _linkTo(self, blurb):
+        """
+        Return the absolute URL the websharing system makes a blurb in the
+        same store as this one available at.
+
+        @type blurb: L{xmantissa.sharing.SharedProxy}
+        @rtype: C{str}
+        """
         subStore = sharing.itemFromProxy(self.original).store
         site = ixmantissa.ISiteURLGenerator(subStore.parent)
         siteURL = site.encryptedRoot()
-        blurbURL = websharing.linkTo(self.original)
+        blurbURL = websharing.linkTo(blurb)
         blurbURL.netloc = siteURL.netloc
         blurbURL.scheme = siteURL.scheme
         return str(blurbURL)
@@ -718,6 +966,16 @@ class BlurbViewer(athena.LiveElement, rend.ChildLookupMixin):
     def child_rss(self, ctx):
         return rss.Feed(self)
 
+
+    def child_atom(self, ctx):
+        """
+        Return an L{rss.AtomFeed} of the children of this blurb, through
+        which its archives can be found.
+        """
+        return rss.AtomFeed(self)
+
+
+
 class _BlogPostBlurbViewer(BlurbViewer):
     """
     L{BlurbViewer} subclass for rendering blurbs of type L{FLAVOR.BLOG_POST}
@@ -745,10 +1003,10 @@ class _BlogPostBlurbViewer(BlurbViewer):
         iq = inevow.IQ(self.docFactory)
         separatorPattern = iq.patternGenerator('tag-separator')
         tags = []
-        selectedTag = self._getSelectedTag(request)
+        selectedTags = self._getSelectedTags(request)
 
         for tag in self.original.tags():
-            if tag == selectedTag:
+            if tag in selectedTags:
                 p = 'selected-tag'
             else:
                 p = 'tag'
@@ -787,6 +1045,14 @@ class _BlogPostBlurbViewer(BlurbViewer):
     page.renderer(deleteLink)
 
 
+    def child_rss(self, ctx):
+        """
+        Return an L{rss.CommentFeed} of the comments on this blog post, and
+        the replies to them.
+        """
+        return rss.CommentFeed(self)
+
+
     def delete(self):
         """
         Unshare and delete our blurb, and all of its children
@@ -903,28 +1169,31 @@ class BlogBlurbViewer(BlurbViewer):
 
     def _getAllTags(self):
         """
-        Get all the tags which have been applied to blurbs in the same store
-        as the underlying item of our blurb.
+        Get all the tags which have been applied to the children of our
+        blurb.
 
         @rtype: C{list} of C{unicode}
         """
-        store = sharing.itemFromProxy(self.original).store
-        # query instead of using Catalog so that tags only applied to
-        # PastBlurb items don't get included
-        return list(store.query(
-            Tag, Tag.object == Blurb.storeID).getColumn('name').distinct())
+        blurb = sharing.itemFromProxy(self.original)
+        return [name for (name, count) in blurb.childTagCounts()]
 
-    def _getChildBlurbs(self, request):
+    def _getChildBlurbs(self, request, after=None, limit=None):
         """
-        Get the child blurbs of this blurb, filtering by the selected tag
+        Get a page of the child blurbs of this blurb, filtering by the
+        selected tags
+
+        @param after: see L{ihyperbola.IViewable.view}.
+        @param limit: see L{ihyperbola.IViewable.view}.
 
         @rtype: C{list} of L{xmantissa.sharing.SharedProxy}
         """
-        tag = self._getSelectedTag(request)
-        if tag is not None:
-            return list(self.original.viewByTag(
-                self.getRole(), tag.decode('utf-8')))
-        return list(self.original.view(self.getRole()))
+        tags = self._getSelectedTags(request)
+        if tags:
+            return list(self.original.viewByTags(
+                self.getRole(), tags, self._matchAllTags(request),
+                after=after, limit=limit))
+        return list(self.original.view(
+            self.getRole(), after=after, limit=limit))
 
 
     def tags(self, request, tag):
@@ -932,9 +1201,9 @@ class BlogBlurbViewer(BlurbViewer):
         Render all tags
         """
         iq = inevow.IQ(self.docFactory)
-        selTag = self._getSelectedTag(request)
+        selTags = self._getSelectedTags(request)
         for tag in self._getAllTags():
-            if tag == selTag:
+            if tag in selTags:
                 pattern = 'selected-tag'
             else:
                  pattern = 'tag'
@@ -36,15 +36,20 @@ class IViewable(Interface):
         'A reference to another L{IViewable} provider, which this was in '
         'response to.')
 
-    def view(role):
+    def view(role, after=None, limit=None):
         """
         Return an iterator of all the children of this viewable, which are
         themselves providers of IViewable (and possibly other interfaces in
         this module).  Only IViewable providers visible to the current role
-        will be yielded.
+        will be yielded, newest first.
+
+        @param after: the L{pageKey} of the last child yielded by a previous
+        call, to continue from there, or C{None} to start with the newest
+        child.
+        @param limit: the maximum number of children to yield, or C{None}.
         """
 
-    def viewByTag(role, tag):
+    def viewByTag(role, tag, after=None, limit=None):
         """
         Same as L{view}, but only children tagged with C{tag} will be returned
 
@@ -52,12 +57,71 @@ class IViewable(Interface):
         @type tag: C{unicode}
         """
 
+    def viewByTags(role, tags, matchAll=True, after=None, limit=None):
+        """
+        Same as L{view}, but only children tagged with every one of C{tags},
+        or with any of them if C{matchAll} is false, will be returned
+
+        @param tags: the tag names
+        @type tags: C{list} of C{unicode}
+        """
+
+    def viewDescendants(role, limit=None):
+        """
+        Same as L{view}, but the descendants of this viewable at any depth
+        which are visible to C{role} will be returned, newest first.
+        """
+
+    def hasChildren(role):
+        """
+        Return whether L{view} would yield any children for C{role}.
+        """
+
+    def thread(role, maxDepth=None):
+        """
+        Return the descendants of this viewable which are visible to C{role},
+        and whose ancestors below this viewable are too, as a tree.  It is a
+        list of C{(viewable, replies)} pairs for the children of this
+        viewable, oldest first, where C{replies} is a list of the same form
+        for the children of C{viewable}.
+
+        @param maxDepth: the depth below this viewable to stop at, or C{None}
+        to include every descendant.
+        """
+
+    def subtreeVersion(role):
+        """
+        Return a C{(time, revision)} pair which changes whenever this
+        viewable, or the set of its descendants which are visible to C{role},
+        does: the latest L{epsilon.extime.Time} at which any of them was
+        posted or changed, or C{None}, and an C{int} which increases each time
+        any of them changes.
+        """
+
+    def pageKey():
+        """
+        Return a key which orders this viewable among its siblings, for use
+        as the C{after} argument to L{view}.
+        """
+
+    def childCount(role):
+        """
+        Return the number of children of this viewable which are visible to
+        C{role}; that is, the number of items L{view} would return.
+        """
+
     def tags():
         """
         Return an iterable of the names of tags that have been applied to this
         viewable
         """
 
+    def renderedBody():
+        """
+        Return the XHTML which should be displayed for the body of this
+        viewable, which is well-formed even if the body itself is not.
+        """
+
 
 
 class ICommentable(IViewable):
@@ -2,7 +2,6 @@
 // import Mantissa.LiveForm
 // import Mantissa.AutoComplete
 // import Mantissa.ScrollTable
-// import Mantissa.DOMReplace
 
 
 
@@ -71,20 +70,6 @@ Hyperbola.BlogPostBlurbController = Nevow.Athena.Widget.subclass('Hyperbola.Blog
  * Controller class for blurbs of the BLOG_POST flavor.
  */
 Hyperbola.BlogPostBlurbController.methods(
-    function __init__(self, node) {
-        Hyperbola.BlogPostBlurbController.upcall(self, '__init__', node);
-        self._highlightURLs();
-    },
-
-    /**
-     * Highlight any URLs that appear in the body of this blog post.
-     */
-    function _highlightURLs(self) {
-        var bodyContainerNode = self.firstNodeByAttribute(
-            'class', 'hyperbola-blurb-body');
-        Mantissa.DOMReplace.urlsToLinks(bodyContainerNode);
-    },
-
     function togglePostComments(self) {
         var node = self.firstNodeByAttribute(
             'class', 'hyperbola-blog-post-comments');
@@ -0,0 +1,137 @@
+# -*- test-case-name: hyperbola.test.test_normalize -*-
+
+"""
+This module turns the bodies of blurbs, as their authors wrote them, into
+the XHTML which is displayed.  L{normalize} is run once when a blurb is
+posted or edited, and its result is stored next to the body, so that
+displaying a blurb never has to parse it.
+"""
+
+import re
+
+from twisted.web import microdom
+from twisted.web.sux import ParseError
+
+
+
+def wellFormed(body):
+    """
+    Parse C{body} leniently, so that it can be displayed even if it is not
+    well-formed.  Bodies which cannot be parsed at all, or which parse into
+    elements that cannot be serialized again, are escaped and displayed as
+    text.
+
+    @type body: C{unicode}
+    @rtype: L{microdom.Element}
+    """
+    try:
+        element = microdom.parseString(
+            body, beExtremelyLenient=True).documentElement
+        # Lenient parsing accepts some namespace prefixes which microdom
+        # then fails to write out, so find out now rather than after the
+        # other steps.
+        element.toxml()
+    except (ParseError, AttributeError):
+        # This is what lenient parsing gives for text without any markup.
+        element = microdom.Element('html')
+        element.appendChild(microdom.Text(body))
+    return element
+
+
+
+# The same URLs as Mantissa.DOMReplace.urlsToLinks finds.
+_URL = re.compile(r'''(?:\w+://|www\.)[^\s<>'()"]+[^\s<>()'"?.]''')
+
+
+
+def _linkURLsIn(node):
+    """
+    Replace the URLs in the text inside C{node}, but not inside any links
+    below it, with links to them.
+
+    @type node: L{microdom.Element}
+    """
+    for child in list(node.childNodes):
+        if isinstance(child, microdom.Element):
+            if child.tagName.lower() != 'a':
+                _linkURLsIn(child)
+        elif isinstance(child, microdom.Text):
+            text = child.nodeValue
+            start = 0
+            for match in _URL.finditer(text):
+                url = match.group()
+                if url[:3].lower() == 'www':
+                    target = u'http://' + url
+                else:
+                    target = url
+                link = microdom.Element(
+                    'a', {'href': target, 'target': '_blank'})
+                link.appendChild(microdom.Text(url))
+                node.insertBefore(
+                    microdom.Text(text[start:match.start()]), child)
+                node.insertBefore(link, child)
+                start = match.end()
+            if start:
+                node.insertBefore(microdom.Text(text[start:]), child)
+                node.removeChild(child)
+
+
+
+def linkURLs(element):
+    """
+    Turn the URLs in the text of C{element} into links, unless it is a link
+    itself.
+
+    @type element: L{microdom.Element}
+    @rtype: L{microdom.Element}
+    """
+    if element.tagName.lower() != 'a':
+        _linkURLsIn(element)
+    return element
+
+
+
+def toXML(element):
+    """
+    Serialize C{element}.
+
+    @type element: L{microdom.Element}
+    @rtype: C{unicode}
+    """
+    return element.toxml()
+
+
+
+def breakLines(body):
+    """
+    End every line of C{body} with a C{br} element.
+
+    @type body: C{unicode}
+    @rtype: C{unicode}
+    """
+    return u''.join([line + u'<br />' for line in body.splitlines()])
+
+
+
+# The steps of normalization, in order.  Each is a callable which takes a body
+# and returns a new one.  The body is parsed once, by the first, and the
+# steps before toXML are given the parsed element; the steps after it are
+# given well-formed XHTML.  Blurbs normalized before a step is added can be
+# normalized again with "axiomatic hyperbola normalize --all".
+NORMALIZERS = [wellFormed, linkURLs, toXML, breakLines]
+
+
+
+def normalize(body):
+    """
+    Turn the body of a blurb into the XHTML which should be displayed for
+    it, by running it through each of L{NORMALIZERS}.
+
+    @type body: C{unicode}
+    @rtype: C{unicode}
+    """
+    if not body:
+        return u''
+    for normalizer in NORMALIZERS:
+        body = normalizer(body)
+    return body
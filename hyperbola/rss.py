@@ -1,11 +1,23 @@
 """Really Simple Syndication.
 
-Provides a Page subclass which renders an RSS 2.0 feed for a given channel.
+Provides Page subclasses which render an RSS 2.0 feed for a given channel,
+and an Atom feed of it which is paged into archives as RFC 5005 describes.
 """
 
-from nevow import inevow, loaders, rend, tags
+import math
+import zlib
+from urllib import quote
+
+from twisted.web import http
+
+from epsilon.extime import Time
+
+from nevow import inevow, rend, tags
+from nevow.flat import flatten
 from zope.interface import implements
 
+from xmantissa.sharing import itemFromProxy
+
 _RSS_TAGS = (
     'rss', 'channel', 'link', 'title', 'copyright', 'description',
     'item', 'author', 'pubDate', 'guid', 'language', 'lastBuildDate')
@@ -14,11 +26,208 @@ RSS = type(
     (object,),
     dict([(k, tags.Proto(k)) for k in _RSS_TAGS]))
 
-class Feed(rend.Page):
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+HISTORY_NS = 'http://purl.org/syndication/history/1.0'
+_ATOM_TAGS = (
+    'feed', 'id', 'title', 'subtitle', 'updated', 'published', 'link',
+    'entry', 'author', 'name', 'content')
+ATOM = type(
+    'ATOM',
+    (object,),
+    dict([(k, tags.Proto(k)) for k in _ATOM_TAGS] +
+         [('archive', tags.Proto('fh:archive'))]))
+
+# Axiom stores times as integral microseconds since the epoch.
+MICRO = 1000000.0
+
+
+
+def _matchesETag(etag, header):
+    """
+    Determine whether an C{If-None-Match} header matches an entity tag, by
+    the weak comparison which RFC 7232 specifies for it.
+
+    @type etag: C{str}
+    @param header: the value of the header.
+    @type header: C{str}
+    @rtype: C{bool}
+    """
+    def opaque(tag):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        return tag
+    tags = [opaque(tag) for tag in header.split(',')]
+    return '*' in tags or opaque(etag) in tags
+
+
+
+def notModified(request, version):
+    """
+    Set the C{ETag} and C{Last-Modified} headers of the response to a
+    request for a view of a subtree of blurbs, and find out whether the
+    client already has the current version of it.  If it does, the response
+    code is set to 304 (Not Modified), and nothing else should be written.
+
+    C{If-None-Match} takes precedence over C{If-Modified-Since}, as RFC 7232
+    requires, since only the entity tag changes when a blurb is deleted.
+
+    @param request: an L{inevow.IRequest}.
+
+    @param version: the result of L{ihyperbola.IViewable.subtreeVersion}
+    for the subtree being viewed.
+
+    @rtype: C{bool}
+    """
+    latest, count = version
+    if latest is None:
+        timestamp = 0
+    else:
+        timestamp = latest.asPOSIXTimestamp()
+    etag = '"%x-%x"' % (int(timestamp * 1000000), count)
+    request.setHeader('etag', etag)
+    # HTTP dates are only good for whole seconds.
+    lastModified = int(math.ceil(timestamp))
+    if latest is not None:
+        request.setHeader('last-modified', http.datetimeToString(lastModified))
+
+    noneMatch = request.getHeader('if-none-match')
+    modifiedSince = request.getHeader('if-modified-since')
+    if noneMatch is not None:
+        matched = _matchesETag(etag, noneMatch)
+    elif modifiedSince is not None and latest is not None:
+        try:
+            since = http.stringToDatetime(modifiedSince.split(';', 1)[0])
+        except ValueError:
+            matched = False
+        else:
+            matched = since >= lastModified
+    else:
+        matched = False
+    if matched:
+        request.setResponseCode(http.NOT_MODIFIED)
+    return matched
+
+
+
+def formatPageKey(key):
+    """
+    Turn the L{ihyperbola.IViewable.pageKey} of a blurb into a URL segment.
+
+    @type key: C{tuple} of L{Time} and C{int}
+    @rtype: C{str}
+    """
+    dateCreated, storeID = key
+    return '%d-%d' % (int(dateCreated.asPOSIXTimestamp() * MICRO), storeID)
+
+
+
+def parsePageKey(segment):
+    """
+    Turn a URL segment made by L{formatPageKey} back into a page key.
+
+    @type segment: C{str}
+    @rtype: C{tuple} of L{Time} and C{int}
+
+    @raise ValueError: if C{segment} was not made by L{formatPageKey}.
+    """
+    microseconds, storeID = segment.split('-')
+    return (Time.fromPOSIXTimestamp(int(microseconds) / MICRO), int(storeID))
+
+
+
+def _lastChanged(blurb):
+    """
+    @return: the L{Time} a blurb was last posted or edited at.
+    """
+    return blurb.dateLastEdited or blurb.dateCreated or Time()
+
+
+
+class _FeedPage(rend.Page):
+    """
+    Base class for feeds of the children of a blurb.  Requests for them are
+    validated by L{notModified}, and the serialized feed is kept in the
+    C{feedCache} of the viewer it is for until the blurb or one of its
+    children changes.
+
+    Subclasses must implement L{_render}, and may override L{_cacheKey},
+    L{_setCacheHeaders} and L{_version} for feeds which depend on more
+    than the blurb and the role viewing it.
+
+    @type original: A L{hyperbola.hyperbola_view.BlurbViewer}.
+    @ivar original: The view of the blurb whose children are to be rendered.
+
+    @type contentType: C{str}
+    @ivar contentType: The MIME type of the feed.
+
+    @type maxItems: C{int}
+    @ivar maxItems: The number of children to include.
+    """
+    contentType = 'text/xml'
+    maxItems = 20
+
+    def _cacheKey(self, request):
+        """
+        Identify everything the feed depends on besides the version of the
+        blurb and the role viewing it.
+        """
+        return ()
+
+    def _setCacheHeaders(self, request):
+        """
+        Set any headers which control how long the feed may be cached for.
+        """
+
+    def _version(self):
+        """
+        Describe the current version of the feed, in the form of
+        L{ihyperbola.IViewable.subtreeVersion}'s result, which changes
+        whenever the feed does.  By default, this is the version of the blurb
+        and all of its descendants.
+        """
+        viewer = self.original
+        return viewer.original.subtreeVersion(viewer.getRole())
+
+    def _render(self, request, version):
+        """
+        Serialize the feed.  Subclasses must implement this.
+
+        @param version: the result of L{_version}.
+
+        @rtype: C{str}
+        """
+        raise NotImplementedError()
+
+    def renderHTTP(self, ctx):
+        """
+        Render the feed, unless the client already has the current version of
+        it, in which case respond with only its validators.
+        """
+        request = inevow.IRequest(ctx)
+        request.setHeader('content-type', self.contentType)
+        self._setCacheHeaders(request)
+        viewer = self.original
+        role = viewer.getRole()
+        version = self._version()
+        if notModified(request, version):
+            return ''
+        blurb = itemFromProxy(viewer.original)
+        key = (self.__class__, version, role.storeID,
+               self._cacheKey(request), self.maxItems)
+        feed = viewer.feedCache.get(blurb, key)
+        if feed is None:
+            feed = self._render(request, version)
+            viewer.feedCache.put(blurb, key, feed)
+        request.write(feed)
+        return ''
+
+
+
+class Feed(_FeedPage):
     implements(inevow.IResource)
     """
-    @type original: A L{hyperbola.hyperblurb.Blurb}.
-    @ivar original: The item whose children are to be rendered.
+    An RSS 2.0 feed of the newest children of a blurb.
 
     @type title: C{unicode}
     @ivar title: This channel's title
@@ -38,8 +247,12 @@ class Feed(rend.Page):
 
     @type timestamp: L{epsilon.extime.Time}
     @ivar timestamp: The time and date at which this channel last changed.
+
+    @type tag: C{unicode} or C{None}
+    @ivar tag: The tag which the children in this channel must have, or
+    C{None} for every child.
     """
-    def __init__(self, parent):
+    def __init__(self, parent, tag=None):
         rend.Page.__init__(self, parent)
         self.title = parent.original.title
         self.link = parent._absoluteURL()
@@ -49,12 +262,54 @@ class Feed(rend.Page):
         self.timestamp = (parent.original.dateLastEdited or
                           parent.original.dateCreated or
                           Time())
+        self.tag = tag
+        if tag is not None:
+            self.title = u'%s: %s' % (self.title, tag)
+            self.link += '?tag=' + quote(tag.encode('utf-8'), '')
 
-    def renderHTTP(self, ctx):
-        inevow.IRequest(ctx).setHeader('content-type', 'text/xml')
-        return rend.Page.renderHTTP(self, ctx)
+    def locateChild(self, ctx, segments):
+        """
+        Find the feed of the children with a particular tag, at
+        C{tag/<name>}.
+        """
+        if (self.tag is None and len(segments) == 2 and
+            segments[0] == 'tag' and segments[1]):
+            try:
+                tag = segments[1].decode('utf-8')
+            except UnicodeDecodeError:
+                return rend.NotFound
+            return Feed(self.original, tag), ()
+        return rend.NotFound
+
+    def _cacheKey(self, request):
+        viewer = self.original
+        if self.tag is not None:
+            return self.tag
+        return (tuple(viewer._getSelectedTags(request)),
+                viewer._matchAllTags(request))
+
+    def _children(self, request):
+        """
+        Collect the newest L{maxItems} children of our blurb which belong in
+        this channel.
 
-    def render_channelInfo(self, ctx, data):
+        @return: an iterable of L{xmantissa.sharing.SharedProxy} instances.
+        """
+        viewer = self.original
+        if self.tag is not None:
+            return viewer.original.viewByTag(
+                viewer.getRole(), self.tag, limit=self.maxItems)
+        return viewer._getChildBlurbs(request, limit=self.maxItems)
+
+    def _render(self, request, version):
+        if version[0] is not None:
+            self.timestamp = version[0]
+        return flatten(RSS.rss(version="2.0")[
+            RSS.channel[
+                self._channelInfo(),
+                self._items(request)]])
+
+    def _channelInfo(self):
         yield RSS.title[self.title]
         yield RSS.link[self.link]
         yield RSS.description[self.description]
@@ -62,20 +317,197 @@ class Feed(rend.Page):
         yield RSS.language[self.language]
         yield RSS.lastBuildDate[self.timestamp.asRFC2822()]
 
-    def render_items(self, ctx, data):
-        request = inevow.IRequest(ctx)
-        for item in self.original._getChildBlurbViews(
-            self.original._getChildBlurbs(request)):
+    def _items(self, request):
+        """
+        Describe the children in this channel, from their own attributes,
+        without making views of them.
+        """
+        viewer = self.original
+        for blurb in self._children(request):
             yield RSS.item[
-                RSS.title[item.original.title],
-                RSS.link[item._absoluteURL()],
-                RSS.description[item.original.body],
-                RSS.author[item.original.author.externalID],
-                RSS.pubDate[(item.original.dateLastEdited or
-                            item.original.dateCreated or
-                            Time()).asRFC2822()]]
-
-    docFactory = loaders.stan(RSS.rss(version="2.0")[
-        RSS.channel[
-            render_channelInfo,
-            render_items]])
+                RSS.title[blurb.title],
+                RSS.link[viewer._linkTo(blurb)],
+                RSS.description[blurb.body],
+                RSS.author[blurb.author.externalID],
+                RSS.pubDate[_lastChanged(blurb).asRFC2822()]]
+
+
+
+class CommentFeed(Feed):
+    """
+    An RSS 2.0 feed of the newest comments on a blurb, such as a blog post,
+    and of the replies to them.
+    """
+    def __init__(self, parent):
+        Feed.__init__(self, parent)
+        self.title = u'Comments on %s' % (self.title,)
+
+    def locateChild(self, ctx, segments):
+        """
+        Comments are not tagged, so there are no feeds of them by tag.
+        """
+        return rend.NotFound
+
+    def _cacheKey(self, request):
+        return ()
+
+    def _children(self, request):
+        viewer = self.original
+        return viewer.original.viewDescendants(
+            viewer.getRole(), limit=self.maxItems)
+
+
+
+class AtomFeed(_FeedPage):
+    """
+    An Atom feed of the children of a blurb, newest first, paged into
+    archives as RFC 5005 describes.  The subscription feed, at C{atom},
+    holds the newest L{maxItems} children.  The archives, at C{atom/<key>},
+    each hold the L{maxItems} children before the one whose page key is in
+    the URL, and link to the next older archive, so that each is one keyset
+    query however old it is.
+
+    The archives are counted from the oldest child: the subscription feed
+    links to the archive which ends a multiple of L{maxItems} children after
+    the oldest one.  New children are always newer than the children already
+    archived, so they never change an archive or its URL, and archives are
+    served with a long cache lifetime.  Deleting a child does move the
+    archives newer than it, and changes the one it was in.
+
+    @type before: C{tuple} or C{None}
+    @ivar before: The L{ihyperbola.IViewable.pageKey} of the child which
+    this archive comes after, or C{None} for the subscription feed.
+
+    @type archiveMaxAge: C{int}
+    @ivar archiveMaxAge: The number of seconds archives may be cached for.
+    """
+    contentType = 'application/atom+xml'
+    archiveMaxAge = 60 * 60 * 24 * 30
+
+    def __init__(self, parent, before=None):
+        rend.Page.__init__(self, parent)
+        self.before = before
+        self._page = None
+
+    def childFactory(self, ctx, name):
+        """
+        Find the archive named by C{name}, if this is the subscription feed.
+        """
+        if self.before is None:
+            try:
+                before = parsePageKey(name)
+            except ValueError:
+                return None
+            return AtomFeed(self.original, before)
+        return None
+
+    def _children(self):
+        """
+        Collect the children in this feed, newest first, and one more child
+        after them if there is one, to link to the archive before them.
+        Each L{AtomFeed} is made for a single request, so they are only
+        queried once, whether for the validators of an archive or to render
+        the feed.
+        """
+        if self._page is None:
+            viewer = self.original
+            self._page = list(viewer.original.view(
+                viewer.getRole(), after=self.before,
+                limit=self.maxItems + 1))
+        return self._page
+
+    def _cacheKey(self, request):
+        return self.before
+
+    def _setCacheHeaders(self, request):
+        if self.before is not None:
+            if self.original.customizedFor is None:
+                visibility = 'public'
+            else:
+                visibility = 'private'
+            request.setHeader(
+                'cache-control',
+                '%s, max-age=%d' % (visibility, self.archiveMaxAge))
+
+    def _version(self):
+        """
+        Describe an archive by the children in it, and by our blurb itself,
+        so that posting new children does not change it.
+        """
+        if self.before is None:
+            return _FeedPage._version(self)
+        children = self._children()[:self.maxItems]
+        latest = max([_lastChanged(self.original.original)] +
+                     [_lastChanged(child) for child in children])
+        storeIDs = ','.join([str(itemFromProxy(child).storeID)
+                             for child in children])
+        return (latest, zlib.crc32(storeIDs) & 0xffffffff)
+
+    def _olderArchive(self, children):
+        """
+        Find the page key which the archive before the children in this feed
+        is named by, if there is one.
+
+        @param children: the result of L{_children}.
+
+        @rtype: C{tuple} or C{None}
+        """
+        if len(children) <= self.maxItems:
+            return None
+        if self.before is not None:
+            return children[self.maxItems - 1].pageKey()
+        # Line the archives up with the oldest child: the newest of them
+        # ends (count % maxItems) children from the newest child, or with
+        # the oldest child shown here if that is none.
+        viewer = self.original
+        count = viewer.original.childCount(viewer.getRole())
+        return children[(count - 1) % self.maxItems].pageKey()
+
+    def _render(self, request, version):
+        viewer = self.original
+        subscriptionURL = viewer._absoluteURL() + '/atom'
+        if self.before is None:
+            selfURL = subscriptionURL
+        else:
+            selfURL = subscriptionURL + '/' + formatPageKey(self.before)
+        children = self._children()
+
+        links = [ATOM.link(rel='self', href=selfURL),
+                 ATOM.link(rel='alternate', href=viewer._absoluteURL()),
+                 ATOM.link(rel='first', href=subscriptionURL)]
+        if self.before is not None:
+            links.append(ATOM.link(rel='current', href=subscriptionURL))
+        older = self._olderArchive(children)
+        if older is not None:
+            links.append(ATOM.link(
+                rel='prev-archive',
+                href=subscriptionURL + '/' + formatPageKey(older)))
+
+        updated = version[0] or Time()
+        if self.before is not None:
+            archive = [ATOM.archive]
+        else:
+            archive = []
+        return flatten(ATOM.feed(xmlns=ATOM_NS, **{'xmlns:fh': HISTORY_NS})[
+            ATOM.id[selfURL],
+            ATOM.title[viewer.original.title],
+            ATOM.subtitle[viewer.original.body],
+            ATOM.updated[updated.asISO8601TimeAndDate()],
+            links,
+            archive,
+            [self._entry(child) for child in children[:self.maxItems]]])
+
+    def _entry(self, blurb):
+        """
+        Describe a child of our blurb, from its own attributes.
+        """
+        url = self.original._linkTo(blurb)
+        return ATOM.entry[
+            ATOM.id[url],
+            ATOM.title[blurb.title],
+            ATOM.link(rel='alternate', href=url),
+            ATOM.author[ATOM.name[blurb.author.externalID]],
+            ATOM.published[
+                (blurb.dateCreated or Time()).asISO8601TimeAndDate()],
+            ATOM.updated[_lastChanged(blurb).asISO8601TimeAndDate()],
+            ATOM.content(type='html')[blurb.body]]
@@ -0,0 +1,22 @@
+
+from epsilon.extime import Time
+
+from axiom.test.historic.stubloader import saveStub
+
+from xmantissa.sharing import getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+def createDatabase(s):
+    """
+    Create a blog with a post, which has a comment on it.
+    """
+    author = getEveryoneRole(s)
+    parent = None
+    for flavor in (FLAVOR.BLOG, FLAVOR.BLOG_POST, FLAVOR.BLOG_COMMENT):
+        parent = Blurb(store=s, title=flavor, body=flavor, flavor=flavor,
+                       author=author, parent=parent,
+                       dateCreated=Time(), dateLastEdited=Time())
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0xd5145f68112ccb97cde7ab9e9b7e544169aa1a49)
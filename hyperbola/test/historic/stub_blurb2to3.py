@@ -0,0 +1,29 @@
+from epsilon.extime import Time
+
+from axiom.test.historic.stubloader import saveStub
+
+from xmantissa.sharing import getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+def createDatabase(s):
+    """
+    Create a blog with two tagged posts, one of which has been edited and has
+    a tagged comment on it.
+    """
+    author = getEveryoneRole(s)
+    def makeBlurb(flavor, parent, tags):
+        blurb = Blurb(store=s, title=flavor, body=flavor, flavor=flavor,
+                      author=author, parent=parent, hits=0,
+                      dateCreated=Time(), dateLastEdited=Time())
+        for tag in tags:
+            blurb.tag(tag)
+        return blurb
+    blog = makeBlurb(FLAVOR.BLOG, None, [])
+    post = makeBlurb(FLAVOR.BLOG_POST, blog, [u'foo'])
+    post.edit(post.title, post.body, author, [u'foo', u'bar'])
+    makeBlurb(FLAVOR.BLOG_POST, blog, [u'foo'])
+    makeBlurb(FLAVOR.BLOG_COMMENT, post, [u'baz'])
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0x0bf4c1aac3d563bb7accb105fcbe5229298795dd)
@@ -0,0 +1,20 @@
+from epsilon.extime import Time
+
+from axiom.test.historic.stubloader import saveStub
+
+from xmantissa.sharing import getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+def createDatabase(s):
+    """
+    Create a blog with a post whose body is not well-formed.
+    """
+    blog = Blurb(store=s, title=u'Blog', body=u'', flavor=FLAVOR.BLOG,
+                 author=getEveryoneRole(s), hits=0,
+                 dateCreated=Time(), dateLastEdited=Time())
+    blog.post(u'Post', u'<i>see http://example.com/\nnow',
+              getEveryoneRole(s))
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0xe7e69d255f6a7695156e018440c8072e27b3a36e)
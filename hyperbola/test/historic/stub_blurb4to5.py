@@ -0,0 +1,23 @@
+from epsilon.extime import Time
+
+from axiom.test.historic.stubloader import saveStub
+
+from xmantissa.sharing import Role, getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+def createDatabase(s):
+    """
+    Create a blog with a post which everyone can see and a post which only
+    one role can see.
+    """
+    everyone = getEveryoneRole(s)
+    blog = Blurb(store=s, title=u'Blog', body=u'', flavor=FLAVOR.BLOG,
+                 author=everyone, hits=0,
+                 dateCreated=Time(), dateLastEdited=Time())
+    blog.post(u'Public', u'', everyone)
+    friend = Role(store=s, externalID=u'friend@example.com', description=u'')
+    blog.post(u'Private', u'', everyone, {friend: []})
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0xdb81451c27abddef05e54deb2cde07e302a1faa7)
@@ -0,0 +1,23 @@
+from epsilon.extime import Time
+
+from axiom.test.historic.stubloader import saveStub
+
+from xmantissa.sharing import getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+def createDatabase(s):
+    """
+    Create a blog post which has been edited three times.
+    """
+    author = getEveryoneRole(s)
+    post = Blurb(store=s, title=u'title 0', body=u'line 0\nline 1\n',
+                 flavor=FLAVOR.BLOG_POST, author=author, hits=0,
+                 dateCreated=Time(), dateLastEdited=Time())
+    for i in range(1, 4):
+        post.edit(u'title %d' % (i,),
+                  u''.join([u'line %d\n' % (j,) for j in range(i + 2)]),
+                  author, [u'tag %d' % (i,)])
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0x30e347d60fee97f2c8c707b998224400b6f3377a)
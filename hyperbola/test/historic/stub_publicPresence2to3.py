@@ -0,0 +1,17 @@
+from axiom.test.historic.stubloader import saveStub
+
+from axiom.userbase import LoginMethod
+
+from hyperbola.hyperbola_model import HyperbolaPublicPresence
+
+def createDatabase(s):
+    """
+    Create a public presence with a blog in it.
+    """
+    LoginMethod(store=s, localpart=u'me', domain=u'here', internal=True,
+                protocol=u'*', account=s, verified=True)
+    presence = HyperbolaPublicPresence(store=s)
+    presence.createBlog(u'Hello, world', u'My first blog')
+
+if __name__ == '__main__':
+    saveStub(createDatabase, 0xc1fc2405a143bf834b3112fb1f60986614811b66)
@@ -0,0 +1,27 @@
+
+"""
+Tests for the upgrade of L{Blurb} from version 1 to version 2, which
+introduced L{BlurbAncestor}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+
+class BlurbUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperblurb.Blurb}'s 1 to 2 upgrader.
+    """
+    def test_ancestry(self):
+        """
+        The upgrader should record the ancestry of every blurb, so that
+        L{Blurb.ancestors} and L{Blurb.descendants} work on upgraded blurbs.
+        """
+        blog = self.store.findUnique(Blurb, Blurb.flavor == FLAVOR.BLOG)
+        post = self.store.findUnique(Blurb, Blurb.flavor == FLAVOR.BLOG_POST)
+        comment = self.store.findUnique(
+            Blurb, Blurb.flavor == FLAVOR.BLOG_COMMENT)
+        self.assertEqual(list(comment.ancestors()), [post, blog])
+        self.assertEqual(list(blog.descendants()), [post, comment])
+        self.assertEqual(list(blog.ancestors()), [])
@@ -0,0 +1,25 @@
+"""
+Tests for the upgrade of L{Blurb} from version 2 to version 3, which
+introduced L{BlurbTagCount}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+
+class BlurbUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperblurb.Blurb}'s 2 to 3 upgrader.
+    """
+    def test_tagCounts(self):
+        """
+        The upgrader should count the tags of every blurb towards its parent,
+        ignoring the tags of past versions.
+        """
+        blog = self.store.findUnique(Blurb, Blurb.flavor == FLAVOR.BLOG)
+        post = self.store.findFirst(
+            Blurb, Blurb.flavor == FLAVOR.BLOG_POST,
+            sort=Blurb.storeID.ascending)
+        self.assertEqual(blog.childTagCounts(), [(u'bar', 1), (u'foo', 2)])
+        self.assertEqual(post.childTagCounts(), [(u'baz', 1)])
@@ -0,0 +1,28 @@
+"""
+Tests for the upgrade of L{Blurb} from version 3 to version 4, which
+introduced L{Blurb.normalizedBody}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from hyperbola.hyperblurb import Blurb, FLAVOR, normalizeBodies
+
+
+class BlurbUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperblurb.Blurb}'s 3 to 4 upgrader.
+    """
+    def test_normalizedBody(self):
+        """
+        The upgrader should leave bodies to be normalized by
+        L{normalizeBodies}, rendering them as they always were until then.
+        """
+        post = self.store.findUnique(Blurb, Blurb.flavor == FLAVOR.BLOG_POST)
+        self.assertIdentical(post.normalizedBody, None)
+        rendered = post.renderedBody()
+        self.assertEqual(
+            rendered,
+            u'<i>see <a href="http://example.com/" target="_blank">'
+            u'http://example.com/</a><br />now</i><br />')
+        self.assertEqual(normalizeBodies(self.store), 2)
+        self.assertEqual(post.normalizedBody, rendered)
@@ -0,0 +1,32 @@
+"""
+Tests for the upgrade of L{Blurb} from version 4 to version 5, which
+introduced L{BlurbVisibility}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from xmantissa.sharing import Role, getEveryoneRole, itemFromProxy
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+
+class BlurbUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperblurb.Blurb}'s 4 to 5 upgrader.
+    """
+    def test_visibility(self):
+        """
+        The upgrader should record the visibility of every blurb, so that
+        each role sees the children it was shared.
+        """
+        blog = self.store.findUnique(Blurb, Blurb.flavor == FLAVOR.BLOG)
+        friend = self.store.findUnique(
+            Role, Role.externalID == u'friend@example.com')
+        everyone = getEveryoneRole(self.store)
+        self.assertEqual(
+            [post.title for post in blog.view(everyone)], [u'Public'])
+        self.assertEqual(
+            [itemFromProxy(post).title for post in blog.view(friend)],
+            [u'Private'])
+        self.assertEqual(blog.childCount(everyone), 1)
+        self.assertEqual(blog.childCount(friend), 1)
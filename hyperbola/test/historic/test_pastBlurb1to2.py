@@ -0,0 +1,33 @@
+"""
+Tests for the upgrade of L{PastBlurb} from version 1 to version 2, which
+introduced L{PastBlurb.bodyDelta}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from hyperbola.hyperblurb import Blurb, PastBlurb
+
+
+class PastBlurbUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperblurb.PastBlurb}'s 1 to 2 upgrader.
+    """
+    def test_bodies(self):
+        """
+        The upgrader should keep the body of every past version of a blurb
+        available from L{PastBlurb.getBody}, and store some of them as deltas.
+        """
+        post = self.store.findUnique(Blurb)
+        versions = list(self.store.query(
+            PastBlurb, PastBlurb.blurb == post,
+            sort=PastBlurb.storeID.ascending))
+        self.assertEqual(
+            [version.title for version in versions],
+            [u'title 0', u'title 1', u'title 2'])
+        self.assertEqual(
+            [version.getBody() for version in versions],
+            [u'line 0\nline 1\n',
+             u'line 0\nline 1\nline 2\n',
+             u'line 0\nline 1\nline 2\nline 3\n'])
+        self.assertNotEqual(
+            [version.bodyDelta for version in versions], [None] * 3)
@@ -0,0 +1,44 @@
+"""
+Tests for the upgrade of L{HyperbolaPublicPresence} from version 2 to version
+3, which introduced L{BlurbIndexer}.
+"""
+
+from axiom.test.historic.stubloader import StubbedTest
+
+from xmantissa.sharing import getEveryoneRole, itemFromProxy
+
+from hyperbola.hyperbola_model import HyperbolaPublicPresence
+from hyperbola.hyperblurb import Blurb, BlurbIndexer, BlurbSource
+
+
+class PublicPresenceUpgradeTestCase(StubbedTest):
+    """
+    Tests for L{hyperbola.hyperbola_model.HyperbolaPublicPresence}'s 2 to 3
+    upgrader.
+    """
+    def test_blurbIndexer(self):
+        """
+        The upgrader should give the public presence a L{BlurbIndexer}, which
+        indexes the blurbs which already exist.
+        """
+        presence = self.store.findUnique(HyperbolaPublicPresence)
+        self.assertIdentical(
+            presence.blurbIndexer, self.store.findUnique(BlurbIndexer))
+        source = self.store.findUnique(BlurbSource)
+        while source.step():
+            pass
+        self.assertEqual(
+            [itemFromProxy(blurb) for blurb in presence.search(
+                getEveryoneRole(self.store), u'world')],
+            [self.store.findUnique(Blurb)])
+
+
+    def test_tagNameIndex(self):
+        """
+        The upgrader should index the tags in the store by name.
+        """
+        self.assertIn(
+            (u'hyperbola_tag_name_object',),
+            self.store.querySchemaSQL(
+                "SELECT name FROM *DATABASE*.sqlite_master "
+                "WHERE type = 'index'"))
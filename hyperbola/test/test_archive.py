@@ -0,0 +1,127 @@
+"""
+Tests for L{hyperbola.archive}.
+"""
+
+from json import loads
+
+from twisted.trial import unittest
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.tags import Catalog
+
+from xmantissa.sharing import (
+    Role, Share, getEveryoneRole, itemFromProxy, shareItem)
+
+from hyperbola import ihyperbola
+from hyperbola.hyperblurb import (
+    Blurb, PastBlurb, FlavorPermission, BlurbChildCount, FLAVOR)
+from hyperbola.archive import exportBlurbs, importBlurbs, _ImportedBlurb
+
+
+
+class ArchiveTestCase(unittest.TestCase):
+    """
+    Tests for L{exportBlurbs} and L{importBlurbs}.
+    """
+    def setUp(self):
+        """
+        Make a blog with a post, which has been edited, and a comment on it.
+        """
+        self.store = Store()
+        self.me = Role(store=self.store, externalID=u'me@example.com',
+                       description=u'')
+        self.blog = Blurb(store=self.store, title=u'Blog', body=u'',
+                          flavor=FLAVOR.BLOG, author=self.me,
+                          dateCreated=Time(), dateLastEdited=Time())
+        shareItem(self.blog, getEveryoneRole(self.store), shareID=u'blog',
+                  interfaces=[ihyperbola.IViewable])
+        self.blog.permitChildren(
+            getEveryoneRole(self.store), FLAVOR.BLOG_POST,
+            ihyperbola.IViewable)
+        self.blog.permitChildren(
+            self.me, FLAVOR.BLOG_POST, ihyperbola.IViewable,
+            ihyperbola.ICommentable)
+        self.post = self._child(self.blog, u'Post')
+        self.post.tag(u'first')
+        self.post.edit(
+            u'Post', u'one\ntwo\nthree\n' * 10, self.me, [u'second'])
+        self.post.edit(
+            u'Post', u'one\ntwo\n' * 10, self.me, [u'second', u'third'])
+        self.comment = self._child(self.post, u'Comment')
+
+
+    def _child(self, parent, title):
+        """
+        Post a child of C{parent} as C{self.me}.
+        """
+        return itemFromProxy(self.me.getShare(
+            parent.post(title, title.lower(), self.me)))
+
+
+    def _describe(self, store):
+        """
+        Describe the blurbs in a store, and everything which refers to them,
+        for comparison.
+        """
+        everyone = getEveryoneRole(store)
+        blurbs = []
+        for blurb in store.query(Blurb, sort=Blurb.storeID.ascending):
+            blurbs.append((
+                    blurb.title, blurb.body, blurb.renderedBody(),
+                    blurb.parent and blurb.parent.title,
+                    blurb.author.externalID,
+                    blurb.dateCreated.asPOSIXTimestamp(),
+                    sorted(blurb.tags()),
+                    [(version.title, version.getBody(),
+                      sorted(store.findUnique(Catalog).tagsOf(version)))
+                     for version in store.query(
+                            PastBlurb, PastBlurb.blurb == blurb,
+                            sort=PastBlurb.storeID.ascending)],
+                    [(permission.flavor, permission.role.externalID,
+                      permission.permissions)
+                     for permission in store.query(
+                            FlavorPermission, FlavorPermission.blurb == blurb,
+                            sort=FlavorPermission.storeID.ascending)],
+                    [child.title for child in blurb.view(everyone)],
+                    blurb.childTagCounts(),
+                    [(share.sharedTo.externalID, share.shareID)
+                     for share in store.query(
+                            Share, Share.sharedItem == blurb,
+                            sort=Share.storeID.ascending)],
+                    sorted((counter.role.externalID, counter.count)
+                           for counter in store.query(
+                            BlurbChildCount,
+                            BlurbChildCount.blurb == blurb))))
+        return blurbs
+
+
+    def test_roundTrip(self):
+        """
+        L{importBlurbs} should recreate the blurbs written by L{exportBlurbs},
+        with their history, tags, flavor permissions, shares and share IDs,
+        and child counts, a few lines in each transaction.
+        """
+        lines = list(exportBlurbs(self.blog))
+        self.assertEqual(
+            [loads(line)[u'type'] for line in lines],
+            [u'blurb', u'permission', u'permission',
+             u'blurb', u'version', u'version', u'blurb'])
+        store = Store()
+        self.assertEqual(importBlurbs(store, lines, 2), 3)
+        self.assertEqual(self._describe(store), self._describe(self.store))
+        self.assertEqual(store.query(_ImportedBlurb).count(), 0)
+
+
+    def test_exportSubtree(self):
+        """
+        L{exportBlurbs} should only describe the given blurb and its
+        descendants, and L{importBlurbs} should make the blurb top-level.
+        """
+        store = Store()
+        importBlurbs(store, exportBlurbs(self.post))
+        self.assertEqual(
+            [(blurb.title, blurb.parent and blurb.parent.title)
+             for blurb in store.query(Blurb, sort=Blurb.storeID.ascending)],
+            [(u'Post', None), (u'Comment', u'Post')])
@@ -4,9 +4,12 @@ viewing logic in Hyperbola.
 """
 
 from axiom.store import Store
+from axiom.attributes import AND
+from axiom.tags import Catalog, Tag
 
 from twisted.python.reflect import qual
 from twisted.trial import unittest
+from twisted.internet.task import Clock
 
 from epsilon.extime import Time
 
@@ -16,6 +19,7 @@ from axiom.plugins.mantissacmd import Mantissa
 from xmantissa.product import Product
 from xmantissa.ixmantissa import IWebViewer
 from xmantissa.sharing import Role, getShare, itemFromProxy, shareItem, NoSuchShare
+from xmantissa.sharing import Share, ALL_IMPLEMENTED, ALL_IMPLEMENTED_DB
 from xmantissa.sharing import getEveryoneRole, getSelfRole
 from xmantissa.publicresource import PublicAthenaLivePage
 from xmantissa.websharing import SharingIndex
@@ -96,6 +100,18 @@ class BlurbTests(unittest.TestCase):
                   interfaces=[ihyperbola.IViewable])
 
 
+    def test_tagNameIndex(self):
+        """
+        Installing L{hyperbola_model.HyperbolaPublicPresence} should index the
+        tags in the store by name.
+        """
+        self.assertIn(
+            (u'hyperbola_tag_name_object',),
+            self.userStore.querySchemaSQL(
+                "SELECT name FROM *DATABASE*.sqlite_master "
+                "WHERE type = 'index'"))
+
+
     def test_postPermissions(self):
         """
         Verify that a post made on the blog by its owner cannot be commented on by
@@ -133,6 +149,187 @@ class BlurbTests(unittest.TestCase):
         self.assertEquals(set(sharedPost.tags()), set(('foo', 'baz')))
 
 
+    def test_changeHooks(self):
+        """
+        Each of L{hyperblurb.blurbChangeHooks} should be called with a blurb
+        when it is edited, tagged or deleted, and with its parent when it is
+        posted or deleted.
+        """
+        changed = []
+        self.patch(hyperblurb, 'blurbChangeHooks', [changed.append])
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        post.tag(u'foo')
+        post.edit(u'', u'', self.me, [])
+        post.delete()
+        self.assertEquals(
+            changed, [self.blog, post, post, self.blog, post])
+
+
+    def test_editUnchangedTags(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.edit} should leave alone the tags of the
+        blurb which were not changed, and keep the tag count of the catalog
+        equal to the number of tags in it.
+        """
+        postShareID = self.blog.post(u'', u'', self.me)
+        post = itemFromProxy(getShare(self.userStore, self.me, postShareID))
+        post.tag(u'foo')
+        post.tag(u'bar')
+        [foo] = self.userStore.query(
+            Tag, AND(Tag.object == post, Tag.name == u'foo'))
+        post.edit(u'', u'', self.me, (u'foo', u'baz'))
+        post.edit(u'', u'', self.me, (u'foo', u'baz'))
+        self.assertIdentical(
+            self.userStore.findUnique(
+                Tag, AND(Tag.object == post, Tag.name == u'foo')),
+            foo)
+        self.assertEquals(set(post.tags()), set((u'foo', u'baz')))
+        self.assertEquals(
+            dict((tagCount.name, tagCount.count) for tagCount in
+                 self.userStore.query(hyperblurb.BlurbTagCount)),
+            {u'foo': 1, u'baz': 1})
+        self.assertEquals(
+            self.userStore.findUnique(Catalog).tagCount,
+            self.userStore.query(Tag).count())
+
+
+    def test_childTagCounts(self):
+        """
+        L{hyperblurb.Blurb.childTagCounts} should count the tags of the
+        blurb's children, as they are applied by L{hyperblurb.Blurb.tag},
+        changed by L{hyperblurb.Blurb.edit} and removed by
+        L{hyperblurb.Blurb.delete}.
+        """
+        first, second = [
+            itemFromProxy(getShare(
+                self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+            for i in range(2)]
+        first.tag(u'foo')
+        first.tag(u'foo')
+        second.tag(u'foo')
+        second.tag(u'bar')
+        self.assertEquals(
+            self.blog.childTagCounts(), [(u'bar', 1), (u'foo', 2)])
+        first.edit(u'', u'', self.me, [u'baz'])
+        self.assertEquals(
+            self.blog.childTagCounts(),
+            [(u'bar', 1), (u'baz', 1), (u'foo', 1)])
+        second.delete()
+        self.assertEquals(self.blog.childTagCounts(), [(u'baz', 1)])
+
+
+    def test_editHistory(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.edit} should save the old title, body and
+        tags of the blurb in a L{hyperblurb.PastBlurb}, storing the body as a
+        delta against the new one when that is smaller, so that
+        L{hyperblurb.PastBlurb.getBody} can rebuild every past body.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        bodies = [u''.join([u'line %d\n' % (j,) for j in range(i * 20)])
+                  for i in range(4)]
+        for i, body in enumerate(bodies):
+            post.edit(u'title %d' % (i,), body, self.me, [u'tag %d' % (i,)])
+        versions = list(self.userStore.query(
+            hyperblurb.PastBlurb, hyperblurb.PastBlurb.blurb == post,
+            sort=hyperblurb.PastBlurb.storeID.ascending))
+        self.assertEquals(
+            [version.getBody() for version in versions],
+            [u''] + bodies[:-1])
+        self.assertEquals(
+            [version.body for version in versions][2:], [None, None])
+        catalog = self.userStore.findUnique(Catalog)
+        self.assertEquals(list(catalog.tagsOf(versions[2])), [u'tag 1'])
+
+
+    def test_revisionPruner(self):
+        """
+        A L{hyperblurb.RevisionPruner} should delete the past versions of a
+        blurb, and their tags, which its policy does not keep, and store the
+        bodies of the versions it keeps against the next version which is
+        kept.
+        """
+        source = self.userStore.findOrCreate(hyperblurb.PastBlurbSource)
+        hyperblurb.RevisionPruner(
+            store=self.userStore, keepRevisions=2, dailyAfterDays=1)
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        midnight = 978307200 # 2001-01-01T00:00:00Z
+        hour = 60 * 60
+        now = Time().asPOSIXTimestamp()
+        dates = [midnight + hour, midnight + 2 * hour,
+                 midnight + 25 * hour, midnight + 26 * hour,
+                 now - 5 * hour, now - 4 * hour, now - 3 * hour]
+        bodies = [u''.join([u'line %d\n' % (j,) for j in range(i * 20)])
+                  for i in range(len(dates) + 1)]
+        post.body = bodies[0]
+        for i, date in enumerate(dates):
+            post.dateLastEdited = Time.fromPOSIXTimestamp(date)
+            post.edit(u'', bodies[i + 1], self.me, [u'tag %d' % (i,)])
+        while source.step():
+            pass
+
+        versions = list(self.userStore.query(
+            hyperblurb.PastBlurb, hyperblurb.PastBlurb.blurb == post,
+            sort=hyperblurb.PastBlurb.storeID.ascending))
+        self.assertEquals(
+            [version.getBody() for version in versions],
+            [bodies[1], bodies[3], bodies[4], bodies[5], bodies[6]])
+        self.assertEquals(
+            set(self.userStore.query(
+                Tag, Tag.object.oneOf(versions)).getColumn('name')),
+            set([u'tag 0', u'tag 2', u'tag 3', u'tag 4', u'tag 5']))
+        self.assertEquals(
+            self.userStore.query(Tag, Tag.object == post).count(), 1)
+        self.assertEquals(self.userStore.query(Tag).count(), 6)
+        self.assertEquals(self.userStore.findUnique(Catalog).tagCount, 6)
+
+
+    def test_revisionPrunerUndated(self):
+        """
+        A L{hyperblurb.RevisionPruner} should treat past versions without a
+        C{dateEdited}, which are made from blurbs without a
+        C{dateLastEdited}, as older than any other.
+        """
+        source = self.userStore.findOrCreate(hyperblurb.PastBlurbSource)
+        hyperblurb.RevisionPruner(
+            store=self.userStore, keepRevisions=1, dailyAfterDays=1)
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        for i in range(3):
+            post.dateLastEdited = None
+            post.edit(u'', unicode(i), self.me, [])
+        post.edit(u'', u'edited', self.me, [])
+        while source.step():
+            pass
+        self.assertEquals(
+            [version.getBody() for version in self.userStore.query(
+                    hyperblurb.PastBlurb, hyperblurb.PastBlurb.blurb == post,
+                    sort=hyperblurb.PastBlurb.storeID.ascending)],
+            [u'1', u'2'])
+
+
+    def test_revisionPrunerOncePerBlurb(self):
+        """
+        A L{hyperblurb.RevisionPruner} created after a blurb has been edited
+        several times should prune that blurb's past versions once, rather
+        than once for each of them.
+        """
+        pruned = []
+        self.patch(hyperblurb.RevisionPruner, '_prune', pruned.append)
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        for i in range(3):
+            post.edit(u'', u'body %d' % (i,), self.me, [])
+        source = self.userStore.findOrCreate(hyperblurb.PastBlurbSource)
+        hyperblurb.RevisionPruner(store=self.userStore)
+        while source.step():
+            pass
+        self.assertEquals(pruned, [post])
+
+
     def test_viewability(self):
         """
         Verify that a blog may be viewed publicly, by retrieving it
@@ -222,6 +419,183 @@ class BlurbTests(unittest.TestCase):
             [p.shareID for p in self.blog.viewByTag(self.me, u'bar')],
             [post2.shareID, post1.shareID])
 
+    def test_hasChildren(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.hasChildren} should tell whether a role
+        can see any of the children of a blurb.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        self.failIf(self.blog.hasChildren(self.me))
+        self.blog.post(u'', u'', self.me, {them: [ihyperbola.IViewable]})
+        self.failIf(self.blog.hasChildren(self.me))
+        self.failUnless(self.blog.hasChildren(them))
+        self.blog.post(u'', u'', self.me)
+        self.failUnless(self.blog.hasChildren(self.me))
+
+
+    def test_thread(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.thread} should collect the descendants
+        of a blurb visible to a role as a tree, oldest first, leaving out
+        those below C{maxDepth} and those whose parents are not visible.
+        """
+        def post(parent, title, roleToPerms=None):
+            return itemFromProxy(getShare(
+                self.userStore, self.me,
+                parent.post(title, u'', self.me, roleToPerms)))
+
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        first = post(self.blog, u'first')
+        reply = post(first, u'reply')
+        post(reply, u'deep')
+        hidden = post(first, u'hidden', {self.me: [ihyperbola.IViewable]})
+        post(hidden, u'orphan')
+        post(self.blog, u'second')
+
+        def titles(thread):
+            return [(proxy.title, titles(replies))
+                    for (proxy, replies) in thread]
+
+        self.assertEquals(
+            titles(self.blog.thread(self.you)),
+            [(u'first', [(u'reply', [(u'deep', [])])]), (u'second', [])])
+        self.assertEquals(
+            titles(self.blog.thread(self.me, 2)),
+            [(u'first', [(u'reply', []), (u'hidden', [])]),
+             (u'second', [])])
+        self.assertEquals(self.blog.thread(them), [])
+
+
+    def test_viewDescendants(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.viewDescendants} should collect at most
+        C{limit} of the descendants of a blurb which are visible to a role,
+        at any depth, newest first.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        def post(parent, title):
+            return itemFromProxy(getShare(
+                self.userStore, self.me,
+                parent.post(title, u'', self.me)))
+        first = post(self.blog, u'first')
+        reply = post(first, u'reply')
+        first.post(u'hidden', u'', self.me, {them: [ihyperbola.IViewable]})
+        post(reply, u'deep')
+
+        self.assertEquals(
+            [proxy.title for proxy in self.blog.viewDescendants(self.you)],
+            [u'deep', u'reply', u'first'])
+        self.assertEquals(
+            [proxy.title for proxy in first.viewDescendants(self.you, 1)],
+            [u'deep'])
+        self.assertEquals(
+            [proxy.title for proxy in first.viewDescendants(them)],
+            [u'hidden'])
+
+
+    def test_subtreeVersion(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.subtreeVersion} should change when a
+        descendant is posted, edited, tagged, has its permissions changed or
+        is deleted, without querying the descendants.
+        """
+        self.assertEquals(
+            self.blog.subtreeVersion(self.you),
+            (self.blog.dateLastEdited, 0))
+
+        post = itemFromProxy(getShare(
+            self.userStore, self.me,
+            self.blog.post(u'post', u'', self.me)))
+        comment = itemFromProxy(getShare(
+            self.userStore, self.me,
+            post.post(u'comment', u'', self.me)))
+        versions = [self.blog.subtreeVersion(self.you)]
+        comment.edit(u'comment', u'edited', self.me, [])
+        versions.append(self.blog.subtreeVersion(self.you))
+        comment.tag(u'foo')
+        versions.append(self.blog.subtreeVersion(self.you))
+        comment.editPermissions({self.me: [ihyperbola.IViewable]})
+        versions.append(self.blog.subtreeVersion(self.you))
+        comment.delete()
+        versions.append(self.blog.subtreeVersion(self.you))
+        self.assertEquals(
+            [revision for (latest, revision) in versions],
+            sorted(set(revision for (latest, revision) in versions)))
+        self.assertEquals(
+            [latest for (latest, revision) in versions],
+            sorted(latest for (latest, revision) in versions))
+
+
+    def test_viewPages(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.view} and
+        L{hyperbola.hyperblurb.Blurb.viewByTag} should collect a page of at
+        most C{limit} visible children, newest first, continuing after the
+        child whose L{hyperbola.hyperblurb.Blurb.pageKey} is C{after}, even
+        if other children were created at the same time.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        posts = [itemFromProxy(getShare(
+                    self.userStore, self.me,
+                    self.blog.post(unicode(i), u'', self.me)))
+                 for i in range(5)]
+        for post in posts:
+            post.tag(u'foo')
+        # dateCreated never changes once a blurb is shared, so tie the
+        # visibility records as well.
+        posts[2].dateCreated = posts[3].dateCreated
+        for visibility in self.userStore.query(
+            hyperblurb.BlurbVisibility,
+            hyperblurb.BlurbVisibility.blurb == posts[2]):
+            visibility.dateCreated = posts[3].dateCreated
+        hidden = self.blog.post(u'hidden', u'', self.me, {them: []})
+        itemFromProxy(getShare(self.userStore, them, hidden)).tag(u'foo')
+
+        for view in [self.blog.view,
+                     lambda *a, **k: self.blog.viewByTag(self.me, u'foo', **k)]:
+            pages = []
+            after = None
+            while True:
+                page = list(view(self.me, after=after, limit=2))
+                if not page:
+                    break
+                pages.append([blurb.title for blurb in page])
+                after = page[-1].pageKey()
+            self.assertEquals(pages, [[u'4', u'3'], [u'2', u'1'], [u'0']])
+
+
+    def test_viewByTags(self):
+        """
+        Test that L{hyperbola.hyperblurb.Blurb.viewByTags} returns children
+        with all of the given tags, or with any of them if C{matchAll} is
+        false
+        """
+        post1, post2, post3 = [
+            getShare(
+                self.userStore, self.me, self.blog.post(u'', u'', self.me))
+            for i in range(3)]
+
+        post1.tag(u'foo')
+        post1.tag(u'bar')
+
+        post2.tag(u'bar')
+        post2.tag(u'baz')
+
+        def shareIDs(*a, **k):
+            return [p.shareID for p in self.blog.viewByTags(self.me, *a, **k)]
+        self.assertEquals(shareIDs([u'foo', u'bar']), [post1.shareID])
+        self.assertEquals(shareIDs([u'foo', u'baz']), [])
+        self.assertEquals(
+            shareIDs([u'foo', u'baz'], matchAll=False),
+            [post2.shareID, post1.shareID])
+        self.assertEquals(
+            shareIDs([u'bar', u'baz'], matchAll=False),
+            [post2.shareID, post1.shareID])
+
     def test_deleteDeletesChildren(self):
         """
         Test that L{hyperbola.hyperblurb.Blurb.delete} deletes child blurbs
@@ -230,6 +604,20 @@ class BlurbTests(unittest.TestCase):
         self.blog.delete()
         self.assertEquals(self.userStore.query(hyperblurb.Blurb).count(), 0)
 
+    def test_deleteDeletesTags(self):
+        """
+        L{hyperbola.hyperblurb.Blurb.delete} should delete the tags of the
+        blurb and of its past versions, and take them out of the tag count of
+        the catalog.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        post.tag(u'foo')
+        post.edit(u'', u'', self.me, [u'foo', u'bar'])
+        post.delete()
+        self.assertEquals(self.userStore.query(Tag).count(), 0)
+        self.assertEquals(self.userStore.findUnique(Catalog).tagCount, 0)
+
     def test_shareToAuthorOnly(self):
         """
         Test that creating a blurb with a single entry for the author in the
@@ -259,6 +647,626 @@ class BlurbTests(unittest.TestCase):
             lambda: getShare(self.userStore, self.you, shareID))
 
 
+    def test_editPermissionsKeepsShares(self):
+        """
+        L{hyperblurb.Blurb.editPermissions} should keep the shares of roles
+        whose interfaces are unchanged, and the share ID of the blurb.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        shareID = self.blog.post(u'', u'', self.me)
+        post = itemFromProxy(getShare(self.userStore, self.me, shareID))
+        myShare = self.userStore.findUnique(
+            Share, AND(Share.sharedItem == post, Share.sharedTo == self.me))
+        self.assertEquals(
+            post.editPermissions({
+                    self.me: myShare.sharedInterfaces,
+                    them: [ihyperbola.IViewable]}),
+            shareID)
+        self.assertIdentical(
+            self.userStore.findUnique(
+                Share, AND(Share.sharedItem == post,
+                           Share.sharedTo == self.me)),
+            myShare)
+        self.assertEquals(
+            getShare(self.userStore, them, shareID).shareID, shareID)
+        self.assertRaises(
+            NoSuchShare, getShare, self.userStore, self.you, shareID)
+
+        post.editPermissions({self.me: [ihyperbola.IViewable]})
+        self.assertEquals(
+            list(getShare(self.userStore, self.me, shareID
+                          ).sharedInterfaces),
+            [ihyperbola.IViewable])
+        self.assertRaises(
+            NoSuchShare, getShare, self.userStore, them, shareID)
+
+
+    def test_editPermissionsSeveralShares(self):
+        """
+        L{hyperblurb.Blurb.editPermissions} should delete every share of a
+        removed role, and change the interfaces of every share of a kept
+        one, when the blurb has been shared to a role more than once.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        shareID = self.blog.post(u'', u'', self.me)
+        post = itemFromProxy(getShare(self.userStore, self.me, shareID))
+        post.shareWith(self.me, [ihyperbola.IViewable], u'mine')
+        post.shareWith(them, [ihyperbola.IViewable], u'theirs')
+        post.shareWith(them, [ihyperbola.IViewable], u'theirs-too')
+        self.assertEquals(
+            post.editPermissions({self.me: [ihyperbola.ICommentable]}),
+            shareID)
+        self.assertEquals(
+            sorted(self.userStore.query(
+                    Share, Share.sharedItem == post).getColumn(
+                    'sharedInterfaceNames')),
+            [qual(ihyperbola.ICommentable)] * 2)
+        for theirID in [u'theirs', u'theirs-too']:
+            self.assertRaises(
+                NoSuchShare, getShare, self.userStore, them, theirID)
+
+
+    def test_editPermissionsAllImplemented(self):
+        """
+        L{hyperblurb.Blurb.editPermissions} should accept L{ALL_IMPLEMENTED}
+        in place of a list of interfaces, as L{shareItem} does.
+        """
+        shareID = self.blog.post(
+            u'', u'', self.me, {self.me: [ihyperbola.IViewable]})
+        post = itemFromProxy(getShare(self.userStore, self.me, shareID))
+        myShare = self.userStore.findUnique(
+            Share, AND(Share.sharedItem == post, Share.sharedTo == self.me))
+        roleToPerms = {self.me: ALL_IMPLEMENTED, self.you: ALL_IMPLEMENTED}
+        self.assertEquals(post.editPermissions(roleToPerms), shareID)
+        self.assertEquals(post.editPermissions(roleToPerms), shareID)
+        self.assertIdentical(
+            self.userStore.findUnique(
+                Share, AND(Share.sharedItem == post,
+                           Share.sharedTo == self.me)),
+            myShare)
+        self.assertEquals(
+            list(self.userStore.query(
+                    Share, Share.sharedItem == post).getColumn(
+                    'sharedInterfaceNames')),
+            [ALL_IMPLEMENTED_DB, ALL_IMPLEMENTED_DB])
+
+
+    def test_editDescendantPermissions(self):
+        """
+        L{hyperblurb.Blurb.editDescendantPermissions} should change the
+        interfaces shared to a role by every descendant of a blurb which is
+        shared to it, and leave the blurb itself alone.
+        """
+        post = self._postThread()
+        post.editDescendantPermissions(self.you, [])
+        self.assertEquals(
+            [list(share.sharedInterfaces) for share in self.userStore.query(
+                    Share, Share.sharedTo == self.you,
+                    sort=Share.storeID.ascending)],
+            [[ihyperbola.ICommentable], [], []])
+
+
+    def test_editDescendantPermissionsInBackground(self):
+        """
+        L{hyperblurb.Blurb.editDescendantPermissions} with
+        C{inBackground=True} should leave changing the shares to a
+        L{hyperblurb.SubtreePermissionEditor}, which changes a few at a time.
+        """
+        post = self._postThread()
+        self.userStore.findOrCreate(
+            hyperblurb.SubtreePermissionEditor, batchSize=2)
+        self.blog.editDescendantPermissions(
+            self.you, [], inBackground=True)
+
+        def locked():
+            return self.userStore.query(
+                Share, AND(Share.sharedTo == self.you,
+                           Share.sharedInterfaceNames == u'')).count()
+
+        self.assertEquals(locked(), 0)
+        source = self.userStore.findUnique(
+            hyperblurb._SubtreePermissionEditSource)
+        source.step()
+        self.assertEquals(locked(), 2)
+        while source.step():
+            pass
+        self.assertEquals(locked(), 3)
+        self.assertEquals(
+            self.userStore.query(
+                hyperblurb._SubtreePermissionEdit).count(), 0)
+
+
+    def test_childCount(self):
+        """
+        L{hyperblurb.Blurb.childCount} should return the number of children
+        of a blurb that are visible to the given role.
+        """
+        self.blog.post(u'', u'', self.me)
+        self.blog.post(u'', u'', self.me, {self.me: [ihyperbola.IViewable]})
+        self.assertEquals(self.blog.childCount(self.me), 2)
+        self.assertEquals(self.blog.childCount(self.you), 1)
+
+
+    def test_childCountReadOnly(self):
+        """
+        L{hyperblurb.Blurb.childCount} should not create a
+        L{hyperblurb.BlurbChildCount} for a role which does not have one.
+        """
+        self.assertEquals(self.blog.childCount(self.you), 0)
+        self.assertEquals(
+            self.userStore.query(hyperblurb.BlurbChildCount).count(), 0)
+
+
+    def test_childCountMaintained(self):
+        """
+        L{hyperblurb.Blurb.post} should create a L{hyperblurb.BlurbChildCount}
+        for each role the new child is shared to, and the counts should be
+        kept up to date as children are posted and deleted.
+        """
+        shareID = self.blog.post(u'', u'', self.me)
+        self.blog.post(u'', u'', self.me, {self.me: [ihyperbola.IViewable]})
+        self.assertEquals(
+            set(self.userStore.query(hyperblurb.BlurbChildCount).getColumn(
+                'role')),
+            set([self.me, self.you]))
+        self.assertEquals(self.blog.childCount(self.you), 1)
+        self.assertEquals(self.blog.childCount(self.me), 2)
+        itemFromProxy(getShare(self.userStore, self.you, shareID)).delete()
+        self.assertEquals(self.blog.childCount(self.you), 0)
+        self.assertEquals(self.blog.childCount(self.me), 1)
+
+
+    def test_shareItemVisibility(self):
+        """
+        A child shared with L{shareItem} rather than
+        L{hyperblurb.Blurb.shareWith} should be listed and counted at once,
+        and should have a L{hyperblurb.BlurbVisibility} recorded for it when
+        the next blurb is posted.
+        """
+        child = hyperblurb.Blurb(
+            store=self.userStore, title=u'', body=u'', author=self.me,
+            hits=0, dateCreated=Time(), dateLastEdited=Time(),
+            flavor=hyperblurb.FLAVOR.BLOG_POST, parent=self.blog)
+        share = shareItem(child, toRole=self.you)
+        self.assertEquals(self.blog.childCount(self.you), 1)
+        self.assertEquals(
+            [itemFromProxy(p) for p in self.blog.view(self.you)], [child])
+        self.blog.post(u'', u'', self.me)
+        self.assertEquals(
+            self.userStore.findUnique(
+                hyperblurb.BlurbVisibility,
+                hyperblurb.BlurbVisibility.share == share).blurb,
+            child)
+        self.assertEquals(self.blog.childCount(self.you), 2)
+
+
+    def test_childrenVisibleToSeveralRoles(self):
+        """
+        L{hyperblurb.Blurb.childrenVisibleTo} should match a child which is
+        visible through more than one of a role's roles only once, so that
+        listings of the children, such as the scrolltable of
+        L{hyperbola.hyperbola_view.BlurbViewer.view}, do not repeat it.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com',
+                    description=u'')
+        them.becomeMemberOf(self.you)
+        shareID = self.blog.post(
+            u'', u'', self.me,
+            {them: [ihyperbola.IViewable], self.you: [ihyperbola.IViewable]})
+        post = itemFromProxy(getShare(self.userStore, them, shareID))
+        children = self.userStore.query(
+            hyperblurb.Blurb, self.blog.childrenVisibleTo(them))
+        self.assertEquals(list(children), [post])
+        self.assertEquals(children.count(), 1)
+
+
+    def test_childCountAfterEditPermissions(self):
+        """
+        L{hyperblurb.Blurb.editPermissions} should cause the child count of
+        the parent blurb to be recomputed.
+        """
+        shareID = self.blog.post(u'', u'', self.me)
+        self.assertEquals(self.blog.childCount(self.you), 1)
+        post = itemFromProxy(getShare(self.userStore, self.me, shareID))
+        post.editPermissions({self.me: [ihyperbola.IViewable]})
+        self.assertEquals(self.blog.childCount(self.you), 0)
+        self.assertEquals(self.blog.childCount(self.me), 1)
+
+
+    def test_visibilityMaintained(self):
+        """
+        A L{hyperblurb.BlurbVisibility} should exist for each role a blurb is
+        shared with, and should follow L{hyperblurb.Blurb.editPermissions}
+        and L{hyperblurb.Blurb.delete}.
+        """
+        shareID = self.blog.post(u'', u'', self.me)
+        post = itemFromProxy(getShare(self.userStore, self.me, shareID))
+
+        def visibleTo():
+            return set(self.userStore.query(
+                hyperblurb.BlurbVisibility,
+                hyperblurb.BlurbVisibility.blurb == post).getColumn('role'))
+
+        self.assertEquals(len(visibleTo()), 2)
+        post.editPermissions({self.me: [ihyperbola.IViewable]})
+        self.assertEquals(visibleTo(), set([self.me]))
+        self.assertEquals(
+            [blurb.storeID for blurb in self.userStore.query(
+                    hyperblurb.Blurb, self.blog.childrenVisibleTo(self.me))],
+            [post.storeID])
+        post.delete()
+        self.assertEquals(
+            self.userStore.query(hyperblurb.BlurbVisibility,
+                                 hyperblurb.BlurbVisibility.parent == self.blog
+                                 ).count(),
+            0)
+
+
+    def test_ancestorsAndDescendants(self):
+        """
+        L{hyperblurb.Blurb.ancestors} should return every blurb above a blurb,
+        nearest first, and L{hyperblurb.Blurb.descendants} should return every
+        blurb below it, shallowest first.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        comment = itemFromProxy(getShare(
+            self.userStore, self.me, post.post(u'', u'', self.me)))
+        self.assertEquals(list(comment.ancestors()), [post, self.blog])
+        self.assertEquals(list(self.blog.ancestors()), [])
+        self.assertEquals(list(self.blog.descendants()), [post, comment])
+        self.assertEquals(list(comment.descendants()), [])
+
+
+    def test_childPermsFromNearestAncestor(self):
+        """
+        L{hyperblurb.Blurb.post} should apply the permissions of the nearest
+        ancestor which has a L{hyperblurb.FlavorPermission} for a role, so
+        that a post can override the permissions given by its blog.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        post.permitChildren(
+            self.you, hyperblurb.FLAVOR.BLOG_COMMENT, ihyperbola.IViewable)
+        shareID = post.post(u'', u'', self.me)
+        comment = getShare(self.userStore, self.you, shareID)
+        self.failIf(ihyperbola.ICommentable.providedBy(comment))
+        self.failUnless(ihyperbola.IViewable.providedBy(comment))
+
+
+    def test_flavorPermissionsCurrent(self):
+        """
+        L{hyperblurb.Blurb._getFlavorPermissions} should reflect changes to
+        the attributes of an existing L{hyperblurb.FlavorPermission}.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com')
+        flavor = hyperblurb.FLAVOR.BLOG_POST
+        self.blog.permitChildren(them, flavor, ihyperbola.IViewable)
+        self.assertEquals(
+            self.blog._getFlavorPermissions(flavor)[them],
+            [ihyperbola.IViewable])
+        permission = self.userStore.findUnique(
+            hyperblurb.FlavorPermission,
+            hyperblurb.FlavorPermission.role == them)
+        permission.permissions = [
+            qual(ihyperbola.ICommentable).decode('ascii')]
+        self.assertEquals(
+            self.blog._getFlavorPermissions(flavor)[them],
+            [ihyperbola.ICommentable])
+
+
+    def test_flavorPermissionInterfacesResolvedOnce(self):
+        """
+        L{hyperblurb.Blurb._getFlavorPermissions} should only resolve the name
+        of each interface in a L{hyperblurb.FlavorPermission} the first time
+        it is needed.
+        """
+        self.patch(hyperblurb, '_namedInterfaces', {})
+        resolved = []
+        namedAny = hyperblurb.namedAny
+        def countingNamedAny(name):
+            resolved.append(name)
+            return namedAny(name)
+        self.patch(hyperblurb, 'namedAny', countingNamedAny)
+        flavor = hyperblurb.FLAVOR.BLOG_POST
+        for i in range(2):
+            self.assertEquals(
+                self.blog._getFlavorPermissions(flavor)[self.you],
+                [ihyperbola.ICommentable])
+        self.assertEquals(resolved, [qual(ihyperbola.ICommentable)])
+
+
+    def test_permitChildrenAppliesToDescendants(self):
+        """
+        L{hyperblurb.Blurb.permitChildren} should affect the children posted
+        to the blurb's descendants as well as its own.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        post.post(u'', u'', self.me)
+        them = Role(store=self.userStore, externalID=u'them@example.com')
+        self.blog.permitChildren(
+            them, hyperblurb.FLAVOR.BLOG_COMMENT, ihyperbola.IViewable)
+        comment = getShare(
+            self.userStore, them, post.post(u'', u'', self.me))
+        self.failUnless(ihyperbola.IViewable.providedBy(comment))
+
+
+    def test_deleteFlavorPermission(self):
+        """
+        Deleting a L{hyperblurb.FlavorPermission} should remove the
+        permissions it contributed.
+        """
+        them = Role(store=self.userStore, externalID=u'them@example.com')
+        flavor = hyperblurb.FLAVOR.BLOG_POST
+        self.blog.permitChildren(them, flavor, ihyperbola.IViewable)
+        self.assertIn(them, self.blog._getFlavorPermissions(flavor))
+        self.userStore.findUnique(
+            hyperblurb.FlavorPermission,
+            hyperblurb.FlavorPermission.role == them).deleteFromStore()
+        self.assertNotIn(them, self.blog._getFlavorPermissions(flavor))
+
+
+    def test_postMany(self):
+        """
+        L{hyperblurb.Blurb.postMany} should create a child for each entry,
+        with the same permissions, ancestry and tags as L{hyperblurb.Blurb.post}
+        would give it, and return the number of children created.
+        """
+        when = Time.fromPOSIXTimestamp(1234)
+        def entries():
+            for i in range(5):
+                yield (u'title %d' % (i,), u'body', self.me,
+                       [u'imported', u'tag %d' % (i % 2,)], when)
+        self.assertEquals(self.blog.childCount(self.you), 0)
+        self.assertEquals(self.blog.postMany(entries(), batchSize=2), 5)
+
+        children = list(self.userStore.query(
+            hyperblurb.Blurb, hyperblurb.Blurb.parent == self.blog,
+            sort=hyperblurb.Blurb.storeID.ascending))
+        self.assertEquals(
+            [child.title for child in children],
+            [u'title %d' % (i,) for i in range(5)])
+        for child in children:
+            self.assertEquals(child.flavor, hyperblurb.FLAVOR.BLOG_POST)
+            self.assertEquals(child.dateCreated, when)
+            self.assertEquals(list(child.ancestors()), [self.blog])
+            shares = list(self.userStore.query(
+                Share, Share.sharedItem == child))
+            self.assertEquals(
+                set(share.sharedTo for share in shares),
+                set([self.me, self.you]))
+            self.assertEquals(len(set(share.shareID for share in shares)), 1)
+        self.assertEquals(
+            sorted(children[3].tags()), [u'imported', u'tag 1'])
+        self.assertEquals(
+            sorted(post.title
+                   for post in self.blog.viewByTag(self.you, u'tag 0')),
+            [u'title 0', u'title 2', u'title 4'])
+        self.assertEquals(self.blog.childCount(self.you), 5)
+        self.assertEquals(
+            self.blog.childTagCounts(),
+            [(u'imported', 5), (u'tag 0', 3), (u'tag 1', 2)])
+        self.assertEquals(
+            len(set(self.userStore.query(Share).getColumn('shareID'))), 6)
+
+
+    def test_postDuringPostMany(self):
+        """
+        A child posted with L{hyperblurb.Blurb.post} while
+        L{hyperblurb.Blurb.postMany} is importing children of the same blurb
+        should have its ancestry recorded as usual.
+        """
+        posted = []
+        def entries():
+            yield (u'imported', u'body', self.me, [], None)
+            posted.append(self.blog.post(u'posted', u'body', self.me))
+            yield (u'imported', u'body', self.me, [], None)
+        self.blog.postMany(entries(), batchSize=1)
+        post = itemFromProxy(getShare(self.userStore, self.me, posted[0]))
+        self.assertEquals(list(post.ancestors()), [self.blog])
+
+
+    def test_deleteDeepThread(self):
+        """
+        L{hyperblurb.Blurb.delete} should delete every descendant of a blurb,
+        however deeply nested, along with their ancestry records.
+        """
+        parent = self.blog
+        for i in range(5):
+            parent = itemFromProxy(getShare(
+                self.userStore, self.me, parent.post(u'', u'', self.me)))
+        self.blog.delete()
+        self.assertEquals(self.userStore.query(hyperblurb.Blurb).count(), 0)
+        self.assertEquals(
+            self.userStore.query(hyperblurb.BlurbAncestor).count(), 0)
+
+
+    def _postThread(self):
+        """
+        Post a blog post, tagged and edited, with a comment and a reply to
+        that comment, to C{self.blog}.
+
+        @return: the post.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me, self.blog.post(u'', u'', self.me)))
+        post.edit(u'title', u'body', self.me, [u'tag'])
+        comment = itemFromProxy(getShare(
+            self.userStore, self.me, post.post(u'', u'', self.me)))
+        comment.post(u'', u'', self.me)
+        return post
+
+
+    def _assertOnlyBlog(self):
+        """
+        Assert that C{self.blog} is the only blurb left in the store, and
+        that nothing refers to any of the blurbs which have been deleted.
+        """
+        self.assertEquals(
+            list(self.userStore.query(hyperblurb.Blurb)), [self.blog])
+        self.assertEquals(
+            self.userStore.query(hyperblurb.PastBlurb).count(), 0)
+        self.assertEquals(self.userStore.query(Tag).count(), 0)
+        self.assertEquals(
+            self.userStore.query(
+                Share, Share.sharedItem != self.blog).count(), 0)
+        self.assertEquals(
+            self.userStore.query(hyperblurb.BlurbAncestor).count(), 1)
+
+
+    def test_deleteSubtree(self):
+        """
+        L{hyperblurb.Blurb.delete} should delete the shares, past versions,
+        tags and ancestry records of every blurb it deletes.
+        """
+        self._postThread().delete()
+        self._assertOnlyBlog()
+
+
+    def test_deleteInBackground(self):
+        """
+        L{hyperblurb.Blurb.delete} with C{inBackground=True} should unshare
+        the subtree immediately and leave deleting it to a
+        L{hyperblurb.SubtreeDeleter}, which deletes a few blurbs at a time.
+        """
+        post = self._postThread()
+        self.userStore.findOrCreate(hyperblurb.SubtreeDeleter, batchSize=2)
+        post.delete(inBackground=True)
+        self.assertEquals(list(self.blog.view(self.me)), [])
+        self.assertEquals(self.blog.childCount(self.me), 0)
+        self.assertEquals(
+            self.userStore.query(hyperblurb.Blurb).count(), 4)
+
+        source = self.userStore.findUnique(
+            hyperblurb._SubtreeDeletionSource)
+        source.step()
+        self.assertEquals(
+            list(self.userStore.query(hyperblurb.Blurb,
+                                      sort=hyperblurb.Blurb.storeID.ascending)),
+            [self.blog, post])
+        while source.step():
+            pass
+        self._assertOnlyBlog()
+        self.assertEquals(
+            self.userStore.query(hyperblurb._SubtreeDeletion).count(), 0)
+
+
+    def test_renderedBody(self):
+        """
+        L{hyperblurb.Blurb.post} and L{hyperblurb.Blurb.edit} should store
+        the normalized body of a blurb, which
+        L{hyperblurb.Blurb.renderedBody} should return.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me,
+            self.blog.post(u'', u'<i>http://example.com/', self.me)))
+        self.assertEquals(
+            post.normalizedBody,
+            u'<i><a href="http://example.com/" target="_blank">'
+            u'http://example.com/</a></i><br />')
+        self.assertEquals(post.renderedBody(), post.normalizedBody)
+        post.edit(u'', u'<b>goodbye', self.me, [])
+        self.assertEquals(post.normalizedBody, u'<b>goodbye</b><br />')
+        self.assertEquals(post.renderedBody(), post.normalizedBody)
+
+
+    def test_renderedBodyUnnormalized(self):
+        """
+        L{hyperblurb.Blurb.renderedBody} should normalize the bodies of
+        blurbs which were posted before normalized bodies were stored,
+        reusing the result until the blurb is edited or too many others have
+        been rendered since.
+        """
+        self.patch(hyperblurb, 'RENDERED_BODY_CACHE_SIZE', 1)
+        first, second = [
+            itemFromProxy(getShare(
+                self.userStore, self.me,
+                self.blog.post(u'', u'<i>hello', self.me)))
+            for i in range(2)]
+        second.normalizedBody = None
+        first.normalizedBody = None
+        self.assertEquals(first.renderedBody(), u'<i>hello</i><br />')
+        first.body = u'<b>hello'
+        self.assertEquals(first.renderedBody(), u'<i>hello</i><br />')
+        self.assertEquals(second.renderedBody(), u'<i>hello</i><br />')
+        self.assertEquals(first.renderedBody(), u'<b>hello</b><br />')
+
+
+    def test_normalizeBodies(self):
+        """
+        L{hyperblurb.normalizeBodies} should store the normalized bodies of
+        blurbs which lack them, or of every blurb if asked to renormalize
+        them.
+        """
+        post = itemFromProxy(getShare(
+            self.userStore, self.me,
+            self.blog.post(u'', u'<i>hello', self.me)))
+        post.normalizedBody = None
+        self.blog.normalizedBody = None
+        self.assertEquals(
+            hyperblurb.normalizeBodies(self.userStore, batchSize=1), 2)
+        self.assertEquals(post.normalizedBody, u'<i>hello</i><br />')
+        self.assertEquals(
+            self.blog.normalizedBody, u'<html>Hello World!~!!</html><br />')
+        self.assertEquals(hyperblurb.normalizeBodies(self.userStore), 0)
+        self.assertEquals(
+            hyperblurb.normalizeBodies(self.userStore, renormalize=True), 2)
+
+
+    def test_search(self):
+        """
+        L{hyperbola_model.HyperbolaPublicPresence.search} should find the
+        blurbs visible to a role whose title, body or tags match a full-text
+        query, once the L{hyperblurb.BlurbIndexer} has processed them, and
+        should notice edits, tags and deletions immediately.
+        """
+        source = self.userStore.findUnique(hyperblurb.BlurbSource)
+        first = itemFromProxy(getShare(self.userStore, self.me, self.blog.post(
+            u'Twisted', u'An event-driven networking engine', self.me)))
+        second = itemFromProxy(getShare(self.userStore, self.me, self.blog.post(
+            u'Axiom', u'An object database for Twisted', self.me,
+            {self.me: [ihyperbola.IViewable]})))
+
+        def search(role, query, **kw):
+            return [itemFromProxy(p) for p in
+                    self.publicPresence.search(role, query, **kw)]
+        self.assertEquals(search(self.me, u'twisted'), [])
+        while source.step():
+            pass
+        self.assertEquals(search(self.me, u'twisted'), [second, first])
+        self.assertEquals(
+            search(self.me, u'twisted', limit=1, offset=1), [first])
+        self.assertEquals(search(self.you, u'twisted'), [first])
+
+        first.edit(u'Twisted', u'Asynchronous networking', self.me, [])
+        self.assertEquals(search(self.me, u'event'), [])
+        self.assertEquals(search(self.me, u'asynchronous'), [first])
+        second.tag(u'python')
+        self.assertEquals(search(self.me, u'python'), [second])
+
+        second.delete()
+        self.assertEquals(search(self.me, u'twisted'), [first])
+
+
+    def test_searchMalformedQuery(self):
+        """
+        L{hyperbola_model.HyperbolaPublicPresence.search} should find nothing
+        for a full-text query which SQLite cannot parse, rather than raising
+        an exception.
+        """
+        self.blog.post(u'Twisted', u'An event-driven networking engine',
+                       self.me)
+        source = self.userStore.findUnique(hyperblurb.BlurbSource)
+        while source.step():
+            pass
+        for query in [u'"twisted', u'OR', u'(twisted', u'twisted AND']:
+            self.assertEquals(
+                list(self.publicPresence.search(self.me, query)), [])
+
+
 
 class BlurbSourceTestCase(unittest.TestCase):
     """
@@ -280,3 +1288,60 @@ class BlurbSourceTestCase(unittest.TestCase):
             body=u'', author=self.me, hits=0,
             dateCreated=Time(), dateLastEdited=Time(),
             flavor=hyperblurb.FLAVOR.BLOG)
+
+
+
+class HitCounterTests(unittest.TestCase):
+    """
+    Tests for L{hyperbola.hyperblurb.HitCounter}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.me = Role(store=self.store, externalID=u'armstrong@example.com')
+        self.blurbs = [
+            hyperblurb.Blurb(
+                store=self.store, title=u'', body=u'', author=self.me, hits=0,
+                dateCreated=Time(), dateLastEdited=Time(),
+                flavor=hyperblurb.FLAVOR.BLOG)
+            for i in range(2)]
+        self.clock = Clock()
+        self.counter = hyperblurb.HitCounter(
+            self.clock, interval=10, threshold=3)
+
+
+    def test_hitsBuffered(self):
+        """
+        L{hyperblurb.HitCounter.hit} should not change the blurb until the
+        interval has passed.
+        """
+        self.counter.hit(self.blurbs[0])
+        self.counter.hit(self.blurbs[1])
+        self.clock.advance(9)
+        self.assertEquals([b.hits for b in self.blurbs], [0, 0])
+        self.clock.advance(1)
+        self.assertEquals([b.hits for b in self.blurbs], [1, 1])
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_threshold(self):
+        """
+        L{hyperblurb.HitCounter.hit} should write all of the counted hits as
+        soon as C{threshold} hits have been counted, and cancel the delayed
+        write.
+        """
+        for i in range(3):
+            self.counter.hit(self.blurbs[0])
+        self.assertEquals(self.blurbs[0].hits, 3)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_deletedBlurb(self):
+        """
+        L{hyperblurb.HitCounter.flush} should skip blurbs which were deleted
+        after their hits were counted.
+        """
+        self.counter.hit(self.blurbs[0])
+        self.counter.hit(self.blurbs[1])
+        self.blurbs[0].delete()
+        self.counter.flush()
+        self.assertEquals(self.blurbs[1].hits, 1)
@@ -0,0 +1,95 @@
+"""
+Tests for L{axiom.plugins.hyperbolacmd}.
+"""
+
+import sys
+from StringIO import StringIO
+
+from twisted.trial import unittest
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.substore import SubStore
+from axiom.plugins.hyperbolacmd import Normalize, Export, Import
+
+from xmantissa.sharing import getEveryoneRole
+
+from hyperbola.hyperblurb import Blurb, FLAVOR
+
+
+class CommandStub(object):
+    """
+    Stand in for the parent of a subcommand, providing its store.
+    """
+    def __init__(self, store):
+        self.store = store
+
+
+    def getStore(self):
+        return self.store
+
+
+
+class NormalizeTestCase(unittest.TestCase):
+    """
+    Tests for L{Normalize}.
+    """
+    def test_normalizeSubstores(self):
+        """
+        L{Normalize} should normalize the bodies of blurbs in the store and
+        in its substores, and report how many it normalized.
+        """
+        store = Store(filesdir=self.mktemp())
+        substore = SubStore.createNew(store, ['user']).open()
+        blurbs = [
+            Blurb(store=s, title=u'', body=u'hello', flavor=FLAVOR.BLOG,
+                  author=getEveryoneRole(s), dateCreated=Time(),
+                  dateLastEdited=Time())
+            for s in [store, substore]]
+        output = StringIO()
+        self.patch(sys, 'stdout', output)
+        command = Normalize()
+        command.parent = CommandStub(store)
+        command.parseOptions([])
+        self.assertEqual(output.getvalue(), 'Normalized 2 blurbs.\n')
+        self.assertEqual(
+            [blurb.normalizedBody for blurb in blurbs],
+            [u'<html>hello</html><br />'] * 2)
+
+
+
+class ExportImportTestCase(unittest.TestCase):
+    """
+    Tests for L{Export} and L{Import}.
+    """
+    def test_exportImport(self):
+        """
+        L{Export} should write every top-level blurb in the store, and its
+        descendants, to a file which L{Import} can read into another store.
+        """
+        store = Store()
+        for title in [u'First', u'Second']:
+            blog = Blurb(store=store, title=title, body=u'',
+                         flavor=FLAVOR.BLOG, author=getEveryoneRole(store),
+                         dateCreated=Time(), dateLastEdited=Time())
+            blog.post(u'Post', u'', getEveryoneRole(store))
+        path = self.mktemp()
+
+        command = Export()
+        command.parent = CommandStub(store)
+        command.parseOptions(['--output', path])
+
+        output = StringIO()
+        self.patch(sys, 'stdout', output)
+        newStore = Store()
+        command = Import()
+        command.parent = CommandStub(newStore)
+        command.parseOptions(['--input', path])
+        self.assertEqual(output.getvalue(), 'Imported 4 blurbs.\n')
+        self.assertEqual(
+            [(blurb.title, blurb.parent and blurb.parent.title)
+             for blurb in newStore.query(
+                    Blurb, sort=Blurb.storeID.ascending)],
+            [(u'First', None), (u'Post', u'First'),
+             (u'Second', None), (u'Post', u'Second')])
@@ -0,0 +1,75 @@
+"""
+Tests for L{hyperbola.normalize}.
+"""
+
+from twisted.trial import unittest
+
+from hyperbola import normalize
+
+
+class NormalizeTestCase(unittest.TestCase):
+    """
+    Tests for the steps of L{normalize.normalize}.
+    """
+    def test_wellFormed(self):
+        """
+        L{normalize.wellFormed} should close the elements of bodies which are
+        not well-formed, and escape bodies which cannot be parsed at all.
+        """
+        self.assertEquals(
+            normalize.wellFormed(u'<i>hello').toxml(), u'<i>hello</i>')
+        self.assertEquals(
+            normalize.wellFormed(u'x < y').toxml(), u'<html>x &lt; y</html>')
+
+
+    def test_linkURLs(self):
+        """
+        L{normalize.linkURLs} should turn URLs in text into links, leaving
+        URLs which are already inside links alone.
+        """
+        self.assertEquals(
+            normalize.linkURLs(normalize.wellFormed(
+                u'<p>see http://example.com/ or www.example.com. '
+                u'<a href="x">http://example.org/</a></p>')).toxml(),
+            u'<p>see <a href="http://example.com/" target="_blank">'
+            u'http://example.com/</a> or <a href="http://www.example.com" '
+            u'target="_blank">www.example.com</a>. '
+            u'<a href="x">http://example.org/</a></p>')
+        self.assertEquals(
+            normalize.linkURLs(normalize.wellFormed(
+                u"<a href='x'>www.example.com</a>")).toxml(),
+            u'<a href="x">www.example.com</a>')
+
+
+    def test_breakLines(self):
+        """
+        L{normalize.breakLines} should end every line with a C{br} element.
+        """
+        self.assertEquals(
+            normalize.breakLines(u'foo\nbar\r\nbaz'),
+            u'foo<br />bar<br />baz<br />')
+
+
+    def test_normalize(self):
+        """
+        L{normalize.normalize} should run a body through every one of
+        L{normalize.NORMALIZERS}, except for an empty one.
+        """
+        self.patch(normalize, 'NORMALIZERS',
+                   [lambda body: body + u'a', lambda body: body + u'b'])
+        self.assertEquals(normalize.normalize(u'x'), u'xab')
+        self.assertEquals(normalize.normalize(u''), u'')
+
+
+    def test_normalizeLenient(self):
+        """
+        L{normalize.normalize} should accept any body which the lenient
+        parser of L{normalize.wellFormed} does, even if what that parser
+        makes of it could not be parsed again strictly.
+        """
+        self.assertIn(
+            u'<a href="http://example.com/" target="_blank">',
+            normalize.normalize(u'<p http://y.org/a>http://example.com/</p>'))
+        self.assertEquals(
+            normalize.normalize(u'a/<: :w&&/a<.w>.aw/'),
+            u'<html>a/&lt;: :w&amp;&amp;/a&lt;.w&gt;.aw/</html><br />')
@@ -4,6 +4,7 @@
 Test that the Hyperbola view classes can be rendered
 """
 
+import math
 from xml.dom import minidom
 from lxml.etree import XPathEvaluator, fromstring
 
@@ -13,14 +14,20 @@ def evaluateXPath(path, document):
 
 from twisted.trial.unittest import TestCase
 from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.web import http
 
 from epsilon.extime import Time
 
+from axiom.store import Store
+
 from xmantissa import ixmantissa, webtheme
+from xmantissa.sharing import Role
 
-from nevow.testutil import renderLivePage, FragmentWrapper, AccumulatingFakeRequest, renderPage
+from nevow import rend
+from nevow.testutil import renderLivePage, FragmentWrapper, AccumulatingFakeRequest, renderPage, FakeRequest
 
-from hyperbola import hyperblurb, hyperbola_view
+from hyperbola import hyperblurb, hyperbola_view, rss
 from hyperbola.test.util import HyperbolaTestMixin
 
 
@@ -30,6 +37,8 @@ class RenderingTestCase(TestCase, HyperbolaTestMixin):
     """
     def setUp(self):
         self._setUpStore()
+        self.patch(hyperbola_view.BlurbViewer, 'hitCounter',
+                   hyperblurb.HitCounter(Clock()))
 
     def _renderFragment(self, fragment, *a, **k):
         """
@@ -129,6 +138,92 @@ class RenderingTestCase(TestCase, HyperbolaTestMixin):
         return D
 
 
+    def test_blogPostDetailThread(self):
+        """
+        The detail view of a blog post should render its comments, each
+        followed by its own replies.
+        """
+        blog = self._makeBlurb(hyperblurb.FLAVOR.BLOG)
+        post = self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST, parent=blog)
+        comment = self._makeBlurb(
+            hyperblurb.FLAVOR.BLOG_COMMENT, body=u'Comment', parent=post)
+        reply = self._makeBlurb(
+            hyperblurb.FLAVOR.BLOG_COMMENT, body=u'Reply', parent=comment)
+        postProxy = self._shareAndGetProxy(post)
+        self._shareAndGetProxy(comment)
+        self._shareAndGetProxy(reply)
+        D = self._renderFragment(
+            hyperbola_view.blurbViewDetailDispatcher(postProxy))
+
+        def rendered(xml):
+            comments = evaluateXPath(
+                '//*[@class="hyperbola-blog-post-comments"]/ol/li', xml)
+            self.assertEquals(len(comments), 1)
+            self.assertEquals(
+                [li.xpath('string(div[@class="hyperbola-blurb-body"]/html)')
+                 for li in comments + comments[0].xpath('ol/li')],
+                ['Comment', 'Reply'])
+
+        D.addCallback(rendered)
+        return D
+
+
+    def test_blogPostFragmentCached(self):
+        """
+        The title and body of a blog post should only be rendered the first
+        time its view is rendered, until the post is edited or a comment is
+        posted on it.
+        """
+        self.patch(hyperbola_view.BlurbViewer, 'fragmentCache',
+                   hyperbola_view.FragmentCache())
+        rendered = []
+        renderedBody = hyperblurb.Blurb.renderedBody.im_func
+        def countingRenderedBody(blurb):
+            rendered.append(blurb.title)
+            return renderedBody(blurb)
+        self.patch(hyperblurb.Blurb, 'renderedBody', countingRenderedBody)
+
+        blog = self._makeBlurb(hyperblurb.FLAVOR.BLOG)
+        post = self._makeBlurb(
+            hyperblurb.FLAVOR.BLOG_POST, title=u'Post', body=u'Body',
+            parent=blog)
+        post.dateLastEdited = Time()
+        proxy = self._shareAndGetProxy(post)
+
+        def render(ignored=None):
+            return self._renderFragment(
+                hyperbola_view.blurbViewDispatcher(proxy))
+
+        def renderedTwice(results):
+            self.assertEquals(rendered, [u'Post'])
+            self.assertEquals(
+                [evaluateXPath(
+                        'string(//*[@class="hyperbola-blurb-body"]/html)',
+                        xml)
+                 for (success, xml) in results],
+                ['Body', 'Body'])
+            post.edit(u'Post', u'Edited', post.author, [])
+            return render()
+
+        def renderedEdit(xml):
+            self.assertEquals(rendered, [u'Post', u'Post'])
+            self.assertEquals(
+                evaluateXPath(
+                    'string(//*[@class="hyperbola-blurb-body"]/html)', xml),
+                'Edited')
+            post.post(u'', u'Comment', post.author)
+            return render()
+
+        def renderedComment(xml):
+            self.assertEquals(rendered, [u'Post', u'Post', u'Post'])
+
+        D = defer.DeferredList([render(), render()])
+        D.addCallback(renderedTwice)
+        D.addCallback(renderedEdit)
+        D.addCallback(renderedComment)
+        return D
+
+
     def test_addCommentDispatch(self):
         """
         Test that we can pass a blurb of any flavor to
@@ -192,7 +287,15 @@ class RSSTestCase(TestCase):
             hyperbola_view.BlurbViewer, '_absoluteURL',
             lambda x: self.BLOG_URL)
         self.patch(
-            hyperbola_view.BlurbViewer, 'getRole', lambda x: None)
+            hyperbola_view.BlurbViewer, '_linkTo',
+            lambda x, blurb: self.BLOG_URL + '/' + blurb.title.encode('utf-8'))
+        role = Role(store=Store(), externalID=self.BLOG_AUTHOR,
+                    description=u'')
+        self.patch(
+            hyperbola_view.BlurbViewer, 'getRole', lambda x: role)
+        self.patch(
+            hyperbola_view.BlurbViewer, 'feedCache',
+            hyperbola_view.FragmentCache())
 
 
     def test_rssGeneration(self):
@@ -242,27 +345,449 @@ class RSSTestCase(TestCase):
         return renderPage(rssView).addCallback(checkData)
 
 
+    def test_itemLimit(self):
+        """
+        The RSS feed should only include the newest L{rss.Feed.maxItems}
+        children of the blurb.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                                              title=unicode(i), body=u'',
+                                              author=self.BLOG_AUTHOR,
+                                              children=[])
+                                    for i in range(3)])
+        self.patch(rss.Feed, 'maxItems', 2)
+        def checkData(rssData):
+            self.assertEqual(
+                evaluateXPath('/rss/channel/item/title/text()', rssData),
+                [u'0', u'1'])
+            self.assertEqual(
+                evaluateXPath('/rss/channel/item/link/text()', rssData),
+                [self.BLOG_URL + '/0', self.BLOG_URL + '/1'])
+        rssView = hyperbola_view.blurbViewDispatcher(blurb).child_rss(None)
+        return renderPage(rssView).addCallback(checkData)
+
+
+    def test_cached(self):
+        """
+        The RSS feed should be rendered once for each version of the blurb,
+        and kept in L{hyperbola_view.BlurbViewer.feedCache} until then.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                                              title=u'post', body=u'',
+                                              author=self.BLOG_AUTHOR,
+                                              children=[])])
+        views = []
+        view = blurb.view
+        def countViews(*a, **k):
+            views.append(a)
+            return view(*a, **k)
+        blurb.view = countViews
+
+        def render(ignored=None):
+            rssView = hyperbola_view.blurbViewDispatcher(blurb).child_rss(None)
+            return renderPage(rssView)
+        def renderedTwice(results):
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(len(views), 1)
+            blurb.dateLastEdited = Time.fromPOSIXTimestamp(
+                blurb.dateLastEdited.asPOSIXTimestamp() + 60)
+            return render()
+        def renderedChanged(rssData):
+            self.assertEqual(len(views), 2)
+        return render().addCallback(
+            lambda first: render().addCallback(
+                lambda second: [first, second])).addCallback(
+            renderedTwice).addCallback(renderedChanged)
+
+
+    def test_tagFeed(self):
+        """
+        The RSS feed at C{tag/<name>} should only include the children of
+        the blurb with that tag, and there should be no feeds below it.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                                              title=title, body=u'',
+                                              author=self.BLOG_AUTHOR,
+                                              children=[], tags=tags)
+                                    for (title, tags) in [
+                                        (u'one', [u'caf\xe9']),
+                                        (u'two', [u'other']),
+                                        (u'three', [u'caf\xe9', u'other'])]])
+        feed = hyperbola_view.blurbViewDispatcher(blurb).child_rss(None)
+        tagFeed, segments = feed.locateChild(None, ('tag', 'caf\xc3\xa9'))
+        self.assertEqual(segments, ())
+        self.assertIdentical(
+            tagFeed.locateChild(None, ('tag', 'other')), rend.NotFound)
+        self.assertIdentical(
+            feed.locateChild(None, ('tag', '\xff')), rend.NotFound)
+
+        def checkData(rssData):
+            self.assertEqual(
+                evaluateXPath('/rss/channel/title/text()', rssData),
+                [u'blog title: caf\xe9'])
+            self.assertEqual(
+                evaluateXPath('/rss/channel/link/text()', rssData),
+                [self.BLOG_URL + '?tag=caf%C3%A9'])
+            self.assertEqual(
+                evaluateXPath('/rss/channel/item/title/text()', rssData),
+                [u'one', u'three'])
+        return renderPage(tagFeed).addCallback(checkData)
+
+
+    def test_commentFeed(self):
+        """
+        The RSS feed of a blog post should include its comments and the
+        replies to them.
+        """
+        def comment(title, children=()):
+            return MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_COMMENT,
+                             title=title, body=u'', author=self.BLOG_AUTHOR,
+                             children=list(children))
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                          title=u"post title", body=u"post body",
+                          author=self.BLOG_AUTHOR,
+                          children=[comment(u'one', [comment(u'reply')]),
+                                    comment(u'two')])
+        feed = hyperbola_view.blurbViewDispatcher(blurb).child_rss(None)
+        self.assertIdentical(
+            feed.locateChild(None, ('tag', 'foo')), rend.NotFound)
+        def checkData(rssData):
+            self.assertEqual(
+                evaluateXPath('/rss/channel/title/text()', rssData),
+                [u'Comments on post title'])
+            self.assertEqual(
+                evaluateXPath('/rss/channel/item/title/text()', rssData),
+                [u'one', u'reply', u'two'])
+        return renderPage(feed).addCallback(checkData)
+
+
+    def test_atomPaging(self):
+        """
+        The Atom feed should include the newest L{rss.AtomFeed.maxItems}
+        children of the blurb, and link to the newest archive counted from
+        the oldest child, which links to the next older archive, and so on.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                                              title=unicode(i), body=u'',
+                                              author=self.BLOG_AUTHOR,
+                                              children=[])
+                                    for i in range(5)])
+        self.patch(rss.AtomFeed, 'maxItems', 2)
+        feedURL = self.BLOG_URL + '/atom'
+        subscription = hyperbola_view.blurbViewDispatcher(
+            blurb).child_atom(None)
+
+        def evaluate(path, data):
+            return XPathEvaluator(
+                fromstring(data),
+                namespaces={'a': rss.ATOM_NS, 'fh': rss.HISTORY_NS}
+                ).evaluate(path)
+
+        def render(url):
+            segments = url[len(feedURL) + 1:]
+            if segments:
+                feed = subscription.childFactory(None, segments)
+            else:
+                feed = subscription
+            requests = []
+            def makeRequest():
+                requests.append(FakeRequest())
+                return requests[-1]
+            return renderPage(feed, reqFactory=makeRequest).addCallback(
+                lambda data: (requests[0], data))
+
+        pages = []
+        def rendered((request, data)):
+            titles = evaluate('/a:feed/a:entry/a:title/text()', data)
+            archived = bool(evaluate('/a:feed/fh:archive', data))
+            cacheControl = request.responseHeaders.getRawHeaders(
+                'cache-control')
+            self.assertEqual(
+                evaluate('/a:feed/a:link[@rel="first"]/@href', data),
+                [feedURL])
+            pages.append((titles, archived, cacheControl))
+            selfURL = evaluate('/a:feed/a:link[@rel="self"]/@href', data)
+            older = evaluate('/a:feed/a:link[@rel="prev-archive"]/@href',
+                             data)
+            if older:
+                self.assertNotEqual(selfURL, older)
+                return render(older[0]).addCallback(rendered)
+
+        def checkPages(ignored):
+            maxAge = 'public, max-age=%d' % (rss.AtomFeed.archiveMaxAge,)
+            self.assertEqual(
+                pages,
+                [([u'0', u'1'], False, None),
+                 ([u'1', u'2'], True, [maxAge]),
+                 ([u'3', u'4'], True, [maxAge])])
+        return render(feedURL).addCallback(rendered).addCallback(checkPages)
+
+
+    def test_atomArchiveStable(self):
+        """
+        Posting a new child should change neither the contents nor the
+        C{ETag} of an Atom archive, nor its URL.
+        """
+        def child(title):
+            return MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                             title=title, body=u'', author=self.BLOG_AUTHOR,
+                             children=[])
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[child(unicode(i)) for i in range(3)])
+        self.patch(rss.AtomFeed, 'maxItems', 2)
+
+        archiveURL = rss.formatPageKey(blurb.children[0].pageKey())
+
+        def render(ignored=None):
+            feed = hyperbola_view.blurbViewDispatcher(
+                blurb).child_atom(None).childFactory(None, archiveURL)
+            requests = []
+            def makeRequest():
+                requests.append(FakeRequest())
+                return requests[-1]
+            return renderPage(feed, reqFactory=makeRequest).addCallback(
+                lambda data: (
+                    requests[0].responseHeaders.getRawHeaders('etag'),
+                    evaluateXPath(
+                        '//*[local-name()="entry"]/*[local-name()="title"]'
+                        '/text()', data)))
+
+        def renderedFirst(first):
+            self.assertEqual(first[1], [u'1', u'2'])
+            blurb.children.insert(0, child(u'new'))
+            return renderPage(hyperbola_view.blurbViewDispatcher(
+                    blurb).child_atom(None)).addCallback(
+                renderedSubscription, first)
+        def renderedSubscription(data, first):
+            self.assertEqual(
+                evaluateXPath(
+                    '//*[local-name()="link"][@rel="prev-archive"]/@href',
+                    data),
+                [self.BLOG_URL + '/atom/' + archiveURL])
+            return render().addCallback(
+                lambda second: self.assertEqual(first, second))
+        return render().addCallback(renderedFirst)
+
+
+    def test_atomArchiveNotFound(self):
+        """
+        Segments below the Atom feed which are not page keys, and any below
+        its archives, should not be found.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          children=[], author=self.BLOG_AUTHOR)
+        feed = hyperbola_view.blurbViewDispatcher(blurb).child_atom(None)
+        self.assertIdentical(feed.childFactory(None, 'foo'), None)
+        archive = feed.childFactory(None, '1-2')
+        self.assertEqual(
+            archive.before, (Time.fromPOSIXTimestamp(0.000001), 2))
+        self.assertIdentical(archive.childFactory(None, '1-2'), None)
+
+
+    def test_atomArchiveQueriedOnce(self):
+        """
+        An Atom archive should query for its children once to render it,
+        and once to answer a conditional request for it, without counting
+        the children of the blurb.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          author=self.BLOG_AUTHOR,
+                          children=[MockBlurb(flavor=hyperblurb.FLAVOR.BLOG_POST,
+                                              title=unicode(i), body=u'',
+                                              author=self.BLOG_AUTHOR,
+                                              children=[])
+                                    for i in range(3)])
+        calls = []
+        view = blurb.view
+        def countingView(*a, **k):
+            calls.append('view')
+            return view(*a, **k)
+        blurb.view = countingView
+        def childCount(role):
+            calls.append('childCount')
+            return len(blurb.children)
+        blurb.childCount = childCount
+        archiveURL = rss.formatPageKey(blurb.children[0].pageKey())
+
+        def render(headers):
+            feed = hyperbola_view.blurbViewDispatcher(
+                blurb).child_atom(None).childFactory(None, archiveURL)
+            requests = []
+            def makeRequest():
+                request = FakeRequest(headers=headers)
+                requests.append(request)
+                return request
+            return renderPage(feed, reqFactory=makeRequest).addCallback(
+                lambda data: requests[0])
+        def rendered(request):
+            self.assertEqual(calls, ['view'])
+            return render(
+                {'if-none-match':
+                     request.responseHeaders.getRawHeaders('etag')[0]})
+        def notModified(request):
+            self.assertEqual(request.code, http.NOT_MODIFIED)
+            self.assertEqual(calls, ['view', 'view'])
+        return render({}).addCallback(rendered).addCallback(notModified)
+
+
+    def _renderConditionally(self, blurb, headers):
+        """
+        Render the RSS feed of C{blurb} for a request with C{headers}.
+
+        @return: a L{Deferred} which fires with the request and what was
+        written to it.
+        """
+        requests = []
+        def makeRequest():
+            request = FakeRequest(headers=headers)
+            requests.append(request)
+            return request
+        rssView = hyperbola_view.blurbViewDispatcher(blurb).child_rss(None)
+        return renderPage(rssView, reqFactory=makeRequest).addCallback(
+            lambda data: (requests[0], data))
+
+
+    def test_conditionalGET(self):
+        """
+        The RSS feed should be sent with an C{ETag} and a C{Last-Modified}
+        header, and not be rendered again for requests which have the
+        current version of it.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          children=[], author=self.BLOG_AUTHOR)
+
+        def rendered((request, data)):
+            self.assertEqual(request.code, http.OK)
+            self.assertNotEqual(data, '')
+            etag = request.responseHeaders.getRawHeaders('etag')[0]
+            lastModified = request.responseHeaders.getRawHeaders(
+                'last-modified')[0]
+            self.assertEqual(
+                http.stringToDatetime(lastModified),
+                math.ceil(blurb.dateLastEdited.asPOSIXTimestamp()))
+            return defer.gatherResults([
+                    self._renderConditionally(
+                        blurb, {'if-none-match': etag}),
+                    self._renderConditionally(
+                        blurb, {'if-none-match': 'W/"x", W/' + etag}),
+                    self._renderConditionally(
+                        blurb, {'if-modified-since': lastModified})])
+        def cached(results):
+            for (request, data) in results:
+                self.assertEqual(request.code, http.NOT_MODIFIED)
+                self.assertEqual(data, '')
+        return self._renderConditionally(blurb, {}).addCallback(
+            rendered).addCallback(cached)
+
+
+    def test_conditionalGETChanged(self):
+        """
+        The RSS feed should be rendered for requests with an out of date
+        C{ETag}, even if it has not been modified since their
+        C{If-Modified-Since}.
+        """
+        blurb = MockBlurb(flavor=hyperblurb.FLAVOR.BLOG,
+                          title=u"blog title", body=u"blog desc",
+                          children=[], author=self.BLOG_AUTHOR)
+        lastModified = http.datetimeToString(
+            blurb.dateLastEdited.asPOSIXTimestamp() + 60)
+        def rendered((request, data)):
+            self.assertEqual(request.code, http.OK)
+            self.assertNotEqual(data, '')
+        return self._renderConditionally(
+            blurb, {'if-none-match': '"0-0"',
+                    'if-modified-since': lastModified}).addCallback(rendered)
+
+
 
 class MockBlurb(object):
     """
     Mock version of L{hyperbola.hyperblurb.Blurb}.
     """
 
-    def __init__(self, flavor, title, body, children, author):
+    def __init__(self, flavor, title, body, children, author, tags=()):
         self.flavor = flavor
         self.title = title
         self.body = body
         self.children = children
+        self.tagNames = tags
+        self.dateCreated = Time.fromPOSIXTimestamp(1234567890)
         self.dateLastEdited = Time()
         #pretend to be a SharedProxy too
         self._sharedItem = self
+        #and an Item in a store of its own
+        self.store = self
+        self.storeID = id(self)
         class author(object):
             externalID = author
         self.author = author
 
 
-    def view(self, role):
+    def view(self, role, after=None, limit=None):
+        """
+        Not testing sharing logic here, so just provide a page of children
+        in the order they were given.
+        """
+        children = self.children
+        if after is not None:
+            keys = [child.pageKey() for child in children]
+            children = children[keys.index(after) + 1:]
+        return children[:limit]
+
+
+    def childCount(self, role):
+        """
+        Count every child.
+        """
+        return len(self.children)
+
+
+    def viewByTag(self, role, tag, after=None, limit=None):
+        """
+        Provide the children with C{tag}, in the order they were given.
+        """
+        return [child for child in self.children
+                if tag in child.tagNames][:limit]
+
+
+    def viewDescendants(self, role, limit=None):
+        """
+        Provide each child followed by its descendants.
+        """
+        descendants = []
+        for child in self.children:
+            descendants.append(child)
+            descendants.extend(child.viewDescendants(role))
+        return descendants[:limit]
+
+
+    def pageKey(self):
+        """
+        Order this blurb by its creation time and identity.
+        """
+        return (self.dateCreated, self.storeID)
+
+
+    def subtreeVersion(self, role):
         """
-        Not testing sharing logic here, so just provide children as-is.
+        Describe the version of this blurb by its own edit time and its
+        number of children.
         """
-        return self.children
+        return (self.dateLastEdited, len(self.children))
@@ -199,6 +199,34 @@ class ViewTestCase(TestCase, HyperbolaTestMixin):
             result.slotData['child-type-name'], fragment._childTypeName)
 
 
+    def test_blogChildBlurbsByTags(self):
+        """
+        L{hyperbola_view.BlogBlurbViewer._getChildBlurbs} should only return
+        the posts which have all of the tags given as C{tag} arguments, or any
+        of them if the C{tagMatch} argument is C{any}.
+        """
+        blog = self._makeBlurb(FLAVOR.BLOG)
+        for (title, tagNames) in [(u'first', [u'foo']),
+                                  (u'second', [u'foo', u'bar']),
+                                  (u'third', [u'baz'])]:
+            post = self._makeBlurb(FLAVOR.BLOG_POST, title, parent=blog)
+            self._shareAndGetProxy(post)
+            for tagName in tagNames:
+                post.tag(tagName)
+        fragment = hyperbola_view.BlogBlurbViewer(
+            self._shareAndGetProxy(blog))
+
+        def titles(args):
+            return sorted(
+                post.title for post in fragment._getChildBlurbs(
+                    FakeRequest(args=args)))
+        self.assertEqual(titles({'tag': ['foo']}), [u'first', u'second'])
+        self.assertEqual(titles({'tag': ['foo', 'bar']}), [u'second'])
+        self.assertEqual(
+            titles({'tag': ['bar', 'baz'], 'tagMatch': ['any']}),
+            [u'second', u'third'])
+
+
     def test_blogsRenderer(self):
         """
         Test that L{hyperbola_view.BlogListFragment.blogs} renders a list of blogs.
@@ -299,22 +327,6 @@ class ViewTestCase(TestCase, HyperbolaTestMixin):
         self.assertEquals(
             hyperbola_view.parseTags('  '), [])
 
-    def test_htmlifyLineBreaks(self):
-        """
-        Test that L{hyperbola.hyperbola_view.BlurbViewer._htmlifyLineBreaks}
-        replaces new lines with <br> elements
-        """
-        share = self._shareAndGetProxy(
-            self._makeBlurb(
-                hyperblurb.FLAVOR.BLOG_POST,
-                body=u'foo\nbar\r\nbaz'))
-
-        frag = hyperbola_view.blurbViewDispatcher(share)
-        self.assertEquals(
-            flatten(frag._htmlifyLineBreaks(frag.original.body)),
-            'foo<br />bar<br />baz<br />')
-
-
     def test_bodyRenderer(self):
         """
         L{BlurbViewer.body} should return a well-formed XHTML document
@@ -363,20 +375,25 @@ class ViewTestCase(TestCase, HyperbolaTestMixin):
     def test_blogTags(self):
         """
         Test that the implementation of C{_getAllTags} on the view for a blog
-        post returns all tags that have been applied to blurbs, without
-        duplicates
+        returns all tags that have been applied to the blog's posts, without
+        duplicates, and without the tags of other blogs' posts
         """
+        blog = self._makeBlurb(hyperblurb.FLAVOR.BLOG)
         postShare = self._shareAndGetProxy(
-            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST))
+            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST, parent=blog))
         postShare.tag(u'foo')
 
         otherPostShare = self._shareAndGetProxy(
-            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST))
+            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST, parent=blog))
         otherPostShare.tag(u'foo')
         otherPostShare.tag(u'bar')
 
-        blogShare = self._shareAndGetProxy(
-            self._makeBlurb(hyperblurb.FLAVOR.BLOG))
+        otherBlog = self._makeBlurb(hyperblurb.FLAVOR.BLOG)
+        otherBlogPostShare = self._shareAndGetProxy(
+            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST, parent=otherBlog))
+        otherBlogPostShare.tag(u'baz')
+
+        blogShare = self._shareAndGetProxy(blog)
         blogView = hyperbola_view.blurbViewDispatcher(blogShare)
 
         self.assertEquals(
@@ -384,6 +401,22 @@ class ViewTestCase(TestCase, HyperbolaTestMixin):
             [u'bar', u'foo'])
 
 
+    def test_addBlogPostTags(self):
+        """
+        L{hyperbola_view.AddBlogPostFragment} should pass the tags which have
+        been applied to the posts of its blog to its widget.
+        """
+        blog = self._makeBlurb(hyperblurb.FLAVOR.BLOG)
+        postShare = self._shareAndGetProxy(
+            self._makeBlurb(hyperblurb.FLAVOR.BLOG_POST, parent=blog))
+        postShare.tag(u'foo')
+        self._makeBlurb(hyperblurb.FLAVOR.BLOG).tag(u'bar')
+        blogView = hyperbola_view.blurbViewDispatcher(
+            self._shareAndGetProxy(blog))
+        fragment = hyperbola_view.AddBlogPostFragment(blogView)
+        self.assertEquals(fragment.getInitialArguments(), ([u'foo'],))
+
+
     def test_editLinkIfEditable(self):
         """
         Test that L{hyperbola_view.BlogPostBlurbViewer} renders an 'edit' link
@@ -467,6 +500,49 @@ class BlurbViewerTests(HyperbolaTestMixin, TestCase):
 
 
 
+    def test_getHitCounter(self):
+        """
+        L{hyperbola_view.getHitCounter} should create a single
+        L{hyperblurb.HitCounter} the first time it is called, rather than
+        when L{hyperbola_view} is imported.
+        """
+        self.patch(hyperbola_view, '_hitCounter', None)
+        counter = hyperbola_view.getHitCounter()
+        self.assertIsInstance(counter, hyperblurb.HitCounter)
+        self.assertIdentical(hyperbola_view.getHitCounter(), counter)
+
+
+    def test_renderCountsHit(self):
+        """
+        Rendering a L{BlurbViewer} as the subject of a page should count a hit
+        on its blurb with its C{hitCounter}, but rendering it as part of
+        another fragment should not.
+        """
+        hits = []
+        class StubHitCounter(object):
+            def hit(self, blurb):
+                hits.append(blurb)
+
+        blurb = self._makeBlurb(FLAVOR.BLOG_POST)
+        share = self._shareAndGetProxy(blurb)
+        view = BlurbViewer(share)
+        view.hitCounter = StubHitCounter()
+        view.docFactory = loaders.stan(tags.div(render=tags.directive(
+            'liveElement'))[tags.div(render=tags.directive('child'))])
+        child = BlurbViewer(share)
+        child.hitCounter = StubHitCounter()
+        child.docFactory = loaders.stan(tags.div(render=tags.directive(
+            'liveElement')))
+        child.setFragmentParent(view)
+        view.child = renderer(lambda request, tag: child)
+        d = renderLivePage(FragmentWrapper(view))
+        def rendered(ignored):
+            self.assertEqual(hits, [blurb])
+        d.addCallback(rendered)
+        return d
+
+
+
 class AddBlogPostDialogFragmentTests(TestCase):
     """
     Tests for L{AddBlogPostDialogFragment}.
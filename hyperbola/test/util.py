@@ -56,7 +56,7 @@ class HyperbolaTestMixin:
             externalID=u'foo@host', description=u'foo')
 
 
-    def _makeBlurb(self, flavor, title=None, body=None):
+    def _makeBlurb(self, flavor, title=None, body=None, parent=None):
         """
         Make a minimal nonsense blurb with flavor C{flavor}
 
@@ -70,6 +70,9 @@ class HyperbolaTestMixin:
         @param body: the blurb body.  defaults to C{flavor}
         @type body: C{unicode}
 
+        @param parent: the parent blurb.  defaults to C{None}
+        @type parent: L{hyperbola.hyperblurb.Blurb}
+
         @rtype: L{hyperbola.hyperblurb.Blurb}
         """
         if title is None:
@@ -81,6 +84,7 @@ class HyperbolaTestMixin:
             title=title,
             body=body,
             flavor=flavor,
+            parent=parent,
             dateCreated=Time(),
             author=self.role)
 